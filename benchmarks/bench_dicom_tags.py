@@ -0,0 +1,174 @@
+from src.xASL_GUI_DCM2NIFTI import DCM2NIFTI_Converter, get_dicom_value
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from timeit import Timer
+from typing import Callable, Dict, List
+from copy import deepcopy
+import logging
+import pydicom
+
+
+########################################################################################################################
+# PREFACE
+# Micro-benchmark of the per-file cost of retrieving the DICOM parameters that the converter needs beyond those
+# provided by dcm2niix. Synthetic Siemens (classic), Philips (enhanced multi-frame) and GE (classic with private tags)
+# headers are compared between the per-field get_dicom_value lookups and the compiled DicomTagResolver, both in memory
+# and when reading the headers from disk.
+# Example usage:
+#       python -m benchmarks.bench_dicom_tags --repeats 5 --number 2000
+########################################################################################################################
+
+
+def make_siemens_header() -> Dataset:
+    ds = Dataset()
+    ds.SpecificCharacterSet = "ISO_IR 100"
+    ds.Manufacturer = "SIEMENS"
+    ds.AcquisitionTime = "101523.457500"
+    ds.ScanOptions = "FS"
+    ds.AcquisitionMatrix = [64, 0, 0, 64]
+    ds.SoftwareVersions = "syngo MR E11"
+    ds.RescaleSlope = "1"
+    ds.RescaleIntercept = "0"
+    ds.NumberOfSlices = 20
+    ds.SeriesNumber = 7
+    return ds
+
+
+def make_philips_header(n_frames: int = 60) -> Dataset:
+    ds = Dataset()
+    ds.SpecificCharacterSet = "ISO_IR 100"
+    ds.Manufacturer = "Philips Medical Systems"
+    ds.AcquisitionTime = "093012.12"
+    ds.SoftwareVersions = "5.4.1"
+    ds.SeriesNumber = 501
+    ds.add_new((0x2005, 0x0010), "LO", "Philips MR Imaging DD 001")
+    ds.add_new((0x2005, 0x110E), "FL", 2.3e-3)
+    rwv_item = Dataset()
+    rwv_item.RealWorldValueSlope = 3.4
+    ds.RealWorldValueMappingSequence = Sequence([rwv_item])
+    frames = []
+    for _ in range(n_frames):
+        frame = Dataset()
+        transformation = Dataset()
+        transformation.RescaleSlope = "3.4"
+        transformation.RescaleIntercept = "0"
+        frame.PixelValueTransformationSequence = Sequence([transformation])
+        private = Dataset()
+        private.add_new((0x0018, 0x1310), "US", [0, 80, 80, 0])
+        private.add_new((0x2005, 0x100E), "FL", 2.3e-3)
+        private.add_new((0x0018, 0x9025), "CS", "FAT")
+        frame.add_new((0x2005, 0x140F), "SQ", Sequence([private]))
+        frames.append(frame)
+    ds.PerFrameFunctionalGroupsSequence = Sequence(frames)
+    return ds
+
+
+def make_ge_header() -> Dataset:
+    ds = Dataset()
+    ds.SpecificCharacterSet = "ISO_IR 100"
+    ds.Manufacturer = "GE MEDICAL SYSTEMS"
+    ds.AcquisitionTime = "140501"
+    ds.ScanOptions = ["FAST_GEMS", "EDR_GEMS"]
+    ds.AcquisitionMatrix = [0, 128, 128, 0]
+    ds.SoftwareVersions = ["27", "LX", "MR Software release:RX27.0_R02_1831.a"]
+    ds.NumberOfTemporalPositions = 2
+    ds.ImagesInAcquisition = 72
+    ds.SeriesNumber = 4
+    return ds
+
+
+HEADER_FACTORIES: Dict[str, Callable[[], Dataset]] = {"Siemens": make_siemens_header,
+                                                      "Philips": make_philips_header,
+                                                      "GE": make_ge_header}
+
+
+def write_header(ds: Dataset, path: Path):
+    """
+    Writes a synthetic header to disk as a DICOM file, alongside a block of pixel data of a realistic size
+    :param ds: the synthetic header
+    :param path: the filepath to write to
+    """
+    ds = deepcopy(ds)
+    ds.SOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    ds.SOPInstanceUID = generate_uid()
+    ds.Rows, ds.Columns, ds.BitsAllocated, ds.BitsStored, ds.HighBit = 128, 128, 16, 12, 11
+    ds.SamplesPerPixel, ds.PixelRepresentation, ds.PhotometricInterpretation = 1, 0, "MONOCHROME2"
+    ds.PixelData = bytes(128 * 128 * 2)
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.save_as(path, write_like_original=False)
+
+
+def legacy_extract(converter: DCM2NIFTI_Converter, ds: Dataset) -> dict:
+    """
+    The per-field lookups, as performed before the fields were compiled into a single lookup plan
+    """
+    fields = {**converter.tags_dict, **converter.helper_tags_dict}
+    return {key: get_dicom_value(data=ds, tags=value["tags"], default=value["default"],
+                                 for_byte_array=value.get("for_byte_array", None))
+            for key, value in fields.items()}
+
+
+def best_time_per_call(func: Callable, repeats: int, number: int) -> float:
+    return min(Timer(func).repeat(repeat=repeats, number=number)) / number
+
+
+def run_benchmark(repeats: int, number: int) -> List[dict]:
+    """
+    Times the legacy and compiled extraction for each of the synthetic headers
+    :param repeats: the number of timing repeats; the best one is kept
+    :param number: the number of calls per repeat
+    :return: a list of dicts, one per manufacturer, of the timings in microseconds
+    """
+    results = []
+    with TemporaryDirectory() as tmpdir:
+        converter = DCM2NIFTI_Converter(config={"RawDir": tmpdir, "Scan Aliases": {}, "Use Header Index": False},
+                                        name="Benchmark", logger=logging.Logger("Benchmark"),
+                                        handler=logging.NullHandler())
+        for manufacturer, factory in HEADER_FACTORIES.items():
+            ds = factory()
+            dcm_file = Path(tmpdir) / f"{manufacturer}.dcm"
+            write_header(ds, dcm_file)
+
+            # Both approaches must agree before their timings are worth comparing
+            assert legacy_extract(converter, ds) == converter.tag_resolver.resolve(ds), manufacturer
+
+            disk_number = max(number // 20, 1)
+            results.append({
+                "Manufacturer": manufacturer,
+                "Legacy (us)": 1E6 * best_time_per_call(lambda: legacy_extract(converter, ds), repeats, number),
+                "Compiled (us)": 1E6 * best_time_per_call(lambda: converter.tag_resolver.resolve(ds), repeats,
+                                                          number),
+                "Full Read + Legacy (us)": 1E6 * best_time_per_call(
+                    lambda: legacy_extract(converter, pydicom.dcmread(dcm_file)), repeats, disk_number),
+                "Header Read + Compiled (us)": 1E6 * best_time_per_call(
+                    lambda: converter.tag_resolver.resolve(converter.read_dicom_header(dcm_file)), repeats,
+                    disk_number)
+            })
+    return results
+
+
+def main():
+    parser = ArgumentParser(prog="python -m benchmarks.bench_dicom_tags",
+                            description="Micro-benchmark of the per-file cost of extracting DICOM parameters")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of timing repeats; the best one is reported")
+    parser.add_argument("--number", type=int, default=2000, help="Number of in-memory extractions per repeat")
+    args = parser.parse_args()
+
+    results = run_benchmark(repeats=args.repeats, number=args.number)
+    columns = list(results[0].keys())
+    print("  ".join(f"{column:>28}" for column in columns))
+    for row in results:
+        print("  ".join(f"{row[column]:>28.2f}" if isinstance(row[column], float) else f"{row[column]:>28}"
+                        for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+from src.xASL_GUI_DCM2NIFTI import DCM2NIFTI_Converter
+from argparse import ArgumentParser
+from timeit import Timer
+from typing import List, Optional, Tuple
+import numpy as np
+import nibabel as nib
+
+
+########################################################################################################################
+# PREFACE
+# Benchmark and correctness check of DCM2NIFTI_Converter.fix_mosaic, which splits mosaics that dcm2niix failed to
+# reformat into 3D volumes. Synthetic mosaics (square and rectangular, with and without empty tiles) are built from
+# known slices; the slices recovered by fix_mosaic are checked against those, and against the output of the previous
+# tile-by-tile implementation. The latter cannot split rectangular mosaics, which is reported rather than compared.
+# Example usage:
+#       python -m benchmarks.bench_fix_mosaic --repeats 5 --number 50
+########################################################################################################################
+
+# (mosaic rows, mosaic columns, acquisition rows, acquisition columns, number of non-empty slices). Square mosaics
+# are split into square tiles even if the acquisition matrix is not square, rectangular mosaics into tiles of the
+# acquisition matrix. Most cases leave some of the tiles empty; some fill the mosaic entirely.
+MOSAIC_CASES: List[Tuple[int, int, int, int, int]] = [(384, 384, 64, 64, 30),
+                                                      (640, 640, 80, 80, 60),
+                                                      (256, 256, 64, 64, 16),
+                                                      (384, 384, 64, 96, 30),
+                                                      (384, 384, 72, 96, 14),
+                                                      (256, 384, 64, 96, 14),
+                                                      (256, 384, 64, 96, 16),
+                                                      (480, 320, 96, 80, 20),
+                                                      (384, 256, 64, 64, 17)]
+
+
+def get_tile_dims(n_rows: int, n_cols: int, acq_rows: int, acq_cols: int) -> Tuple[int, int]:
+    """
+    :return: the (rows, columns) of the tiles that fix_mosaic splits a mosaic into, given its acquisition matrix
+    """
+    if n_rows == n_cols:
+        return (acq_rows, acq_rows) if n_rows % acq_rows == 0 else (acq_cols, acq_cols)
+    return acq_rows, acq_cols
+
+
+def make_mosaic(n_rows: int, n_cols: int, acq_rows: int, acq_cols: int, n_slices: int,
+                dtype=np.int16) -> Tuple[nib.Nifti1Image, np.ndarray]:
+    """
+    Builds a synthetic mosaic NIFTI out of random slices, padding the remaining tiles with zeros. The slices are the
+    size of the tiles that fix_mosaic is expected to split the mosaic into.
+    :return: the mosaic NIFTI (of shape n_rows x n_cols x 1) and the slices that it was built from, in the order that
+    fix_mosaic is expected to recover them
+    """
+    rng = np.random.default_rng(seed=n_rows * n_cols + n_slices)
+    acq_rows, acq_cols = get_tile_dims(n_rows, n_cols, acq_rows, acq_cols)
+    slices = rng.integers(1, 4096, size=(acq_rows, acq_cols, n_slices)).astype(dtype)
+    n_row_tiles, n_col_tiles = n_rows // acq_rows, n_cols // acq_cols
+    mosaic = np.zeros((n_rows, n_cols), dtype=dtype)
+    # fix_mosaic works on the mosaic rotated by 90 degrees counter-clockwise, such that the tiles are recovered from
+    # the last column of tiles to the first, and from the first row of tiles to the last within each column
+    for slice_idx in range(n_slices):
+        col_tile = n_col_tiles - 1 - slice_idx // n_row_tiles
+        row_tile = slice_idx % n_row_tiles
+        mosaic[row_tile * acq_rows:(row_tile + 1) * acq_rows,
+               col_tile * acq_cols:(col_tile + 1) * acq_cols] = slices[..., slice_idx]
+    return nib.Nifti1Image(mosaic[..., np.newaxis], affine=np.eye(4)), slices
+
+
+def fix_mosaic_loops(mosaic_nifti: nib.Nifti1Image, acq_dims: tuple) -> Optional[np.ndarray]:
+    """
+    The previous tile-by-tile implementation of fix_mosaic, kept unchanged as a reference. Returns the array rather
+    than the NIFTI image.
+    """
+    acq_rows, acq_cols = acq_dims
+    img_shape = mosaic_nifti.shape
+    img_data = np.rot90(np.squeeze(mosaic_nifti.get_fdata()))
+    if img_shape[0] == img_shape[1] and img_shape[0] % acq_rows == 0:
+        nsplits_w, nsplits_h = img_shape[0] / acq_rows, img_shape[0] / acq_rows
+        kernel_w, kernel_h = acq_rows, acq_rows
+    elif img_shape[0] == img_shape[1] and img_shape[0] % acq_cols == 0:
+        nsplits_w, nsplits_h = img_shape[0] / acq_cols, img_shape[0] / acq_cols
+        kernel_w, kernel_h = acq_cols, acq_cols
+    elif all([img_shape[0] != img_shape[1],
+              img_shape[0] % acq_rows == 0,
+              img_shape[1] % acq_cols == 0
+              ]):
+        nsplits_w, nsplits_h = img_shape[0] / acq_rows, img_shape[1] / acq_cols
+        kernel_w, kernel_h = acq_rows, acq_cols
+    else:
+        return
+
+    new_img_data = np.zeros(shape=(kernel_w, kernel_h, int(nsplits_w * nsplits_h)))
+    slice_num = 0
+    for ii in range(int(nsplits_w)):
+        for jj in range(int(nsplits_h)):
+            x_start, x_end = ii * kernel_w, (ii + 1) * kernel_w
+            y_start, y_end = jj * kernel_h, (jj + 1) * kernel_h
+            img_slice = img_data[x_start:x_end, y_start:y_end]
+            if np.nanmax(img_slice) == 0:
+                continue
+            else:
+                new_img_data[:, :, slice_num] = img_slice
+                slice_num += 1
+    return np.rot90(new_img_data[:, :, 0:slice_num], 3)
+
+
+def check_correctness() -> List[str]:
+    """
+    Raises an AssertionError if fix_mosaic does not recover the slices of any of the synthetic mosaics, or if it
+    disagrees with the previous implementation on any mosaic that the latter could split
+    :return: a description of each mosaic that the previous implementation failed to split
+    """
+    previous_failures = []
+    for n_rows, n_cols, acq_rows, acq_cols, n_slices in MOSAIC_CASES:
+        case = f"{n_rows}x{n_cols} mosaic of {acq_rows}x{acq_cols} acquisitions with {n_slices} slices"
+        mosaic_nifti, slices = make_mosaic(n_rows, n_cols, acq_rows, acq_cols, n_slices)
+        fixed = DCM2NIFTI_Converter.fix_mosaic(mosaic_nifti=mosaic_nifti, acq_dims=(acq_rows, acq_cols))
+        assert fixed is not None, f"fix_mosaic could not split the {case}"
+        fixed_data = np.asanyarray(fixed.dataobj)
+        assert fixed_data.dtype == slices.dtype, f"{fixed_data.dtype} != {slices.dtype}"
+        assert np.array_equal(fixed_data, slices), f"Slices were not recovered from the {case}"
+
+        try:
+            previous = fix_mosaic_loops(mosaic_nifti, (acq_rows, acq_cols))
+        except ValueError as previous_err:
+            previous_failures.append(f"{case}: {previous_err}")
+            continue
+        assert previous is not None, f"The previous implementation did not recognize the {case}"
+        assert np.array_equal(fixed_data, previous), f"Disagreement with the previous implementation for the {case}"
+    return previous_failures
+
+
+def main():
+    parser = ArgumentParser(prog="python -m benchmarks.bench_fix_mosaic",
+                            description="Benchmark and correctness check of fix_mosaic")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of timing repeats; the best one is reported")
+    parser.add_argument("--number", type=int, default=50, help="Number of calls per repeat")
+    args = parser.parse_args()
+
+    previous_failures = check_correctness()
+    print("fix_mosaic recovered the slices of all synthetic mosaics and agreed with the previous implementation on "
+          "every mosaic that the latter could split")
+    if len(previous_failures) > 0:
+        print("The previous implementation could not split the following mosaics:\n\t" +
+              "\n\t".join(previous_failures))
+    print()
+
+    print(f"{'Mosaic':>12}  {'Acq':>8}  {'Slices':>6}  {'Previous (ms)':>14}  {'Current (ms)':>14}")
+    for n_rows, n_cols, acq_rows, acq_cols, n_slices in MOSAIC_CASES:
+        mosaic_nifti, _ = make_mosaic(n_rows, n_cols, acq_rows, acq_cols, n_slices)
+        current = min(Timer(lambda: DCM2NIFTI_Converter.fix_mosaic(mosaic_nifti, (acq_rows, acq_cols)))
+                      .repeat(repeat=args.repeats, number=args.number)) / args.number
+        try:
+            previous = min(Timer(lambda: fix_mosaic_loops(mosaic_nifti, (acq_rows, acq_cols)))
+                           .repeat(repeat=args.repeats, number=args.number)) / args.number
+            previous = f"{1E3 * previous:>14.3f}"
+        except ValueError:
+            previous = f"{'failed':>14}"
+        print(f"{f'{n_rows}x{n_cols}':>12}  {f'{acq_rows}x{acq_cols}':>8}  {n_slices:>6}  {previous}  "
+              f"{1E3 * current:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+from src.xASL_GUI_DCM2NIFTI import DCM2NIFTI_Converter
+from src.xASL_utils_DCM2NIIX import DCM2NIIX_Result
+from benchmarks.bench_dicom_tags import make_siemens_header, make_philips_header, make_ge_header
+import src.xASL_GUI_DCM2NIFTI as dcm2nifti_module
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import nibabel as nib
+import logging
+import pydicom
+import json
+import io
+
+
+########################################################################################################################
+# PREFACE
+# Offline benchmark of the import hot path. Synthetic DICOM series are generated with pydicom for each of the
+# scenarios that the converter treats differently, and each DICOM directory is run through
+# DCM2NIFTI_Converter.process_dcm_dir within this process. The throughput (files/sec and MB/sec of DICOM input) and
+# the memory of each conversion stage are then reported. The peak memory within each stage is only measured on Linux,
+# where it can be reset at the start of each stage; elsewhere, only the change in memory over each stage is known.
+# The scenarios are:
+#       - Siemens ASL as mosaics, one DICOM file per volume, which reach the converter as one mosaic NIFTI per volume
+#       - Philips ASL as a single enhanced multi-frame DICOM file, whose values must be rescaled to floating point
+#       - GE 2D-EPI ASL as one DICOM file per slice and volume, which reaches the converter as a single 3D NIFTI
+#       - Siemens structural T1 as one DICOM file per slice
+# By default, dcm2niix is replaced by a stub that writes the NIFTI files and JSON sidecars that the converter expects
+# for each scenario (including the dcm2niix mistakes that the converter corrects), such that the benchmark needs no
+# external program and measures the converter's own stages. Pass --real-dcm2niix to call the bundled dcm2niix.
+# Example usage:
+#       python -m benchmarks.bench_import --subjects 4 --volumes 20
+########################################################################################################################
+
+MR_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.4"
+ENHANCED_MR_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.4.1"
+SCAN_ALIASES = {"ASL4D": "ASL", "T1": "T1"}
+
+
+def add_image_module(ds: Dataset, pixels: np.ndarray, sop_class_uid: str = MR_IMAGE_STORAGE):
+    """
+    Adds the identifying, geometric and pixel elements to a synthetic header, in place
+    :param ds: the synthetic header
+    :param pixels: the uint16 pixel data; either (rows, columns) or (frames, rows, columns)
+    :param sop_class_uid: the SOP class of the file
+    """
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = generate_uid()
+    ds.Modality = "MR"
+    ds.PatientID = ds.get("PatientID", "BENCHMARK")
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [3, 3]
+    ds.SliceThickness = 4
+    ds.Rows, ds.Columns = pixels.shape[-2:]
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.SamplesPerPixel, ds.PixelRepresentation, ds.PhotometricInterpretation = 1, 0, "MONOCHROME2"
+    if pixels.ndim == 3:
+        ds.NumberOfFrames = pixels.shape[0]
+    ds.PixelData = pixels.astype(np.uint16).tobytes()
+
+
+def save_dicom(ds: Dataset, path: Path):
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ds.save_as(path, write_like_original=False)
+
+
+def make_siemens_asl(dcm_dir: Path, rng: np.random.Generator, n_volumes: int, matrix: int = 64, n_slices: int = 30):
+    """
+    One mosaic file per volume, with the slices laid out in a square grid of tiles
+    """
+    n_tiles = int(np.ceil(np.sqrt(n_slices)))
+    series_uid = generate_uid()
+    for vol_idx in range(n_volumes):
+        mosaic = np.zeros((n_tiles * matrix, n_tiles * matrix), dtype=np.uint16)
+        for slice_idx in range(n_slices):
+            row, col = divmod(slice_idx, n_tiles)
+            mosaic[row * matrix:(row + 1) * matrix, col * matrix:(col + 1) * matrix] = \
+                rng.integers(1, 4096, size=(matrix, matrix))
+        ds = make_siemens_header()
+        ds.SeriesInstanceUID = series_uid
+        ds.AcquisitionMatrix = [matrix, 0, 0, matrix]
+        ds.ImageType = ["ORIGINAL", "PRIMARY", "ASL", "NONE", "MOSAIC"]
+        ds.AcquisitionNumber = vol_idx + 1
+        ds.AcquisitionTime = f"1015{vol_idx // 60:02d}.{vol_idx % 60:02d}0000"
+        ds.RepetitionTime, ds.EchoTime = 4000, 14
+        ds.ImagePositionPatient = [0, 0, 0]
+        add_image_module(ds, mosaic)
+        save_dicom(ds, dcm_dir / f"IM_{vol_idx + 1:05d}.dcm")
+
+
+def make_philips_asl(dcm_dir: Path, rng: np.random.Generator, n_volumes: int, matrix: int = 80, n_slices: int = 17):
+    """
+    A single enhanced multi-frame file holding every slice of every volume
+    """
+    n_frames = n_slices * n_volumes
+    ds = make_philips_header(n_frames=n_frames)
+    ds.SeriesInstanceUID = generate_uid()
+    ds.NumberOfTemporalPositions = n_volumes
+    ds.ImageType = ["ORIGINAL", "PRIMARY", "M", "PERFUSION"]
+    ds.RepetitionTime, ds.EchoTime = 4000, 14
+    ds.ImagePositionPatient = [0, 0, 0]
+    add_image_module(ds, rng.integers(1, 4096, size=(n_frames, matrix, matrix)), ENHANCED_MR_IMAGE_STORAGE)
+    save_dicom(ds, dcm_dir / "IM_00001.dcm")
+
+
+def make_ge_asl(dcm_dir: Path, rng: np.random.Generator, n_volumes: int, matrix: int = 64, n_slices: int = 18):
+    """
+    One file per slice and volume
+    """
+    series_uid = generate_uid()
+    for vol_idx in range(n_volumes):
+        for slice_idx in range(n_slices):
+            ds = make_ge_header()
+            ds.SeriesInstanceUID = series_uid
+            ds.AcquisitionMatrix = [0, matrix, matrix, 0]
+            ds.ScanOptions = ["EPI_GEMS", "EDR_GEMS"]
+            ds.ImageType = ["ORIGINAL", "PRIMARY", "ASL"]
+            ds.NumberOfTemporalPositions = n_volumes
+            ds.ImagesInAcquisition = n_slices * n_volumes
+            ds.TemporalPositionIdentifier = vol_idx + 1
+            ds.InstanceNumber = vol_idx * n_slices + slice_idx + 1
+            ds.RepetitionTime, ds.EchoTime = 4000, 11
+            ds.ImagePositionPatient = [0, 0, 4 * slice_idx]
+            add_image_module(ds, rng.integers(1, 4096, size=(matrix, matrix)))
+            save_dicom(ds, dcm_dir / f"IM_{ds.InstanceNumber:05d}.dcm")
+
+
+def make_siemens_t1(dcm_dir: Path, rng: np.random.Generator, _n_volumes: int, matrix: int = 128,
+                    n_slices: int = 96):
+    """
+    One file per slice of a single structural volume
+    """
+    series_uid = generate_uid()
+    for slice_idx in range(n_slices):
+        ds = make_siemens_header()
+        ds.SeriesInstanceUID = series_uid
+        ds.AcquisitionMatrix = [matrix, 0, 0, matrix]
+        ds.ImageType = ["ORIGINAL", "PRIMARY", "M", "NORM"]
+        ds.AcquisitionNumber = 1
+        ds.InstanceNumber = slice_idx + 1
+        ds.RepetitionTime, ds.EchoTime = 2300, 3
+        ds.ImagePositionPatient = [0, 0, slice_idx]
+        add_image_module(ds, rng.integers(1, 1024, size=(matrix, matrix)))
+        save_dicom(ds, dcm_dir / f"IM_{slice_idx + 1:05d}.dcm")
+
+
+# Scenario name: (subject name prefix, scan alias, fixture function)
+SCENARIOS: Dict[str, Tuple[str, str, Callable]] = {"Siemens Mosaic ASL": ("SiemensSub", "ASL", make_siemens_asl),
+                                                   "Philips Enhanced ASL": ("PhilipsSub", "ASL", make_philips_asl),
+                                                   "GE 2D-EPI ASL": ("GESub", "ASL", make_ge_asl),
+                                                   "Siemens T1": ("SiemensSub", "T1", make_siemens_t1)}
+
+
+def make_raw_dataset(raw_dir: Path, n_subjects: int, n_volumes: int, seed: int = 0) -> List[Tuple[str, Path]]:
+    """
+    Generates the synthetic raw directory, structured as Subject/Scan
+    :return: a list of (scenario name, DICOM directory) pairs
+    """
+    rng = np.random.default_rng(seed)
+    dcm_dirs = []
+    for sub_idx in range(n_subjects):
+        for scenario, (subject_prefix, scan_alias, fixture_func) in SCENARIOS.items():
+            dcm_dir = raw_dir / f"{subject_prefix}{sub_idx + 1:03d}" / scan_alias
+            fixture_func(dcm_dir, rng, n_volumes)
+            dcm_dirs.append((scenario, dcm_dir))
+    return dcm_dirs
+
+
+def stub_dcm2niix(dcm_dir: Path, output_dir: Path, filename_format: str, on_line=None) -> DCM2NIIX_Result:
+    """
+    Stand-in for dcm2niix. Files are grouped into one NIFTI per acquisition, as dcm2niix does for these series when it
+    is unable to interpret the vendor-private headers; mosaics remain mosaics and GE 2D-EPI volumes are stacked into
+    a single 3D NIFTI. Enhanced multi-frame files with several temporal positions become 4D NIFTIs.
+    """
+    start = perf_counter()
+    groups: Dict[tuple, List[Dataset]] = defaultdict(list)
+    for dcm_file in sorted(Path(dcm_dir).iterdir()):
+        ds = pydicom.dcmread(dcm_file)
+        groups[(int(ds.SeriesNumber), int(ds.get("AcquisitionNumber", 1)))].append(ds)
+
+    for (series_number, acq_number), datasets in groups.items():
+        first = datasets[0]
+        # Pixel arrays are (rows, columns) or (frames, rows, columns); NIFTI arrays are (columns, rows, slices)
+        slices = [ds.pixel_array.T if ds.pixel_array.ndim == 2 else ds.pixel_array.transpose(2, 1, 0)
+                  for ds in sorted(datasets, key=lambda ds: int(ds.get("InstanceNumber", 0)))]
+        data = np.dstack(slices)
+        n_temporal = int(first.get("NumberOfTemporalPositions", 1))
+        if "NumberOfFrames" in first and n_temporal > 1:
+            data = data.reshape(data.shape[0], data.shape[1], -1, n_temporal, order="F")
+        affine = np.diag([float(first.PixelSpacing[0]), float(first.PixelSpacing[1]), float(first.SliceThickness), 1])
+
+        basename = filename_format.replace("%s", str(series_number)) + ("" if acq_number == 1 else f"_a{acq_number}")
+        nib.save(nib.Nifti1Image(data.astype(np.int16), affine), Path(output_dir) / f"{basename}.nii")
+        sidecar = {"Manufacturer": str(first.Manufacturer).split()[0].capitalize(),
+                   "SeriesNumber": series_number,
+                   "AcquisitionNumber": acq_number,
+                   "AcquisitionTime": str(first.AcquisitionTime),
+                   "RepetitionTime": float(first.RepetitionTime) / 1000,
+                   "EchoTime": float(first.EchoTime) / 1000,
+                   "ImageType": list(first.ImageType),
+                   "ScanOptions": "_".join(first.get("ScanOptions", []))}
+        if sidecar["Manufacturer"] == "Philips":
+            sidecar.update({"PhilipsRescaleSlope": 3.4, "PhilipsRescaleIntercept": 0, "PhilipsScaleSlope": 2.3e-3,
+                            "UsePhilipsFloatNotDisplayScaling": 0})
+        with open(Path(output_dir) / f"{basename}.json", "w") as sidecar_writer:
+            json.dump(sidecar, sidecar_writer, indent=3)
+
+    return DCM2NIIX_Result(return_code=0, output="", elapsed=perf_counter() - start, waited=0.0)
+
+
+def get_dir_size(dcm_dir: Path) -> Tuple[int, float]:
+    """
+    :return: the number of files and their total size in megabytes
+    """
+    sizes = [dcm_file.stat().st_size for dcm_file in dcm_dir.iterdir() if dcm_file.is_file()]
+    return len(sizes), sum(sizes) / 1024 ** 2
+
+
+def run_benchmark(n_subjects: int, n_volumes: int, real_dcm2niix: bool, seed: int = 0) -> Tuple[List[dict], int]:
+    """
+    Generates the synthetic dataset and converts each of its DICOM directories
+    :return: the per-stage timing records of every DICOM directory, each extended with its scenario, number of files
+    and megabytes, alongside the number of DICOM directories that failed to convert
+    """
+    records, n_failed = [], 0
+    with TemporaryDirectory() as tmpdir:
+        raw_dir = Path(tmpdir) / "raw"
+        gen_start = perf_counter()
+        dcm_dirs = make_raw_dataset(raw_dir, n_subjects=n_subjects, n_volumes=n_volumes, seed=seed)
+        print(f"Generated {len(dcm_dirs)} synthetic DICOM directories in {perf_counter() - gen_start:.1f} seconds\n")
+
+        config = {"RawDir": str(raw_dir), "Directory Structure": ["Subject", "Scan"], "Scan Aliases": SCAN_ALIASES,
+                  "Ordered Run Aliases": {}, "Use Header Index": False}
+        converter = DCM2NIFTI_Converter(config=config, name="Benchmark", logger=logging.Logger("Benchmark"),
+                                        handler=logging.NullHandler())
+        original_run_dcm2niix = dcm2nifti_module.run_dcm2niix
+        if not real_dcm2niix:
+            dcm2nifti_module.run_dcm2niix = stub_dcm2niix
+        try:
+            for scenario, dcm_dir in dcm_dirs:
+                n_files, megabytes = get_dir_size(dcm_dir)
+                # The converter prints its progress; only the benchmark's own output is of interest here
+                with redirect_stdout(io.StringIO()):
+                    success, _ = converter.process_dcm_dir(dcm_dir)
+                n_failed += int(not success)
+                records.extend({**timing, "scenario": scenario, "n_files": n_files, "megabytes": megabytes}
+                               for timing in converter.stage_timings)
+        finally:
+            dcm2nifti_module.run_dcm2niix = original_run_dcm2niix
+    return records, n_failed
+
+
+def summarize(records: List[dict], group_key: Optional[str] = None) -> List[dict]:
+    """
+    Aggregates the timing records per stage (and optionally per scenario as well)
+    :return: a list of dicts of the throughput and memory of each stage
+    """
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    for record in records:
+        groups[(record[group_key] if group_key else "All", record["stage"])].append(record)
+
+    rows = []
+    for (group, stage), stage_records in groups.items():
+        seconds = sum(record["seconds"] for record in stage_records)
+        n_files = sum(record["n_files"] for record in stage_records)
+        megabytes = sum(record["megabytes"] for record in stage_records)
+        # The peak memory within the stage, and how far above the memory at the start of the stage it went
+        peaks = [record["stage_peak_rss_mb"] for record in stage_records if record["stage_peak_rss_mb"] is not None]
+        peak_increases = [record["stage_peak_rss_mb"] - record["rss_start_mb"] for record in stage_records
+                          if record["stage_peak_rss_mb"] is not None]
+        rows.append({"Group": group, "Stage": stage, "Seconds": seconds,
+                     "Files/sec": n_files / seconds if seconds > 0 else float("inf"),
+                     "MB/sec": megabytes / seconds if seconds > 0 else float("inf"),
+                     "Stage Peak RSS (MB)": max(peaks) if len(peaks) > 0 else "n/a",
+                     "Peak Above Start (MB)": max(peak_increases) if len(peak_increases) > 0 else "n/a",
+                     "RSS Change (MB)": max(record["rss_end_mb"] - record["rss_start_mb"]
+                                            for record in stage_records)})
+    return rows
+
+
+def print_rows(rows: List[dict]):
+    columns = list(rows[0].keys())
+    widths = {column: max(len(column), *(len(f"{row[column]:.2f}" if isinstance(row[column], float)
+                                             else str(row[column])) for row in rows)) for column in columns}
+    print("  ".join(f"{column:>{widths[column]}}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{row[column]:>{widths[column]}.2f}" if isinstance(row[column], float)
+                        else f"{row[column]:>{widths[column]}}" for column in columns))
+    print()
+
+
+def main():
+    parser = ArgumentParser(prog="python -m benchmarks.bench_import",
+                            description="Offline benchmark of the conversion stages on synthetic DICOM series")
+    parser.add_argument("--subjects", type=int, default=2, help="Number of subjects generated per scenario")
+    parser.add_argument("--volumes", type=int, default=10, help="Number of volumes in each ASL series")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random pixel data")
+    parser.add_argument("--real-dcm2niix", action="store_true",
+                        help="Call the bundled dcm2niix rather than the stub")
+    parser.add_argument("--by-scenario", action="store_true",
+                        help="Additionally report the stages of each scenario separately")
+    args = parser.parse_args()
+
+    records, n_failed = run_benchmark(n_subjects=args.subjects, n_volumes=args.volumes,
+                                      real_dcm2niix=args.real_dcm2niix, seed=args.seed)
+    n_dirs = len({record["dcm_dir"] for record in records})
+    print(f"Converted {n_dirs - n_failed} of {n_dirs} DICOM directories "
+          f"({'bundled dcm2niix' if args.real_dcm2niix else 'stub dcm2niix'})\n")
+    print_rows(summarize(records))
+    if args.by_scenario:
+        print_rows(summarize(records, group_key="scenario"))
+    if n_failed > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
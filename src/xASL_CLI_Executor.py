@@ -0,0 +1,360 @@
+from src.xASL_GUI_Executor_ancillary import (calculate_anticipated_workload, calculate_missing_STATUS,
+                                             interpret_statusfile_errors)
+from src.xASL_utils_ExploreASL import (RUN_OPTION_MODULES, StudyPreparationError, ExploreASLOutputParser,
+                                       count_remaining_work, load_study_parms, check_matlab_version, prepare_worker_env,
+                                       get_worker_command, start_worker_process, monitor_worker_process, kill_proc_tree,
+                                       remove_locked_dirs, merge_worker_logs)
+from src.xASL_utils_CoreScheduler import CoreScheduler, WorkerLaunch
+from src.xASL_utils_StatusIndex import get_status_index
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from contextlib import redirect_stdout
+from argparse import ArgumentParser
+from itertools import chain
+from functools import partial
+from threading import Event, Thread
+from queue import Queue, Empty
+from pathlib import Path
+from shutil import which
+from time import time
+from typing import List, Optional
+import logging
+import psutil
+import json
+import sys
+
+
+########################################################################################################################
+# PREFACE
+# This module is the headless (no Qt) entry point for running ExploreASL on one or more studies. Each study is
+# validated, has its anticipated workload calculated and is processed by its ExploreASL workers exactly as it would be
+# from the Executor window, since both use xASL_utils_ExploreASL and xASL_GUI_Executor_ancillary. The STATUS files
+# created by ExploreASL are watched for in order to report progress, which is printed to stdout as JSON lines;
+# human-readable messages go to stderr.
+# Example usage:
+#       python -m src.xASL_CLI_Executor /home/jsmith/MyStudy/analysis --modules Both --cores 4
+#       python -m src.xASL_CLI_Executor /home/jsmith/BigStudy/analysis /home/jsmith/SmallStudy/analysis --cores 6 2 \
+#           --total-cores 8
+########################################################################################################################
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def emit_progress(event: str, **kwargs):
+    """
+    Prints a single machine-readable progress record as a line of JSON to stdout
+    :param event: the name of the event (i.e. "start", "status", "worker_finished", "finished", "error")
+    :param kwargs: additional fields of the record
+    """
+    print(json.dumps({"event": event, **kwargs}), file=sys.__stdout__, flush=True)
+
+
+class StatusEventQueueHandler(FileSystemEventHandler):
+    """
+    Hands the files created within the watched lock dirs over to the main thread through a queue
+    """
+
+    def __init__(self, events: Queue):
+        super().__init__()
+        self.events = events
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.events.put(("created", event.src_path))
+
+
+def prepare_study(study_dir: Path, run_option: str, n_cores: int, matlab_ver: Optional[str],
+                  matlab_cmd: Optional[str], translators: dict) -> dict:
+    """
+    Performs the same pre-run checks and preparations for a study as the Executor window does
+    :param study_dir: the analysis directory of the study
+    :param run_option: "Structural", "ASL", "Both" or "Population"; which modules to run
+    :param n_cores: the number of ExploreASL workers to start the study with, if that many cores are available
+    :param matlab_ver: the MATLAB version (i.e. "R2019a"); only needed for uncompiled ExploreASL
+    :param matlab_cmd: the path to the MATLAB command; only needed for uncompiled ExploreASL
+    :param translators: the contents of JSON_LOGIC/ExecutorTranslators.json
+    :return: the description of the study's run
+    """
+    ana_path = study_dir.expanduser().resolve()
+    parms = load_study_parms(ana_path)
+    if parms["EXPLOREASL_TYPE"] == "LOCAL_UNCOMPILED":
+        parms["WORKER_MATLAB_VER"] = check_matlab_version(matlab_ver, matlab_cmd)
+        parms["WORKER_MATLAB_CMD_PATH"] = matlab_cmd
+    worker_env = prepare_worker_env(parms, ana_path)
+
+    workload, expected_status_files = calculate_anticipated_workload(parmsdict=parms, run_options=run_option,
+                                                                     translators=translators)
+    remove_locked_dirs(ana_path)
+    if not workload or len(expected_status_files) == 0:
+        raise StudyPreparationError("NoWorkloadDetected", [str(ana_path)])
+
+    # The STATUS files still to be created, by the lock dir in which they will appear
+    pending = {}
+    for status_file in expected_status_files:
+        pending.setdefault(str(status_file.parent), set()).add(status_file.name)
+    return {"dir": ana_path, "parms": parms, "env": worker_env, "n_cores": n_cores,
+            "imodules": RUN_OPTION_MODULES[run_option], "workload": workload, "completed": 0,
+            "expected": expected_status_files, "pending": pending, "status_index": get_status_index(ana_path, True),
+            "terminated": False, "easl_errors": False, "crashed": False}
+
+
+def follow_worker(study_idx: int, study: dict, launch: WorkerLaunch, events: Queue, stop_event: Event,
+                  procs: List[psutil.Popen]):
+    """
+    Runs a single ExploreASL worker of a study to completion, logging its output to a temporary worker log just like
+    the workers of the Executor window. Errors and the end of the worker, however it ends, are reported through the
+    events queue.
+    """
+    parms, iworker = study["parms"], launch.ilog
+    logger = logging.Logger(name=parms.get("name", "Unspecified Study Name"), level=logging.DEBUG)
+    handler, proc = None, None
+    try:
+        handler = logging.FileHandler(filename=study["dir"] / f"tmp_RunWorker_{str(launch.ilog).zfill(3)}.log",
+                                      mode='w')
+        handler.setFormatter(logging.Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s\n%(message)s"))
+        handler.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        command = get_worker_command(parms, launch.iworker, launch.nworkers, list(launch.imodules))
+        logger.info(f"Worker {iworker}: Preparing subprocess with the following commands:\n"
+                    f"{command if isinstance(command, str) else ' '.join(command)}")
+        proc = start_worker_process(command, study["env"])
+        procs.append(proc)
+        parser = ExploreASLOutputParser()
+
+        def on_error(err_msg: str):
+            logger.error(f"Worker {iworker} detected the following Error message from ExploreASL:\n{err_msg}")
+            events.put(("easl_error", study_idx, iworker, err_msg))
+
+        stderr = monitor_worker_process(proc, logger, parser, on_error=on_error, should_stop=stop_event.is_set)
+        logger.info(f"Worker {iworker}: has received return code {proc.returncode}")
+        if proc.returncode != 0 and not stop_event.is_set():
+            logger.error(f"Worker {iworker}: Has recovered the following crash report:\n{stderr}")
+        events.put(("worker_finished", study_idx, iworker, proc.returncode, parser.has_easl_errors))
+    except Exception as worker_err:
+        # Any failure must still report the end of the worker, otherwise its cores are never released
+        logger.error(f"Worker {iworker}: Could not be run to completion:\n{worker_err!r}")
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+        events.put(("worker_finished", study_idx, iworker, None, False))
+    finally:
+        if handler is not None:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def run_cli_executor(studies: List[dict], translators: dict, total_cores: int) -> int:
+    """
+    Runs ExploreASL on the prepared studies, reports progress as STATUS files are created and performs the same
+    post-run steps as the Executor window. Workers are launched by a core scheduler, such that the cores freed by one
+    study are handed to the studies that still have work remaining.
+    :param studies: the studies, as prepared by prepare_study, in order of priority
+    :param translators: the contents of JSON_LOGIC/ExecutorTranslators.json
+    :param total_cores: the maximum number of workers that may be running at any time across all studies
+    :return: the exit code; 0 if every study completed all anticipated steps without errors, 1 otherwise, or 2 if the
+    studies could not be run at all
+    """
+    workload_translator: dict = translators["ExploreASL_Filename2Workload"]
+    events: Queue = Queue()
+    stop_event = Event()
+    procs: List[psutil.Popen] = []
+    start_time = time()
+
+    # A single recursive watch is placed on the lock dir of each study, as every watch costs the observer a thread and,
+    # on Linux, an inotify instance. Only the events within the lock dirs in which STATUS files are anticipated to
+    # appear are of interest; the remainder of the lock tree is disregarded
+    lockdir2study = {lock_dir: study_idx for study_idx, study in enumerate(studies) for lock_dir in study["pending"]}
+    observer = Observer()
+    handler = StatusEventQueueHandler(events)
+    try:
+        for study in studies:
+            (study["dir"] / "lock").mkdir(exist_ok=True)
+            observer.schedule(handler, str(study["dir"] / "lock"), recursive=True)
+        observer.start()
+    except OSError as watch_err:
+        observer.stop()
+        emit_progress("error", message=f"The lock dirs of the studies could not be watched: {watch_err}")
+        return 2
+
+    def handle_created(created_path: str):
+        created_path = Path(created_path)
+        study_idx = lockdir2study.get(str(created_path.parent))
+        if study_idx is None or created_path.suffix != ".status":
+            return
+        study = studies[study_idx]
+        study["status_index"].add(created_path)
+        pending = study["pending"][str(created_path.parent)]
+        if created_path.name not in pending:
+            return
+        pending.discard(created_path.name)
+        study["completed"] += workload_translator.get(created_path.name, 0)
+        emit_progress("status", study=str(study["dir"]), status_file=str(created_path),
+                      completed=study["completed"], workload=study["workload"], elapsed=round(time() - start_time, 3))
+
+    scheduler = CoreScheduler(total_cores=total_cores)
+    key2study = {}
+    for study_idx, study in enumerate(studies):
+        key2study[str(study["dir"])] = study_idx
+        scheduler.add_study(str(study["dir"]), n_cores=study["n_cores"],
+                            remaining_work=partial(count_remaining_work, study["pending"], study["imodules"]))
+        emit_progress("start", study=str(study["dir"]), n_cores=study["n_cores"], modules=study["imodules"],
+                      workload=study["workload"], n_expected_status_files=len(study["expected"]))
+
+    threads = []
+
+    def launch_scheduled_workers():
+        for launch in scheduler.schedule():
+            study_idx = key2study[launch.study_key]
+            thread = Thread(target=follow_worker, daemon=True,
+                            args=(study_idx, studies[study_idx], launch, events, stop_event, procs))
+            threads.append(thread)
+            thread.start()
+            emit_progress("worker_started", study=launch.study_key, worker=launch.ilog, iworker=launch.iworker,
+                          nworkers=launch.nworkers, modules=list(launch.imodules),
+                          elapsed=round(time() - start_time, 3))
+
+    launch_scheduled_workers()
+    try:
+        while not scheduler.is_finished:
+            try:
+                event = events.get(timeout=1)
+            except Empty:
+                continue
+            if event[0] == "created":
+                handle_created(event[1])
+                # Progress may allow idle cores to be handed to the study with the most remaining work
+                launch_scheduled_workers()
+            elif event[0] == "easl_error":
+                _, study_idx, iworker, err_msg = event
+                studies[study_idx]["easl_errors"] = True
+                emit_progress("easl_error", study=str(studies[study_idx]["dir"]), worker=iworker, message=err_msg)
+            elif event[0] == "worker_finished":
+                _, study_idx, iworker, returncode, had_easl_errors = event
+                scheduler.release(str(studies[study_idx]["dir"]))
+                launch_scheduled_workers()
+                has_crashed = returncode != 0 and not stop_event.is_set()
+                studies[study_idx]["crashed"] |= has_crashed
+                emit_progress("worker_finished", study=str(studies[study_idx]["dir"]), worker=iworker,
+                              returncode=returncode, had_easl_errors=had_easl_errors, crashed=has_crashed,
+                              elapsed=round(time() - start_time, 3))
+    except KeyboardInterrupt:
+        stop_event.set()
+        for study in studies:
+            scheduler.cancel(str(study["dir"]))
+        for proc in list(procs):
+            try:
+                kill_proc_tree(pid=proc.pid, include_parent=True, timeout=10)
+            except psutil.NoSuchProcess:
+                pass
+        for thread in threads:
+            thread.join(timeout=10)
+        for study in studies:
+            study["terminated"] = True
+        emit_progress("terminated", elapsed=round(time() - start_time, 3))
+
+    # STATUS files created just before the workers exited may still be on their way
+    observer.stop()
+    observer.join()
+    while not events.empty():
+        event = events.get_nowait()
+        if event[0] == "created":
+            handle_created(event[1])
+
+    # Post-run steps
+    all_ok = True
+    for study in studies:
+        # Events may have been missed (i.e. not yet delivered when the observer stopped); the index is brought up to
+        # date with the lock tree before it is relied upon
+        study["status_index"].refresh()
+        is_complete, incomplete_files = calculate_missing_STATUS(study["dir"], study["expected"],
+                                                                 status_index=study["status_index"])
+        study["status_index"].save()
+        messages = []
+        if not is_complete:
+            interpreted = interpret_statusfile_errors(study["dir"], incomplete_files, translators)
+            messages = list(chain(*interpreted)) if interpreted is not None else []
+            for module_msg in messages:
+                print(module_msg)
+        log_path = merge_worker_logs(study["dir"])
+        all_ok &= is_complete and not any([study["terminated"], study["easl_errors"], study["crashed"]])
+        emit_progress("finished", study=str(study["dir"]), complete=is_complete, n_missing=len(incomplete_files),
+                      terminated=study["terminated"], had_easl_errors=study["easl_errors"], crashed=study["crashed"],
+                      messages=messages, log=str(log_path) if log_path is not None else None,
+                      elapsed=round(time() - start_time, 3))
+    return 0 if all_ok else 1
+
+
+def load_matlab_config() -> dict:
+    """
+    :return: the MATLAB version and command path known to the GUI's master configuration, if it exists
+    """
+    try:
+        with open(PROJECT_DIR / "JSON_LOGIC" / "ExploreASL_GUI_masterconfig.json") as master_config_reader:
+            master_config: dict = json.load(master_config_reader)
+    except (OSError, ValueError):
+        master_config = {}
+    return {"MATLAB_VER": master_config.get("MATLAB_VER", None),
+            "MATLAB_CMD_PATH": master_config.get("MATLAB_CMD_PATH", which("matlab"))}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(prog="python -m src.xASL_CLI_Executor",
+                            description="Run ExploreASL on one or more studies without the GUI, using the same checks "
+                                        "and worker setup as the Executor.")
+    parser.add_argument("studies", nargs="+", type=Path,
+                        help="The analysis directories of the studies to run, each containing a DataPar.json file")
+    parser.add_argument("--modules", choices=list(RUN_OPTION_MODULES), default="Both",
+                        help="Which ExploreASL modules to run. Defaults to Both (Structural and ASL).")
+    parser.add_argument("--cores", type=int, nargs="+", default=[1],
+                        help="Number of ExploreASL workers each study starts with. Either a single number for all "
+                             "studies or one number per study, in the same order as the studies. Defaults to 1.")
+    parser.add_argument("--total-cores", type=int, default=None,
+                        help="Maximum number of ExploreASL workers running at once across all studies. Studies are "
+                             "started in the order given; cores freed by one study are handed to the studies that "
+                             "still have subjects to process. Defaults to the sum of --cores.")
+    matlab_config = load_matlab_config()
+    parser.add_argument("--matlab-ver", default=matlab_config["MATLAB_VER"],
+                        help="The MATLAB version (i.e. R2019a) used for uncompiled ExploreASL. Defaults to the one "
+                             "known to the GUI.")
+    parser.add_argument("--matlab-cmd", default=matlab_config["MATLAB_CMD_PATH"],
+                        help="The path to the MATLAB command used for uncompiled ExploreASL. Defaults to the one known "
+                             "to the GUI, or the matlab command on the PATH.")
+    args = parser.parse_args(argv)
+
+    if len(args.cores) not in {1, len(args.studies)}:
+        emit_progress("error", message=f"--cores must be given either once or once per study ({len(args.studies)})")
+        return 2
+    if any(n_cores < 1 for n_cores in args.cores):
+        emit_progress("error", message="--cores must be at least 1")
+        return 2
+    cores = args.cores * len(args.studies) if len(args.cores) == 1 else args.cores
+    total_cores = sum(cores) if args.total_cores is None else args.total_cores
+    if total_cores < 1:
+        emit_progress("error", message="--total-cores must be at least 1")
+        return 2
+
+    try:
+        with open(PROJECT_DIR / "JSON_LOGIC" / "ExecutorTranslators.json") as translator_reader:
+            translators = json.load(translator_reader)
+        with open(PROJECT_DIR / "JSON_LOGIC" / "ErrorsListing.json") as exec_err_reader:
+            exec_errs = json.load(exec_err_reader)
+    except (OSError, ValueError) as json_err:
+        emit_progress("error", message=str(json_err))
+        return 2
+
+    # ExploreASL output and interpreted messages are human-readable; keep them off of stdout so that it remains
+    # machine-readable
+    with redirect_stdout(sys.stderr):
+        studies = []
+        for study_dir, n_cores in zip(args.studies, cores):
+            try:
+                studies.append(prepare_study(study_dir, args.modules, n_cores, args.matlab_ver, args.matlab_cmd,
+                                             translators))
+            except StudyPreparationError as prep_err:
+                emit_progress("error", study=str(study_dir), error=prep_err.err_key,
+                              message=prep_err.format(exec_errs))
+                return 2
+        return run_cli_executor(studies, translators, total_cores)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+from src.xASL_GUI_DCM2NIFTI import (iter_dicom_directories, create_import_summary, write_import_log,
+                                    write_failed_imports, bids_import_followup, create_timing_summary)
+from src.xASL_utils_ImportEngine import DCM2NIFTI_ImportEngine, get_default_nworkers
+from src.xASL_utils_ImportSummary import ImportSummaryAccumulator
+from more_itertools import collapse
+from contextlib import redirect_stdout
+from argparse import ArgumentParser
+from pathlib import Path
+from time import time
+from typing import Iterator, List
+import json
+import sys
+
+
+########################################################################################################################
+# PREFACE
+# This module is the headless (no Qt) entry point for converting DICOM directories into NIFTI format. It reads the
+# ImportConfig.json file that the Importer window writes to the raw directory and runs the same conversion pipeline on
+# a pool of processes. Progress is printed to stdout as JSON lines; human-readable conversion messages go to stderr.
+# Example usage:
+#       python -m src.xASL_CLI_Importer --config /home/jsmith/MyStudy/raw/ImportConfig.json --workers 8
+########################################################################################################################
+
+
+def emit_progress(event: str, **kwargs):
+    """
+    Prints a single machine-readable progress record as a line of JSON to stdout
+    :param event: the name of the event (i.e. "start", "progress", "finished", "error")
+    :param kwargs: additional fields of the record
+    """
+    print(json.dumps({"event": event, **kwargs}), file=sys.__stdout__, flush=True)
+
+
+def load_import_config(config_path: Path) -> dict:
+    """
+    Loads and sanity-checks the ImportConfig.json file
+    :param config_path: the path to the ImportConfig.json file
+    :return: the import configuration
+    """
+    with open(config_path) as config_reader:
+        config: dict = json.load(config_reader)
+    missing = [key for key in ["RawDir", "Directory Structure", "Scan Aliases", "Ordered Run Aliases"]
+               if key not in config]
+    if len(missing) > 0:
+        raise KeyError(f"The import configuration is missing the following keys: {missing}")
+    if any(["Subject" not in config["Directory Structure"], "Scan" not in config["Directory Structure"]]):
+        raise ValueError("The import configuration's Directory Structure must contain both Subject and Scan")
+    if not Path(config["RawDir"]).is_dir():
+        raise FileNotFoundError(f"The raw directory {config['RawDir']} does not exist")
+    return config
+
+
+def run_cli_import(config: dict, n_workers: int, use_legacy_mode: bool, n_dcm2niix: int = None,
+                   resume: bool = False) -> int:
+    """
+    Runs the import described by the import configuration and performs the same post-import steps as the Importer
+    :param config: the import configuration
+    :param n_workers: the number of processes to convert with
+    :param use_legacy_mode: whether the legacy (non-BIDS) import should be used
+    :param n_dcm2niix: the maximum number of dcm2niix processes that may run at once
+    :param resume: whether DICOM directories already converted by a previous import should be skipped
+    :return: the exit code; 0 if all DICOM directories were converted, 1 otherwise
+    """
+    # DICOM directories are discovered while the first ones are already being converted; the total is only known once
+    # discovery has finished
+    dcm_dirs: List[Path] = []
+    discovery = {"finished": False}
+
+    def discover() -> Iterator[Path]:
+        for dcm_dir in collapse(iter_dicom_directories(config=config)):
+            dcm_dirs.append(dcm_dir)
+            yield dcm_dir
+        discovery["finished"] = True
+        emit_progress("discovered", n_dirs=len(dcm_dirs))
+
+    engine = DCM2NIFTI_ImportEngine(config=config, use_legacy_mode=use_legacy_mode, n_workers=n_workers,
+                                    stdout_to_stderr=True, n_dcm2niix=n_dcm2niix, resume=resume)
+    emit_progress("start", raw_dir=config["RawDir"], n_workers=engine.n_workers, n_dcm2niix=engine.n_dcm2niix,
+                  resume=resume)
+
+    import_summaries = ImportSummaryAccumulator()
+    failed_runs, logs, timings = [], [], []
+    n_completed, start_time = 0, time()
+    try:
+        for result in engine.run(discover()):
+            n_completed += 1
+            logs.append(result["log"])
+            timings.extend(result["timings"])
+            if result["success"]:
+                import_summaries.append(result["summary"])
+            else:
+                failed_runs.append(result["description"])
+            emit_progress("progress", completed=n_completed, total=len(dcm_dirs) if discovery["finished"] else None,
+                          discovered=len(dcm_dirs), dcm_dir=result["dcm_dir"],
+                          success=result["success"], skipped=result.get("skipped", False),
+                          elapsed=round(time() - start_time, 3))
+    except KeyboardInterrupt:
+        engine.stop()
+        emit_progress("terminated", completed=n_completed, total=len(dcm_dirs))
+        return 1
+
+    # Post-import steps
+    analysis_dir = Path(config["RawDir"]).parent / "analysis"
+    if not analysis_dir.exists():
+        emit_progress("error", message=f"The study directory {analysis_dir} was never created")
+        return 1
+    log_path = write_import_log(analysis_dir=analysis_dir, logs=logs)
+    with redirect_stdout(sys.stderr):
+        create_import_summary(import_summaries=import_summaries, config=config)
+        print(create_timing_summary(timings=timings, analysis_dir=analysis_dir))
+    if not use_legacy_mode:
+        bids_import_followup(analysis_dir=analysis_dir)
+    if len(failed_runs) > 0:
+        write_failed_imports(analysis_dir=analysis_dir, failed_runs=failed_runs)
+
+    emit_progress("finished", completed=n_completed, total=len(dcm_dirs), n_failed=len(failed_runs),
+                  analysis_dir=str(analysis_dir), log=str(log_path), elapsed=round(time() - start_time, 3))
+    return 0 if len(failed_runs) == 0 else 1
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(prog="python -m src.xASL_CLI_Importer",
+                            description="Convert a DICOM dataset to NIFTI format without the GUI, using the "
+                                        "ImportConfig.json file written by the Importer.")
+    parser.add_argument("--config", required=True, type=Path,
+                        help="Path to the ImportConfig.json file describing the raw directory structure")
+    parser.add_argument("--workers", type=int, default=get_default_nworkers(),
+                        help="Number of processes to convert with. Defaults to the number of physical cores.")
+    parser.add_argument("--dcm2niix-procs", type=int, default=None,
+                        help="Maximum number of dcm2niix processes that may run at once, regardless of the number of "
+                             "workers. Defaults to the number of physical cores.")
+    parser.add_argument("--bids", action="store_true",
+                        help="Use the BIDS import rather than the legacy import")
+    parser.add_argument("--header-samples", type=int, default=None,
+                        help="Number of DICOM headers per directory to read and compare for consistency. Defaults to "
+                             "the \"Header Samples\" value of the import configuration, or 1 if it is not present.")
+    parser.add_argument("--direct", action="store_true",
+                        help="Move the NIFTIs produced by dcm2niix into place as-is when they need no changes, rather "
+                             "than re-saving them")
+    parser.add_argument("--scratch-dir", type=Path, default=None,
+                        help="Directory (i.e. on a fast local disk) in which dcm2niix output is kept until it is "
+                             "processed. Defaults to a TEMP directory alongside the final output.")
+    parser.add_argument("--parquet", action="store_true",
+                        help="Also write the import summary as a Parquet file (requires pyarrow or fastparquet)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip DICOM directories that a previous import already converted with the same DICOM "
+                             "files and settings, as recorded in the analysis directory's Import_Manifest.jsonl")
+    parser.add_argument("--no-header-index", action="store_true",
+                        help="Do not read from or write to the DICOM header index kept within the raw directory")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_import_config(args.config.resolve())
+    except (OSError, KeyError, ValueError, json.JSONDecodeError) as config_err:
+        emit_progress("error", message=str(config_err))
+        return 2
+    if args.header_samples is not None:
+        config["Header Samples"] = max(args.header_samples, 1)
+    if args.no_header_index:
+        config["Use Header Index"] = False
+    if args.parquet:
+        config["Summary Parquet"] = True
+    if args.direct:
+        config["Direct Conversion"] = True
+    if args.scratch_dir is not None:
+        config["Scratch Dir"] = str(args.scratch_dir.resolve())
+
+    # Conversion messages are human-readable; keep them off of stdout so that it remains machine-readable
+    with redirect_stdout(sys.stderr):
+        return run_cli_import(config=config, n_workers=args.workers, use_legacy_mode=not args.bids,
+                              n_dcm2niix=args.dcm2niix_procs, resume=args.resume)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,50 +1,123 @@
 import numpy as np
 import shutil
-import subprocess
 import nibabel as nib
 import pydicom
 from pydicom.errors import InvalidDicomError
 from pydicom.multival import MultiValue
+from src.xASL_utils_HeaderIndex import DicomHeaderIndex, to_index_value
+from src.xASL_utils_DCM2NIIX import run_dcm2niix, get_dcm2niix_path
+from src.xASL_utils_ImportSummary import ImportSummaryAccumulator, write_import_summary
+from src.xASL_utils_Sidecars import get_imported_sidecars, pair_asl_m0_sidecars, rewrite_json_sidecars
 import json
 import pandas as pd
 from more_itertools import peekable, sort_together
 import struct
 import logging
+import sqlite3
 from ast import literal_eval
 from nilearn import image
 from platform import system
 from pathlib import Path
-from typing import Union, List, Tuple
+from typing import Callable, Iterator, Union, List, Tuple
 from datetime import datetime
+from tempfile import mkdtemp
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import psutil
+import os
 import re
 
 pd.set_option("display.width", 600)
 pd.set_option("display.max_columns", 15)
 
 
-def get_dicom_directories(config: dict) -> List[Tuple[Path]]:
+def _scan_directory_levels(parent_dirs: List[str], first_level: int, n_levels: int,
+                           keep: Callable[[int, str], bool]) -> List[str]:
     """
-    Convenience function for globbing the dicom directories from the config file
+    Lists the directories a fixed number of levels below the given parent directories, with a single os.scandir call
+    per directory.
+    :param parent_dirs: the directories to start from
+    :param first_level: the level within the directory structure of the directories immediately below the parents
+    :param n_levels: the number of levels to descend
+    :param keep: a function receiving a level within the directory structure and a directory name, returning whether
+    that directory should be descended into
+    :return: the string filepaths of the directories found at the final level, in sorted order
+    """
+    current_dirs = parent_dirs
+    for level in range(first_level, first_level + n_levels):
+        next_dirs = []
+        for parent_dir in current_dirs:
+            try:
+                with os.scandir(parent_dir) as entries:
+                    names = sorted(entry.name for entry in entries if entry.is_dir())
+            except OSError:
+                continue
+            next_dirs.extend(os.path.join(parent_dir, name) for name in names if keep(level, name))
+        current_dirs = next_dirs
+    return current_dirs
+
+
+def iter_dicom_directories(config: dict, n_threads: int = None) -> Iterator[Tuple[Path, ...]]:
+    """
+    Lazily discovers the dicom directories specified by the config file, subject by subject. The subject directories
+    are listed first; the levels below each subject are then listed in parallel across subjects, such that the first
+    subjects may already be converted while the remainder are still being discovered.
     :param config: the configuration file that specifies the directory structure
-    :return: dcm_firs: the list of filepaths to directories containing the dicom files
+    :param n_threads: the number of threads used to list subjects in parallel. Defaults to that of ThreadPoolExecutor.
+    Listing is mostly spent waiting on the filesystem (particularly network shares), hence threads rather than processes
+    :return: an iterator of tuples, each tuple being the filepaths to the directories of dicom files of a subject
     """
-    raw_dir = Path(config["RawDir"])
+    raw_dir = str(Path(config["RawDir"]))
     n_levels_total: int = len(config["Directory Structure"])
     n_levels_subject: int = config["Directory Structure"].index("Subject") + 1
-    delimiter: str = "\\" if system() == "Windows" else "/"
+    scan_level: int = config["Directory Structure"].index("Scan")
+    scan_aliases = frozenset(config["Scan Aliases"].values())
+
+    # Only directories whose names are scan aliases are descended into at the scan level
+    def keep(level: int, name: str) -> bool:
+        return level != scan_level or name in scan_aliases
 
-    subject_dirs = []
-    dicom_dir: Path
-    for subject_dir in raw_dir.glob(delimiter.join(["*"] * n_levels_subject)):
-        dcms_per_subject = []
-        for dicom_dir in subject_dir.glob(delimiter.join(["*"] * (n_levels_total - n_levels_subject))):
-            hit = set(config["Scan Aliases"].values()).intersection(dicom_dir.parts)
-            if len(hit) > 0:
-                dcms_per_subject.append(dicom_dir)
-        if len(dcms_per_subject) > 0:
-            subject_dirs.append(tuple(dcms_per_subject))
+    def scan_subject(subject_dir: str) -> Tuple[Path, ...]:
+        return tuple(Path(dicom_dir) for dicom_dir in
+                     _scan_directory_levels([subject_dir], n_levels_subject, n_levels_total - n_levels_subject, keep))
 
-    return subject_dirs
+    subject_dirs = _scan_directory_levels([raw_dir], 0, n_levels_subject, keep)
+    if n_threads == 1:
+        subjects = map(scan_subject, subject_dirs)
+        yield from (dcms_per_subject for dcms_per_subject in subjects if len(dcms_per_subject) > 0)
+        return
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        yield from (dcms_per_subject for dcms_per_subject in executor.map(scan_subject, subject_dirs)
+                    if len(dcms_per_subject) > 0)
+
+
+def list_level_basenames(raw_dir: Union[str, Path], level: int) -> List[str]:
+    """
+    Convenience function for listing the names found at a given depth below the raw directory, such as when the
+    Importer previews a level of the directory structure
+    :param raw_dir: the raw directory
+    :param level: the python index of the depth below the raw directory (i.e. 0 for its immediate contents)
+    :return: the sorted, unique names of the files and directories at that depth
+    """
+    parent_dirs = _scan_directory_levels([str(raw_dir)], 0, level, lambda _level, _name: True)
+    basenames = set()
+    for parent_dir in parent_dirs:
+        try:
+            with os.scandir(parent_dir) as entries:
+                basenames.update(entry.name for entry in entries)
+        except OSError:
+            continue
+    return sorted(basenames)
+
+
+def get_dicom_directories(config: dict, n_threads: int = None) -> List[Tuple[Path, ...]]:
+    """
+    Convenience function for finding the dicom directories from the config file
+    :param config: the configuration file that specifies the directory structure
+    :param n_threads: the number of threads used to list subjects in parallel
+    :return: dcm_firs: the list of filepaths to directories containing the dicom files, grouped by subject
+    """
+    return list(iter_dicom_directories(config=config, n_threads=n_threads))
 
 
 def get_value(subset, remaining_tags: List[Tuple[int]], default=None):
@@ -99,7 +172,20 @@ def get_dicom_value(data: pydicom.Dataset, tags: List[List[tuple]], default=None
     detected_values = []
     for tag_set in tags:
         detected_values.append(get_value(subset=data, remaining_tags=tag_set, default=default))
+    return interpret_dicom_values(detected_values=detected_values, default=default, for_byte_array=for_byte_array)
+
 
+def interpret_dicom_values(detected_values: list, default=None, for_byte_array=None):
+    """
+    Given the values found along each of the tag pathways of a field, decides upon the value of that field
+
+    :param detected_values: the values found along each tag pathway, in order of preference, with the default value
+    standing in for pathways that were not found
+    :param default: the default value to return if nothing can be found
+    :param for_byte_array: a byte string to use with regex in the event that the given tags result in a bytearray
+    such that the expected string will be extracted
+    :return: value: the first valid value
+    """
     # Additional for loop for types
     while default in detected_values:
         detected_values.remove(default)
@@ -150,68 +236,319 @@ def get_dicom_value(data: pydicom.Dataset, tags: List[List[tuple]], default=None
     return default
 
 
-def create_import_summary(import_summaries: list, config: dict):
+class DicomTagResolver:
     """
-    Given a list of individual summaries of each subject/visit/scan, this function will bring all those givens
-    together into a single dataframe for easy viewing
-    :param import_summaries: a list of dicts, with each dict being the parameters of that subject-visit-scan
+    Precompiled lookup plan for retrieving many fields from a DICOM dataset at once. The tag pathways of all fields
+    are merged into a tree keyed by tag, such that pathways sharing a prefix (i.e. the Philips functional group
+    sequences) are walked only once. The values found are then interpreted exactly as get_dicom_value would.
+    """
+
+    def __init__(self, fields: dict):
+        """
+        :param fields: a dict of field name to a dict with the keys "tags" and "default", and optionally
+        "for_byte_array", as per get_dicom_value
+        """
+        self.fields = {name: {"n_paths": len(spec["tags"]),
+                              "default": spec.get("default", None),
+                              "for_byte_array": spec.get("for_byte_array", None)}
+                       for name, spec in fields.items()}
+        # Each node of the plan is a dict of tag -> (terminal entries, child node); a terminal entry is a
+        # (field name, pathway index) pair for the field whose pathway ends at that tag
+        self.plan: dict = {}
+        for name, spec in fields.items():
+            for path_idx, tag_path in enumerate(spec["tags"]):
+                node = self.plan
+                for depth, tag in enumerate(tag_path):
+                    terminals, children = node.setdefault(tuple(tag), ([], {}))
+                    if depth == len(tag_path) - 1:
+                        terminals.append((name, path_idx))
+                    node = children
+
+    @property
+    def top_level_tags(self) -> List[Tuple[int, int]]:
+        """
+        The top-level DICOM elements that must be present in a dataset for every field to be resolved
+        """
+        return sorted(self.plan.keys())
+
+    def _walk(self, subset, node: dict, found: dict):
+        for tag, (terminals, children) in node.items():
+            if tag not in subset:
+                continue
+            item = subset[tag].value
+            if isinstance(item, pydicom.DataElement):
+                for name, path_idx in terminals:
+                    found[name][path_idx] = item.value
+                continue
+            is_nonempty_sequence = isinstance(item, pydicom.Sequence) and len(item) > 0
+            for name, path_idx in terminals:
+                # A pathway that ends on a sequence with items has no value, as in get_value
+                found[name][path_idx] = None if is_nonempty_sequence else item
+            if len(children) > 0 and is_nonempty_sequence:
+                self._walk(subset=item[0], node=children, found=found)
+
+    def resolve(self, data: pydicom.Dataset) -> dict:
+        """
+        Retrieves every field of the plan from a DICOM dataset in a single walk over its elements
+        :param data: the dicom data as a Pydicom Dataset object
+        :return: a dict of field name to the retrieved value (or the field's default)
+        """
+        found = {name: [field["default"]] * field["n_paths"] for name, field in self.fields.items()}
+        self._walk(subset=data, node=self.plan, found=found)
+        return {name: interpret_dicom_values(detected_values=found[name], default=field["default"],
+                                             for_byte_array=field["for_byte_array"])
+                for name, field in self.fields.items()}
+
+
+def create_import_summary(import_summaries: Union[ImportSummaryAccumulator, list], config: dict):
+    """
+    Given the individual summaries of each subject/visit/scan, this function will bring all those givens together into
+    a single dataframe for easy viewing
+    :param import_summaries: the accumulated summaries, or a list of dicts with each dict being the (compact or full)
+    parameters of that subject-visit-scan
     :param config: the import configuration file generated by the GUI to help locate the analysis directory
     """
     analysis_dir = Path(config["RawDir"]).parent / "analysis"
+    if not isinstance(import_summaries, ImportSummaryAccumulator):
+        accumulator = ImportSummaryAccumulator(extra_fields=config.get("Summary Extra Fields", []))
+        accumulator.extend(import_summaries)
+        import_summaries = accumulator
+    df = write_import_summary(summaries=import_summaries, analysis_dir=analysis_dir,
+                              write_parquet=config.get("Summary Parquet", False))
+    if df is not None:
+        print(df)
+
+
+def rescale_nifti(nifti_path: Path, scale: float, offset: float, rewrite_data: bool = False) -> str:
+    """
+    Applies a linear correction (new value = old value * scale + offset) to the values of an uncompressed NIFTI file,
+    in place. By default, the correction is folded into the scl_slope and scl_inter fields of the header, which is
+    mathematically equivalent and leaves the image data untouched. Otherwise, or if the header cannot express the
+    correction, the image data is rewritten as float32 one volume at a time from the memory-mapped input.
+    :param nifti_path: the NIFTI file to correct
+    :param scale: the factor to multiply the values by
+    :param offset: the value to add after scaling
+    :param rewrite_data: whether the image data should always be rewritten rather than the header scaling adjusted
+    :return: "header" or "data", depending on how the correction was applied
+    """
+    nifti_img = nib.load(str(nifti_path))
+    # The header is read from the file itself; the header of a loaded image has its scaling and data offset reset
+    with open(nifti_path, "rb") as nifti_reader:
+        header = nifti_img.header_class.from_fileobj(nifti_reader)
+    old_slope, old_inter = header.get_slope_inter()
+    old_slope = 1.0 if old_slope is None else old_slope
+    old_inter = 0.0 if old_inter is None else old_inter
+    new_slope, new_inter = old_slope * scale, old_inter * scale + offset
+
+    # The header stores the scaling as float32; it cannot represent non-finite or vanishing slopes
+    if all([not rewrite_data,
+            header.get_data_dtype().kind in "iuf",
+            np.isfinite(np.float32(new_slope)), np.isfinite(np.float32(new_inter)),
+            np.float32(new_slope) != 0]):
+        header.set_slope_inter(new_slope, new_inter)
+        del nifti_img
+        # Only the fixed-size header block is overwritten; the extensions and image data are left where they are
+        with open(nifti_path, "r+b") as nifti_writer:
+            nifti_writer.write(header.binaryblock)
+        return "header"
+
+    header.set_data_dtype(np.float32)
+    header.set_slope_inter(1, 0)
+    shape = nifti_img.shape
+    tmp_path = nifti_path.with_name(f"{nifti_path.name}.tmp")
+    with open(tmp_path, "wb") as nifti_writer:
+        header.write_to(nifti_writer)
+        nifti_writer.write(b"\0" * (header.get_data_offset() - nifti_writer.tell()))
+        # NIFTI data is stored in Fortran order, such that the volumes (or the slices of a 3D image) along the last
+        # axis are contiguous and can be written one after the other
+        for idx in range(shape[-1] if len(shape) >= 3 else 1):
+            volume = np.asanyarray(nifti_img.dataobj[..., idx] if len(shape) >= 3 else nifti_img.dataobj)
+            corrected = (volume * scale + offset).astype(np.float32)
+            nifti_writer.write(corrected.tobytes(order="F"))
+            del volume, corrected
+    del nifti_img
+    os.replace(tmp_path, nifti_path)
+    return "data"
+
+
+def get_rss_mb() -> float:
+    """
+    Convenience function for getting the current resident memory of the current process
+    :return: the resident set size, in megabytes
+    """
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident memory of the current process to its current resident memory, such that the peak of
+    the next stage can be measured on its own. Only possible on Linux.
+    :return: whether the peak was reset
+    """
     try:
-        df = pd.concat([pd.Series(import_summary) for import_summary in import_summaries], axis=1, sort=True).T
-    except ValueError as concat_error:
-        print(concat_error)
-        return
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mb() -> Union[float, None]:
+    """
+    Convenience function for getting the peak resident memory of the current process since it was last reset
+    (see reset_peak_rss). Only available on Linux.
+    :return: the peak resident set size, in megabytes, or None if it could not be determined
+    """
+    try:
+        with open("/proc/self/status") as status_reader:
+            for line in status_reader:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
 
-    df["dt"] = df["RepetitionTime"]
-    appropriate_ordering = ['subject', 'visit', 'run', 'scan', 'dx', 'dy', 'dz', 'dt', 'nx', 'ny', 'nz', 'nt',
-                            "RepetitionTime", "EchoTime", "NumberOfAverages", "RescaleSlope", "RescaleIntercept",
-                            "MRScaleSlope", "AcquisitionTime",
-                            "AcquisitionMatrix", "TotalReadoutTime", "EffectiveEchoSpacing"]
-    df = df.reindex(columns=appropriate_ordering)
-    df = df.sort_values(by=["scan", "subject", "visit", "run"]).reset_index(drop=True)
-    print(df)
+def create_timing_summary(timings: List[dict], analysis_dir: Path) -> str:
+    """
+    Given the per-stage timings of each converted DICOM directory, writes them to a table in the analysis directory
+    and summarizes which stages and subjects took the longest
+    :param timings: a list of dicts, with each dict being the timing of a single stage of a single DICOM directory
+    :param analysis_dir: the absolute path to the analysis directory
+    :return: a human-readable summary of the slowest stages and subjects
+    """
+    if len(timings) == 0:
+        return "No timings were recorded"
+    df = pd.DataFrame(timings)
     now_str = datetime.now().strftime("%a-%b-%d-%Y %H-%M-%S")
     try:
-        df.to_csv(analysis_dir / f"Import_Dataframe_{now_str}.tsv", sep='\t', index=False, na_rep='n/a')
+        df.to_csv(analysis_dir / f"Import_Timings_{now_str}.tsv", sep='\t', index=False, na_rep='n/a')
     except PermissionError:
-        df.to_csv(analysis_dir / f"Import_Dataframe_{now_str}_copy.tsv", sep='\t', index=False, na_rep='n/a')
+        df.to_csv(analysis_dir / f"Import_Timings_{now_str}_copy.tsv", sep='\t', index=False, na_rep='n/a')
+
+    by_stage = df.groupby("stage", sort=False)["seconds"].agg(["sum", "mean", "max"]).sort_values("sum",
+                                                                                                ascending=False)
+    by_subject = df.groupby(["subject", "visit"], dropna=False)["seconds"].sum().sort_values(ascending=False)
+    lines = [f"Total conversion time across {df['dcm_dir'].nunique()} DICOM directories: "
+             f"{df['seconds'].sum():.1f} seconds (summed over all processes)",
+             f"Largest resident memory of any import process at the end of a stage: {df['rss_end_mb'].max():.0f} MB",
+             f"Largest increase in resident memory over a single stage: "
+             f"{(df['rss_end_mb'] - df['rss_start_mb']).max():.0f} MB"]
+    if df["stage_peak_rss_mb"].notna().any():
+        lines.append(f"Largest peak resident memory during a single stage: {df['stage_peak_rss_mb'].max():.0f} MB")
+    lines.extend(["", "Slowest stages (total / mean / max seconds):"])
+    lines.extend([f"\t{stage}: {row['sum']:.1f} / {row['mean']:.2f} / {row['max']:.2f}"
+                  for stage, row in by_stage.iterrows()])
+    lines.extend(["", "Slowest subjects (total seconds):"])
+    lines.extend([f"\t{subject}" + ("" if pd.isna(visit) else f" ({visit})") + f": {seconds:.1f}"
+                  for (subject, visit), seconds in by_subject.head(5).items()])
+    return "\n".join(lines)
 
 
 def bids_m0_followup(analysis_dir: Path):
     """
     In a BIDS import, this function will run through the imported dataset and adjust any BIDS-standard fields that
-    should be present in the m0scan.json sidecar, such as "IntendedFor"
+    should be present in the m0scan.json sidecar, such as "IntendedFor". The sidecars are taken from the import
+    manifest and all rewritten in a single parallel batch.
     :param analysis_dir: the absolute path to the analysis directory
     """
-    m0_jsons = peekable(analysis_dir.rglob("*_m0scan.json"))
-    if not m0_jsons:
-        print("bids_m0_followup could not find any _m0scan.json files")
+    m0_to_asl = pair_asl_m0_sidecars(get_imported_sidecars(analysis_dir=analysis_dir, suffix="_m0scan.json"))
+    if len(m0_to_asl) == 0:
+        print("bids_m0_followup could not find any _m0scan.json files with an accompanying ASL scan")
         return
-    for m0_json in m0_jsons:
-        asl_json = m0_json.with_name("_asl.json")
-        asl_nifti = m0_json.with_name("_asl.nii")
 
-        # Ensure that the asl json sidecar and nifti images actually exist adjacent to the m0scan.json
-        if asl_json.exists() and asl_nifti.exists():
-            # BIDS standard: the "IntendedFor" filepath must be relative to the subject (exclusive)
-            # and contain forward slashes
-            truncated_asl_nifti = str(asl_nifti).replace(str(analysis_dir), "").replace("\\", "/")
-            by_parts = truncated_asl_nifti.split(sep='/')
-            truncated_asl_nifti = "/".join(by_parts[2:])
+    def add_intended_for(m0_json: Path, m0_parms: dict) -> bool:
+        # BIDS standard: the "IntendedFor" filepath must be relative to the subject (exclusive)
+        # and contain forward slashes
+        asl_nifti = m0_to_asl[m0_json].with_suffix(".nii")
+        truncated_asl_nifti = str(asl_nifti).replace(str(analysis_dir), "").replace("\\", "/")
+        by_parts = truncated_asl_nifti.split(sep='/')
+        m0_parms["IntendedFor"] = "/".join(by_parts[2:])
+        return True
+
+    rewrite_json_sidecars(sidecars=list(m0_to_asl.keys()), update=add_intended_for)
+
+
+def write_import_log(analysis_dir: Path, logs: List[str]) -> Path:
+    """
+    Concatenates the logs of each converted DICOM directory into a single log placed in the study directory
+    :param analysis_dir: the absolute path to the analysis directory
+    :param logs: the list of log texts, one per converted DICOM directory
+    :return: log_path: the path to the log file that was written
+    """
+    now_str = datetime.now().strftime("%a-%b-%d-%Y_%H-%M-%S")
+    try:
+        log_path = analysis_dir / "Logs" / "Import Logs" / f"Import_Log_{now_str}.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(log_path, "w") as log_writer:
+            log_writer.write(f"\n{'#' * 50}\n".join(logs))
+    except PermissionError:
+        log_path = analysis_dir / "Logs" / "Import Logs" / f"Import_Log_{now_str}_backup.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(log_path, "w") as log_writer:
+            log_writer.write("\n\n".join(logs))
+    return log_path
+
+
+def write_failed_imports(analysis_dir: Path, failed_runs: List[str]):
+    """
+    Writes the descriptions of the DICOM directories that failed to be converted to the study directory
+    :param analysis_dir: the absolute path to the analysis directory
+    :param failed_runs: the list of failure descriptions
+    """
+    with open(analysis_dir / "Import_Failed_Imports.txt", "w") as failed_writer:
+        failed_writer.writelines([line + "\n" for line in failed_runs])
+
+
+def create_dataset_description_template(analysis_dir: Path):
+    """
+    Creates a template for the dataset description file for the user to complete at a later point in time
+    :param analysis_dir: The analysis directory where the dataset description will be saved to.
+    """
+    template = {
+        "BIDSVersion": "0.1.0",
+        "License": "CC0",
+        "Name": "A multi-subject, multi-modal human neuroimaging dataset",
+        "Authors": [],
+        "Acknowledgements": "",
+        "HowToAcknowledge": "This data was obtained from [owner]. "
+                            "Its accession number is [id number]'",
+        "ReferencesAndLinks": ["https://www.ncbi.nlm.nih.gov/pubmed/25977808",
+                               "https://openfmri.org/dataset/ds000117/"],
+        "Funding": ["UK Medical Research Council (MC_A060_5PR10)"]
+    }
+    with open(analysis_dir / "dataset_description.json", 'w') as dataset_writer:
+        json.dump(template, dataset_writer, indent=3)
+
+
+def bids_import_followup(analysis_dir: Path):
+    """
+    Performs the additional steps needed after a BIDS import: "IntendedFor" fields in the m0scan sidecars, the dataset
+    description template, and the ".bidsignore" file
+    :param analysis_dir: the absolute path to the analysis directory
+    """
+    # Ensure all M0 jsons have the appropriate "IntendedFor" field
+    bids_m0_followup(analysis_dir=analysis_dir)
+
+    # Create the template for the dataset description
+    create_dataset_description_template(analysis_dir)
 
-            with open(m0_json) as m0_json_reader:
-                m0_parms = json.load(m0_json_reader)
-            m0_parms["IntendedFor"] = truncated_asl_nifti
-            with open(m0_json, 'w') as m0_json_writer:
-                json.dump(m0_parms, m0_json_writer, indent=3)
+    # Create the "bidsignore" file
+    with open(analysis_dir / ".bidsignore", 'w') as ignore_writer:
+        to_ignore = ["Import_Log_*.log\n", "Import_Failed*.txt\n", "Import_Dataframe_*.tsv\n",
+                     "Import_Dataframe_*.parquet\n",
+                     "Import_Timings_*.tsv\n", "Import_Manifest.jsonl*\n", "Status_Index.json*\n"]
+        ignore_writer.writelines(to_ignore)
 
 
 class DCM2NIFTI_Converter:
-    def __init__(self, config: dict, name: str, logger: logging.Logger, b_legacy: bool = True):
+    def __init__(self, config: dict, name: str, logger: logging.Logger, b_legacy: bool = True,
+                 handler: logging.Handler = None):
         """
         Class to perform DCM2NIFTI Conversion & Logging
+
+        :param handler: an optional logging handler to record to. If not provided, a temporary log file is created
+        within the raw directory.
         """
         self.config: dict = config
         self.b_legacy: bool = b_legacy
@@ -220,7 +557,9 @@ class DCM2NIFTI_Converter:
 
         # Prepare the logging credentials
         self.logger: logging.Logger = logger
-        self.handler = logging.FileHandler(filename=self.path_sourcedir / f"tmpImport_{name}.log", mode="w")
+        if handler is None:
+            handler = logging.FileHandler(filename=self.path_sourcedir / f"tmpImport_{name}.log", mode="w")
+        self.handler = handler
         self.handler.setFormatter(logging.Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s\n%(message)s"))
         self.handler.setLevel(logging.DEBUG)
         self.logger.addHandler(self.handler)
@@ -242,7 +581,7 @@ class DCM2NIFTI_Converter:
                     [(0x5200, 0x9230), (0x0028, 0x9145), (0x0028, 0x1053)]
                 ],
                 "default": 1},
-            "RescaleIntercept": {"tags": [(0x0028, 0x1052)],
+            "RescaleIntercept": {"tags": [[(0x0028, 0x1052)]],
                                  "default": 0},
             "MRScaleSlope": {
                 "tags": [
@@ -272,7 +611,33 @@ class DCM2NIFTI_Converter:
                 "default": None,
                 "for_byte_array": b'\x18\x00%\x90\x04\x00\x00\x00(FAT|WATER|NONE|FAT_AND_WATER)'}
         }
+        # Fields needed while retrieving the tags_dict fields, but which are not themselves reported
+        self.helper_tags_dict: dict = {
+            "Manufacturer": {"tags": [[(0x0008, 0x0070)], [(0x0019, 0x0010)]],
+                             "default": None},
+            "AcquisitionMatrixBackup": {"tags": [[(0x5200, 0x9230), (0x0021, 0x10FE), (0x0021, 0x1058)]],
+                                        "default": None},
+            "SeriesNumber": {"tags": [[(0x0020, 0x0011)]],
+                             "default": None},
+            "NumberOfTemporalPositions": {"tags": [[(0x0020, 0x0105)]],
+                                          "default": None},
+            "ImagesInAcquisition": {"tags": [[(0x0020, 0x1002)]],
+                                    "default": None}
+        }
+        # Compile the tag pathways once such that every field is retrieved in a single walk over each dataset
+        self.tag_resolver = DicomTagResolver({**self.tags_dict, **self.helper_tags_dict})
+        # The top-level DICOM elements that need to be read from the headers: those at the start of each pathway,
+        # alongside the character set
+        self.header_tags: List[Tuple[int, int]] = sorted(set(self.tag_resolver.top_level_tags) | {(0x0008, 0x0005)})
+        # Index of previously-retrieved header fields, such that unchanged files need not be parsed again
+        self.header_index: Union[DicomHeaderIndex, None] = None
+        if self.config.get("Use Header Index", True):
+            self.header_index = DicomHeaderIndex(self.path_sourcedir)
+        self.header_fields: dict = {}
         self.summary_data = {}
+        # Per-stage wall-clock time and memory of the current DICOM directory
+        self.stage_timings: List[dict] = []
+        self.path_tempdir: Union[Path, None] = None
         self.logger.info(f"Initialized Logger for {name}")
 
     def process_dcm_dir(self, dcm_dir: Path):
@@ -283,14 +648,30 @@ class DCM2NIFTI_Converter:
                  self.run_dcm2niix, self.process_niftis_in_temp, self.update_final_json_and_nifti]
 
         self.summary_data.clear()
+        self.stage_timings.clear()
         start_str = f"START PROCESSING DICOM DIR {str(dcm_dir)}\n"
         self.logger.info("%" * len(start_str) + "\n" +
                          start_str +
                          "%" * len(start_str) + "\n")
         for func, desc in zip(funcs, module_names):
             self.logger.info(f"Beginning Module - {desc}")
-            successfully_completed = func(dcm_dir)
+            # The peak memory of a process only ever grows unless reset; without a reset (i.e. outside of Linux), only
+            # the memory before and after the stage is known
+            is_peak_reset = reset_peak_rss()
+            rss_start, stage_start = get_rss_mb(), perf_counter()
+            try:
+                successfully_completed = func(dcm_dir)
+            finally:
+                stage_peak = get_peak_rss_mb() if is_peak_reset else None
+                self.stage_timings.append({"dcm_dir": str(dcm_dir), "subject": self.subject, "visit": self.visit,
+                                           "run": self.run, "scan": self.scan, "stage": desc,
+                                           "seconds": round(perf_counter() - stage_start, 4),
+                                           "rss_start_mb": round(rss_start, 1),
+                                           "rss_end_mb": round(get_rss_mb(), 1),
+                                           "stage_peak_rss_mb": None if stage_peak is None else round(stage_peak, 1)})
             if not successfully_completed:
+                # Each conversion has its own TEMP directory, which would otherwise accumulate
+                self.cleanup()
                 return False, f"\nERROR_LISTING FOR DICOM DIRECTORY WITH GIVENS:\n\t" \
                               f"SUBECT: {self.subject}\n\t" \
                               f"VISIT: {self.visit}\n\t" \
@@ -311,8 +692,9 @@ class DCM2NIFTI_Converter:
 
     def cleanup(self):
         # Remove the TEMP directory
-        if self.path_tempdir.exists():
+        if self.path_tempdir is not None and self.path_tempdir.exists():
             shutil.rmtree(path=str(self.path_tempdir), ignore_errors=True)
+        self.path_tempdir = None
 
     def get_structure_components(self, dcm_dir: Path):
         """
@@ -351,83 +733,102 @@ class DCM2NIFTI_Converter:
             visit_str = "" if self.visit_dst_name is None else f"_{self.visit_dst_name}"
             run_str = "ASL_1" if self.run_dst_name is None else self.run_dst_name
             if self.scan_dst_name not in {"T1", "T2", "FLAIR"}:
-                self.path_tempdir = path_study_dir / f"{subject_str}{visit_str}" / run_str / "TEMP"
+                self.path_destdir = path_study_dir / f"{subject_str}{visit_str}" / run_str
             else:
-                self.path_tempdir = path_study_dir / f"{subject_str}{visit_str}" / "TEMP"
+                self.path_destdir = path_study_dir / f"{subject_str}{visit_str}"
         # BIDS FORMAT
         else:
             # Get rid of illegal characters for subject
             subject_str = self.subject_dst_name.replace("-", "").replace("_", "")
             anat_or_perf = "anat" if self.scan_dst_name not in {"T1", "T2", "FLAIR"} else "perf"
             if self.visit_dst_name is None:
-                self.path_tempdir = path_study_dir / f"sub-{subject_str}" / anat_or_perf / "TEMP"
+                self.path_destdir = path_study_dir / f"sub-{subject_str}" / anat_or_perf
             else:
                 # Get rid of illegal characters for visit
                 visit_str = self.visit_dst_name.replace("-", "").replace("_", "")
-                self.path_tempdir = path_study_dir / f"sub-{subject_str}" / f"ses-{visit_str}" / anat_or_perf / "TEMP"
-
-        self.path_tempdir.mkdir(parents=True, exist_ok=True)
+                self.path_destdir = path_study_dir / f"sub-{subject_str}" / f"ses-{visit_str}" / anat_or_perf
+        self.path_destdir.mkdir(parents=True, exist_ok=True)
+
+        # Several scans may share the same destination (i.e. ASL4D and M0) and may be converted at the same time by
+        # different processes; each therefore gets its own TEMP directory. If a scratch directory was specified (i.e. a
+        # fast local disk), the TEMP directory is placed there instead.
+        scratch_dir = self.config.get("Scratch Dir", None)
+        if scratch_dir:
+            Path(scratch_dir).mkdir(parents=True, exist_ok=True)
+            self.path_tempdir = Path(mkdtemp(prefix=f"TEMP_{self.subject_dst_name}_{self.scan_dst_name}_",
+                                             dir=scratch_dir))
+        else:
+            self.path_tempdir = Path(mkdtemp(prefix=f"TEMP_{self.scan_dst_name}_", dir=self.path_destdir))
         msg = f"The DICOM directory will have its DICOM files temporarily converted to NIFTI format and output to:\n" \
               f"{str(self.path_tempdir)}"
         self.print_and_log(msg, "info")
         return True
 
-    def get_additional_dicom_parms(self, dcm_dir: Path):
+    def read_dicom_header(self, dcm_file: Path) -> pydicom.Dataset:
         """
-        Step 3: DCM2NIIX does not always retrieve the needed DICOM parameters, some must be retrieved
+        Reads only the header elements of a DICOM file that are needed by the converter; the pixel data and all other
+        top-level elements are skipped over
+        :param dcm_file: the DICOM file to read
+        :return: the (partial) dataset of the DICOM file
         """
-        dcm_files = peekable(dcm_dir.glob("*"))
-        if not dcm_files:
-            self.print_and_log(f"The DICOM directory was empty!", msg_type="error")
-            return False
+        return pydicom.dcmread(dcm_file, stop_before_pixels=True, specific_tags=self.header_tags)
 
-        dcm_data = None
-        for dcm_file in dcm_files:
-
-            if dcm_file.name.startswith("XX"):
-                continue
+    def read_header_fields(self, dcm_file: Path) -> dict:
+        """
+        Retrieves all the fields of the tag_resolver from a DICOM file, using the header index if the file has not
+        changed since it was last indexed
+        :param dcm_file: the DICOM file to read
+        :return: a dict of field name to the retrieved value
+        """
+        if self.header_index is not None:
             try:
-                dcm_data = pydicom.read_file(dcm_file)
-            except (InvalidDicomError, PermissionError):
-                continue
-            except IsADirectoryError:
-                self.print_and_log(f"Bad Folder Structure Provided! User probably forgot to indicate a DUMMY variable!",
-                                   msg_type="error")
-                return False
-        if dcm_data is None:
-            self.print_and_log(f"The DICOM directory did not contain any valid DICOM files which could be parsed",
-                               msg_type="error")
-            return False
-        else:
-            self.dcm_dataset: pydicom.Dataset = dcm_data
+                record = self.header_index.get(dcm_file)
+            except sqlite3.Error as index_err:
+                self.print_and_log(f"The header index could not be read and will not be used: {index_err}",
+                                   msg_type="warning")
+                self.header_index = None
+                record = None
+            if record is not None:
+                if not record["valid"]:
+                    raise InvalidDicomError(f"{dcm_file} was previously indexed as not being a valid DICOM file")
+                return record["fields"]
 
-        manufacturer = get_dicom_value(data=dcm_data, tags=[[(0x0008, 0x0070)], [(0x0019, 0x0010)]], default=None)
-        if manufacturer is None:
-            self.print_and_log(f"The DICOM directory could not have its Manufacturer tag determined!!!", "error")
-            return False
-        if "SIEMENS" in manufacturer.upper():
-            manufacturer = "Siemens"
-        elif "PHILIPS" in manufacturer.upper():
-            manufacturer = "Philips"
-        elif "GE" in manufacturer.upper():
-            manufacturer = "GE"
-        else:
-            self.print_and_log(f"The DICOM directory did not have a manufacturer of either Philips, Siemens, or GE!!!",
-                               msg_type="error")
-            return False
         try:
-            if manufacturer != 'Philips':
-                del self.tags_dict["RealWorldValueSlope"]
-                del self.tags_dict["MRScaleSlope"]
-        except KeyError:
-            pass
+            fields = {key: to_index_value(value)
+                      for key, value in self.tag_resolver.resolve(self.read_dicom_header(dcm_file)).items()}
+        except InvalidDicomError:
+            self.put_header_fields(dcm_file, None)
+            raise
+        self.put_header_fields(dcm_file, fields)
+        return fields
+
+    def put_header_fields(self, dcm_file: Path, fields: Union[dict, None]):
+        """
+        Convenience function for adding a DICOM file's fields to the header index, if the index is in use
+        """
+        if self.header_index is None:
+            return
+        try:
+            self.header_index.put(dcm_file, fields)
+        except sqlite3.Error as index_err:
+            self.print_and_log(f"The header index could not be updated and will not be used: {index_err}",
+                               msg_type="warning")
+            self.header_index = None
 
-        self.dcm_info = {}.fromkeys(self.tags_dict.keys())
-        self.dcm_info["Manufacturer"] = manufacturer
-        value: dict
-        for key, value in self.tags_dict.items():
-            result = get_dicom_value(data=dcm_data, tags=value["tags"], default=value["default"],
-                                     for_byte_array=value.get("for_byte_array", None))
+    def extract_dicom_parms(self, resolved: dict, manufacturer: str) -> dict:
+        """
+        Extracts the fields of tags_dict from the values retrieved from a DICOM dataset
+        :param resolved: the values retrieved by the tag_resolver from the dataset
+        :param manufacturer: one of "Siemens", "Philips", or "GE"
+        :return: dcm_info: a dict of the extracted fields, including the manufacturer
+        """
+        # The Philips-specific fields are not relevant for other manufacturers
+        keys = [key for key in self.tags_dict.keys()
+                if manufacturer == "Philips" or key not in {"RealWorldValueSlope", "MRScaleSlope"}]
+        dcm_info = {}.fromkeys(keys)
+        dcm_info["Manufacturer"] = manufacturer
+        for key in keys:
+            result = resolved[key]
             if isinstance(result, MultiValue):
                 result = list(result)
             # Additional processing for specific keys
@@ -437,7 +838,7 @@ class DCM2NIFTI_Converter:
                 elif isinstance(result, list):
                     result = [int(number) for number in result]
                 elif result is None:
-                    backup = get_dicom_value(dcm_data, [[(0x5200, 0x9230), (0x0021, 0x10FE), (0x0021, 0x1058)]])
+                    backup = resolved["AcquisitionMatrixBackup"]
                     if backup is not None:
                         col, row = [int(x) for x in backup.split("*")]
                         result = [row, 0, 0, col]
@@ -450,28 +851,83 @@ class DCM2NIFTI_Converter:
                     except ValueError:
                         pass
 
-            self.dcm_info[key] = result
+            dcm_info[key] = result
             # Final corrections for Philips scans in particular
             if manufacturer == "Philips":
                 # First correction - disagreeing values between RescaleSlope and RealWorldValueSlope if they ended up
                 # in the same dicom. Choose the small value of the two and set it for both
-                if all([self.dcm_info["RescaleSlope"] is not None,
-                        self.dcm_info["RealWorldValueSlope"] is not None,
-                        self.dcm_info["RescaleSlope"] != 1,
-                        self.dcm_info["RealWorldValueSlope"] != 1,
-                        self.dcm_info["RescaleSlope"] != self.dcm_info["RealWorldValueSlope"]
+                if all([dcm_info["RescaleSlope"] is not None,
+                        dcm_info["RealWorldValueSlope"] is not None,
+                        dcm_info["RescaleSlope"] != 1,
+                        dcm_info["RealWorldValueSlope"] != 1,
+                        dcm_info["RescaleSlope"] != dcm_info["RealWorldValueSlope"]
                         ]):
-                    self.dcm_info["RescaleSlope"] = min([self.dcm_info["RescaleSlope"],
-                                                         self.dcm_info["RealWorldValueSlope"]])
-                    self.dcm_info["RealWorldValueSlope"] = min([self.dcm_info["RescaleSlope"],
-                                                                self.dcm_info["RealWorldValueSlope"]])
+                    dcm_info["RescaleSlope"] = min([dcm_info["RescaleSlope"], dcm_info["RealWorldValueSlope"]])
+                    dcm_info["RealWorldValueSlope"] = min([dcm_info["RescaleSlope"], dcm_info["RealWorldValueSlope"]])
 
                 # Second correction - just to ease things on the side of ExploreASL; if RescaleSlope could not be
                 # determined while "RealWorldValueSlope" could be, copy over the latter's value for the former
-                if all([self.dcm_info["RealWorldValueSlope"] is not None,
-                        self.dcm_info["RealWorldValueSlope"] != 1,
-                        self.dcm_info["RescaleSlope"] == 1]):
-                    self.dcm_info["RescaleSlope"] = self.dcm_info["RealWorldValueSlope"]
+                if all([dcm_info["RealWorldValueSlope"] is not None,
+                        dcm_info["RealWorldValueSlope"] != 1,
+                        dcm_info["RescaleSlope"] == 1]):
+                    dcm_info["RescaleSlope"] = dcm_info["RealWorldValueSlope"]
+
+        return dcm_info
+
+    def get_additional_dicom_parms(self, dcm_dir: Path):
+        """
+        Step 3: DCM2NIIX does not always retrieve the needed DICOM parameters, some must be retrieved
+        """
+        dcm_files = sorted(dcm_file for dcm_file in dcm_dir.iterdir() if not dcm_file.name.startswith("XX"))
+        if len(dcm_files) == 0:
+            self.print_and_log(f"The DICOM directory was empty!", msg_type="error")
+            return False
+        # Forget about the files of this directory which have been removed since it was last imported
+        if self.header_index is not None:
+            try:
+                self.header_index.prune_directory(dcm_dir, dcm_files)
+            except sqlite3.Error as index_err:
+                self.print_and_log(f"The header index could not be pruned and will not be used: {index_err}",
+                                   msg_type="warning")
+                self.header_index = None
+
+        # Only the header of the first valid DICOM file is needed to retrieve the parameters
+        resolved, first_idx = None, None
+        for idx, dcm_file in enumerate(dcm_files):
+            try:
+                resolved = self.read_header_fields(dcm_file)
+                first_idx = idx
+                break
+            except (InvalidDicomError, PermissionError):
+                continue
+            except IsADirectoryError:
+                self.print_and_log(f"Bad Folder Structure Provided! User probably forgot to indicate a DUMMY variable!",
+                                   msg_type="error")
+                return False
+        if resolved is None:
+            self.print_and_log(f"The DICOM directory did not contain any valid DICOM files which could be parsed",
+                               msg_type="error")
+            return False
+        else:
+            self.header_fields = resolved
+
+        manufacturer = resolved["Manufacturer"]
+        if manufacturer is None:
+            self.print_and_log(f"The DICOM directory could not have its Manufacturer tag determined!!!", "error")
+            return False
+        if "SIEMENS" in manufacturer.upper():
+            manufacturer = "Siemens"
+        elif "PHILIPS" in manufacturer.upper():
+            manufacturer = "Philips"
+        elif "GE" in manufacturer.upper():
+            manufacturer = "GE"
+        else:
+            self.print_and_log(f"The DICOM directory did not have a manufacturer of either Philips, Siemens, or GE!!!",
+                               msg_type="error")
+            return False
+
+        self.dcm_info = self.extract_dicom_parms(resolved=resolved, manufacturer=manufacturer)
+        self.check_dicom_parms_consistency(dcm_files=dcm_files[first_idx + 1:], manufacturer=manufacturer)
 
         # remove the "RealWorldValueSlope" as it is no longer needed
         try:
@@ -483,6 +939,36 @@ class DCM2NIFTI_Converter:
         self.print_and_log(msg, msg_type="info")
         return True
 
+    def check_dicom_parms_consistency(self, dcm_files: List[Path], manufacturer: str):
+        """
+        Optional consistency check; samples a number of additional DICOM files from the directory (as set by the
+        "Header Samples" key of the import configuration) and warns if their parameters disagree with those already
+        extracted into dcm_info
+        :param dcm_files: the remaining DICOM files of the directory that may be sampled from
+        :param manufacturer: one of "Siemens", "Philips", or "GE"
+        """
+        n_extra = min(int(self.config.get("Header Samples", 1)) - 1, len(dcm_files))
+        if n_extra <= 0:
+            return
+
+        # Evenly space the samples across the remaining files, always including the last one
+        step = len(dcm_files) / n_extra
+        sampled_files = [dcm_files[min(int(step * (ii + 1)) - 1, len(dcm_files) - 1)] for ii in range(n_extra)]
+        for dcm_file in sampled_files:
+            try:
+                sample_resolved = self.read_header_fields(dcm_file)
+                sample_info = self.extract_dicom_parms(resolved=sample_resolved, manufacturer=manufacturer)
+            except (InvalidDicomError, PermissionError, IsADirectoryError):
+                continue
+            # Acquisition times are expected to differ between files of the same series
+            disagreements = [f"\t{key}: {self.dcm_info[key]} vs {sample_value}"
+                             for key, sample_value in sample_info.items()
+                             if key != "AcquisitionTime" and sample_value != self.dcm_info.get(key)]
+            if len(disagreements) > 0:
+                self.print_and_log("\n".join([f"The DICOM file {dcm_file.name} disagrees with the first DICOM file of "
+                                              f"the directory in the following parameters:"] + disagreements),
+                                   msg_type="warning")
+
     def run_dcm2niix(self, dcm_dir: Path):
         """
         Step 4: Run DCM2NIIX
@@ -497,27 +983,23 @@ class DCM2NIFTI_Converter:
               f"\tRun: {self.run_dst_name}\n\tOutputTEMPDir: {self.path_tempdir}"
         self.print_and_log(msg, msg_type="info")
 
-        # Prepare the body of the main command
-        header = "" if system() == "Windows" else "./"
-        command = f"{header}dcm2niix -b y -z n -x n -t n -m n -s n -v n " \
-                  f"-f {output_filename_format} -o {str(self.path_tempdir)} {str(dcm_dir)}"
-
         # Execute DCM2NIIX
-        if system() == "Windows":
-            result = subprocess.run(command.split(" "), creationflags=subprocess.CREATE_NO_WINDOW)
-            stderr, return_code = result.stderr, result.returncode
-        else:
-            p = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                                 text=True, shell=True)
-            p.wait()
-            stdout, stderr = p.communicate()
-            return_code = p.returncode
-
-        if return_code == 0:
-            self.print_and_log(f"DCM2NIIX successfully converted files to NIFTI format!", msg_type="info")
+        try:
+            result = run_dcm2niix(dcm_dir=dcm_dir, output_dir=self.path_tempdir, filename_format=output_filename_format,
+                                  on_line=self.logger.debug)
+        except OSError as dcm2niix_err:
+            self.print_and_log(f"DCM2NIIX could not be started from {get_dcm2niix_path()}:\n{dcm2niix_err}",
+                               msg_type="error")
+            return False
+        self.summary_data["DCM2NIIXTime"] = round(result.elapsed, 3)
+        self.summary_data["DCM2NIIXWaitTime"] = round(result.waited, 3)
+
+        if result.return_code == 0:
+            self.print_and_log(f"DCM2NIIX successfully converted files to NIFTI format in {result.elapsed:.2f} "
+                               f"seconds!", msg_type="info")
             return True
         else:
-            self.print_and_log(f"DCM2NIIX Did not exit gracefully!!!\nStd Err:\n{stderr}", msg_type="error")
+            self.print_and_log(f"DCM2NIIX Did not exit gracefully!!!\nOutput:\n{result.output}", msg_type="error")
             return False
 
     def process_niftis_in_temp(self, _):
@@ -525,6 +1007,8 @@ class DCM2NIFTI_Converter:
         Step 5: Clean up the mess that is present in the TEMP directory
         """
         ge_fix_flag, ge_json_file = False, None
+        # The NIFTI produced by DCM2NIIX, if it can be used without any changes
+        direct_source: Union[Path, None] = None
         import_summary = dict.fromkeys(["subject", "visit", "scan", "filename",
                                         "dx", "dy", "dz", "nx", "ny", "nz", "nt"])
         jsons = peekable(self.path_tempdir.glob("*.json"))
@@ -595,9 +1079,6 @@ class DCM2NIFTI_Converter:
         # Scenario: ASL4D
         if len(reorganized_niftis) > 1 and self.scan_dst_name == "ASL4D":
             self.print_and_log(f"NIFTI Scenario: Multiple ASL NIFTIs needing to be concatenated", msg_type="info")
-            initial_shape_history = []
-            nii_objs = []
-
             # GE Fix, sometimes the vendors mix up the Perfusion vs M0 ordering; best to make sure each time
             if self.dcm_info["Manufacturer"] == "GE" and len(reorganized_niftis) == 2:
                 self.print_and_log(f"GE Perfusion & M0 scenario: Attempting to ensure the ordering is correct", "info")
@@ -630,48 +1111,9 @@ class DCM2NIFTI_Converter:
                                        f"attempt", msg_type="error")
                     pass
 
-            for idx, nifti in enumerate(reorganized_niftis):
-                nii_obj: nib.Nifti1Image = nib.load(str(nifti))
-
-                # Must keep a history of incoming shapes to prevent incompatible later scans from ruining the concat
-                if idx > 0 and nii_obj.shape not in initial_shape_history:
-                    break
-                initial_shape_history.append(nii_obj.shape)
-
-                # dcm2niix error: imports a 4D NIFTI instead of a 3D one. Solution: must be split first and concatenated
-                # with the others at a later step
-                if len(nii_obj.shape) == 4:
-                    volumes = nib.funcs.four_to_three(nii_obj)
-                    for volume in volumes:
-                        nii_objs.append(volume)
-
-                # Otherwise, correct 3D import
-                elif len(nii_obj.shape) == 3:
-
-                    # dcm2niix error: imports a 3D mosaic. Solution: reformat as a 3D stack
-                    if nii_obj.shape[2] == 1:
-                        if idx == 0:
-                            self.print_and_log("The NIFTI Files were determined to be incorrectly processed by DCM2NIX "
-                                               ", resulting in a mosaic outcome. Converting mosaic to 3D volume",
-                                               "warning")
-
-                        # Get the acquisition matrix
-                        acq_matrix = self.dcm_info["AcquisitionMatrix"]
-                        if acq_matrix[0] == 0:
-                            acq_rows = int(acq_matrix[1])
-                            acq_cols = int(acq_matrix[2])
-                        else:
-                            acq_rows = int(acq_matrix[0])
-                            acq_cols = int(acq_matrix[3])
-
-                        nii_obj = self.fix_mosaic(mosaic_nifti=nii_obj, acq_dims=(acq_rows, acq_cols))
-                    nii_objs.append(nii_obj)
-                else:
-                    self.print_and_log(f"An uncanny NIFTI set was encountered. A single NIFTI in this set had the "
-                                       f"following shape: {nii_obj.shape}", msg_type="error")
-                    return False
-
-            final_nifti_obj = nib.funcs.concat_images(nii_objs)
+            final_nifti_obj = self.concatenate_asl_niftis(niftis=reorganized_niftis)
+            if final_nifti_obj is None:
+                return False
 
         # Scenario: multiple M0; will take their mean as final
         elif len(reorganized_niftis) > 1 and self.scan_dst_name == "M0":
@@ -691,13 +1133,14 @@ class DCM2NIFTI_Converter:
         elif len(reorganized_niftis) == 1 and self.scan_dst_name in ["M0", "ASL4D"]:
             self.print_and_log(f"NIFTI Scenario: Single M0 or ASL scan (i.e. CBF or PWI Image)", msg_type="info")
             final_nifti_obj: nib.Nifti1Image = nib.load(reorganized_niftis[0])
+            direct_source = reorganized_niftis[0]
 
             # Weird GE flavor which DCM2NIIX gets wrong (ends up as a 3D when it needs to be 4D)
             if all([self.dcm_info["Manufacturer"] == "GE", "EPI" in sidecar_data.get("ScanOptions", ""),
                     len(final_nifti_obj.shape) == 3
                     ]):
-                n_temporal = get_dicom_value(self.dcm_dataset, [[(0x0020, 0x0105)]], default=None)
-                n_images = get_dicom_value(self.dcm_dataset, [[(0x0020, 0x1002)]], default=None)
+                n_temporal = self.header_fields["NumberOfTemporalPositions"]
+                n_images = self.header_fields["ImagesInAcquisition"]
                 if any([n_images is None, n_temporal is None]):
                     self.print_and_log("Could not parse GE 2D-EPI ")
                 self.print_and_log("Weird GE 2D-EPI Scenario: DCM2NIIX Concatenated Incorrectly. Fixing Issue.")
@@ -706,6 +1149,7 @@ class DCM2NIFTI_Converter:
                 new_data = np.transpose(new_data, (1, 2, 3, 0))
                 final_nifti_obj: nib.Nifti1Image = image.new_img_like(final_nifti_obj, data=new_data,
                                                                       affine=final_nifti_obj.affine)
+                direct_source = None
 
             # Must correct for bad headers under BIDS specification
             if not self.b_legacy and final_nifti_obj.ndim < 4:
@@ -715,11 +1159,13 @@ class DCM2NIFTI_Converter:
                 final_nifti_obj = nib.Nifti1Image(np.expand_dims(image.get_data(final_nifti_obj), axis=-1),
                                                   final_nifti_obj.affine,
                                                   final_nifti_obj.header)
+                direct_source = None
 
         # Scenario: one of the structural types
         elif len(reorganized_niftis) == 1 and self.scan_dst_name in ["T1", "T2", "FLAIR"]:
             self.print_and_log(f"NIFTI Scenario: Single Structural Scan", msg_type="info")
             final_nifti_obj = nib.load(str(reorganized_niftis[0]))
+            direct_source = reorganized_niftis[0]
 
         # Scenario: multiple T1 acquisitions...take the mean
         elif len(reorganized_niftis) > 1 and self.scan_dst_name in ["T1", "T2", "FLAIR"]:
@@ -770,20 +1216,24 @@ class DCM2NIFTI_Converter:
         visit_str = "" if self.visit_dst_name is None \
             else f"ses-{self.visit_dst_name.replace('-', '').replace('_', '')}_"
         if self.b_legacy:
-            self.path_final_nifti = self.path_tempdir.parent / f"{self.scan_dst_name}.nii"
-            self.path_final_json = self.path_tempdir.parent / f"{self.scan_dst_name}.json"
+            self.path_final_nifti = self.path_destdir / f"{self.scan_dst_name}.nii"
+            self.path_final_json = self.path_destdir / f"{self.scan_dst_name}.json"
         else:
             scan_str = {"ASL4D": "asl", "M0": "m0scan", "T1": "T1w", "T2": "T2w", "FLAIR": "FLAIR"}[self.scan_dst_name]
             subject_str = self.subject_dst_name.replace("-", "").replace("_", "")
             basename_str = f"sub-{subject_str}_{visit_str}{run_str}{scan_str}"
-            self.path_final_nifti = self.path_tempdir.parent / f"{basename_str}.nii"
-            self.path_final_json = self.path_tempdir.parent / f"{basename_str}.json"
+            self.path_final_nifti = self.path_destdir / f"{basename_str}.nii"
+            self.path_final_json = self.path_destdir / f"{basename_str}.json"
         self.print_and_log(f"Determined the final NIFTI and JSON filepaths to be as follows:\n"
                            f"\t NIFTI: {str(self.path_final_nifti)}\n"
                            f"\t JSON: {str(self.path_final_json)}", msg_type="info")
 
         # Perform the file move operations
-        nib.save(final_nifti_obj, self.path_final_nifti)
+        if direct_source is not None and self.config.get("Direct Conversion", False):
+            self.print_and_log("The NIFTI produced by DCM2NIIX needed no changes; moving it as-is", msg_type="info")
+            shutil.move(str(direct_source), str(self.path_final_nifti))
+        else:
+            nib.save(final_nifti_obj, self.path_final_nifti)
         if ge_fix_flag and ge_json_file is not None:
             ge_json_file.replace(self.path_final_json)
         else:
@@ -797,16 +1247,91 @@ class DCM2NIFTI_Converter:
 
         return True
 
+    def concatenate_asl_niftis(self, niftis: List[Path]) -> Union[nib.Nifti1Image, None]:
+        """
+        Concatenates the ASL NIFTIs in the TEMP directory into a single 4D NIFTI. The output array is allocated once
+        and each volume is copied into it as it is read, such that peak memory remains near that of the output alone.
+        :param niftis: the NIFTI files to concatenate, in order
+        :return: the concatenated NIFTI image, or None if the NIFTIs could not be concatenated
+        """
+        # First pass, using only the headers: determine which files can be concatenated and how many volumes they hold.
+        # Must keep a history of incoming shapes to prevent incompatible later scans from ruining the concat
+        sources: List[nib.Nifti1Image] = []
+        initial_shape_history = []
+        n_volumes = 0
+        for idx, nifti in enumerate(niftis):
+            nii_obj: nib.Nifti1Image = nib.load(str(nifti))
+            if idx > 0 and nii_obj.shape not in initial_shape_history:
+                break
+            initial_shape_history.append(nii_obj.shape)
+
+            if len(nii_obj.shape) not in [3, 4]:
+                self.print_and_log(f"An uncanny NIFTI set was encountered. A single NIFTI in this set had the "
+                                   f"following shape: {nii_obj.shape}", msg_type="error")
+                return None
+            # dcm2niix error: imports a 4D NIFTI instead of a 3D one. Each of its volumes is concatenated separately
+            n_volumes += nii_obj.shape[3] if len(nii_obj.shape) == 4 else 1
+            sources.append(nii_obj)
+
+        def iter_volumes():
+            for src_idx, src_obj in enumerate(sources):
+                if len(src_obj.shape) == 4:
+                    # Slicing the proxy reads only the one volume from disk
+                    for vol_idx in range(src_obj.shape[3]):
+                        yield src_obj, np.asanyarray(src_obj.dataobj[..., vol_idx])
+
+                # dcm2niix error: imports a 3D mosaic. Solution: reformat as a 3D stack
+                elif src_obj.shape[2] == 1:
+                    if src_idx == 0:
+                        self.print_and_log("The NIFTI Files were determined to be incorrectly processed by DCM2NIX "
+                                           ", resulting in a mosaic outcome. Converting mosaic to 3D volume",
+                                           "warning")
+
+                    # Get the acquisition matrix
+                    acq_matrix = self.dcm_info["AcquisitionMatrix"]
+                    if acq_matrix[0] == 0:
+                        acq_rows = int(acq_matrix[1])
+                        acq_cols = int(acq_matrix[2])
+                    else:
+                        acq_rows = int(acq_matrix[0])
+                        acq_cols = int(acq_matrix[3])
+
+                    fixed_obj = self.fix_mosaic(mosaic_nifti=src_obj, acq_dims=(acq_rows, acq_cols))
+                    if fixed_obj is None:
+                        raise ValueError(f"the mosaic of shape {src_obj.shape} could not be divided using the "
+                                         f"acquisition matrix {acq_matrix}")
+                    yield fixed_obj, np.asanyarray(fixed_obj.dataobj)
+
+                # Otherwise, correct 3D import
+                else:
+                    yield src_obj, np.asanyarray(src_obj.dataobj)
+
+        # Second pass: copy each volume into the preallocated output as it is read
+        out_data, first_obj = None, None
+        try:
+            for vol_idx, (vol_obj, vol_data) in enumerate(iter_volumes()):
+                if out_data is None:
+                    first_obj = vol_obj
+                    out_data = np.empty(vol_data.shape + (n_volumes,))
+                if vol_data.shape != out_data.shape[:3] or not np.all(vol_obj.affine == first_obj.affine):
+                    raise ValueError(f"volume {vol_idx} has shape {vol_data.shape} and affine\n{vol_obj.affine}\n"
+                                     f"whereas the first volume has shape {out_data.shape[:3]} and affine\n"
+                                     f"{first_obj.affine}")
+                out_data[..., vol_idx] = vol_data
+        except ValueError as concat_err:
+            self.print_and_log(f"The ASL NIFTIs could not be concatenated: {concat_err}", msg_type="error")
+            return None
+
+        return first_obj.__class__(out_data, first_obj.affine, first_obj.header)
+
     @staticmethod
     def fix_mosaic(mosaic_nifti: nib.Nifti1Image, acq_dims: tuple):
         """
         Fixes incorrectly-processed NIFTIs by dcm2niix where they still remain mosaics due to a lack of
-        NumberOfImagesInMosaic header. This function implements a hack to
+        NumberOfImagesInMosaic header. This function implements a hack to split the mosaic into its tiles.
         :param mosaic_nifti: the nifti image object that needs to be fixed. Should be of shape m x n x 1
-        the sliding window algorithm
         :param acq_dims: the (row, col) acquisition dimensions for rows and columns from the AcquisitionMatrix DICOM
-        field.
-        Used to determine the appropriate kernel size to use for the sliding window algorithm
+        field. Used to determine the appropriate tile size to split the mosaic with
         :return: new_nifti; a 3D NIFTI that is no longer mosaic
         """
         acq_rows, acq_cols = acq_dims
@@ -814,47 +1339,36 @@ class DCM2NIFTI_Converter:
         # Get the shape and array values of the mosaic (flatten the latter into a 2D array)
         img_shape = mosaic_nifti.shape
         # noinspection PyTypeChecker
-        img_data = np.rot90(np.squeeze(mosaic_nifti.get_fdata()))
+        img_data = np.rot90(np.squeeze(np.asanyarray(mosaic_nifti.dataobj)))
 
         # If this is a square, and the rows perfectly divides the mosaic
         if img_shape[0] == img_shape[1] and img_shape[0] % acq_rows == 0:
-            nsplits_w, nsplits_h = img_shape[0] / acq_rows, img_shape[0] / acq_rows
+            nsplits_w, nsplits_h = img_shape[0] // acq_rows, img_shape[0] // acq_rows
             kernel_w, kernel_h = acq_rows, acq_rows
         # If this is a square, and the cols perfectly divides the mosaic
         elif img_shape[0] == img_shape[1] and img_shape[0] % acq_cols == 0:
-            nsplits_w, nsplits_h = img_shape[0] / acq_cols, img_shape[0] / acq_cols
+            nsplits_w, nsplits_h = img_shape[0] // acq_cols, img_shape[0] // acq_cols
             kernel_w, kernel_h = acq_cols, acq_cols
         # If this is a rectangle
         elif all([img_shape[0] != img_shape[1],
                   img_shape[0] % acq_rows == 0,
                   img_shape[1] % acq_cols == 0
                   ]):
-            nsplits_w, nsplits_h = img_shape[0] / acq_rows, img_shape[1] / acq_cols
+            nsplits_w, nsplits_h = img_shape[0] // acq_rows, img_shape[1] // acq_cols
             kernel_w, kernel_h = acq_rows, acq_cols
         else:
             return
 
-        # Initialize the data that will house the split mosaic into slices
-        new_img_data = np.zeros(shape=(kernel_w, kernel_h, int(nsplits_w * nsplits_h)))
-        slice_num = 0
-
-        # Sliding Window algorithm
-        for ii in range(int(nsplits_w)):
-            for jj in range(int(nsplits_h)):
-                x_start, x_end = ii * kernel_w, (ii + 1) * kernel_w
-                y_start, y_end = jj * kernel_h, (jj + 1) * kernel_h
-                img_slice = img_data[x_start:x_end, y_start:y_end]
-
-                # Disregard slices that are only zeros
-                if np.nanmax(img_slice) == 0:
-                    continue
-                # Otherwise update the zeros array at the appropriate slice with the new values
-                else:
-                    new_img_data[:, :, slice_num] = img_slice
-                    slice_num += 1
+        # Split the mosaic into its tiles in a single operation, ordered row-wise across the rotated mosaic. The
+        # rotation swaps the dimensions of the mosaic, and therefore those of the tiles
+        tiles = img_data.reshape(nsplits_h, kernel_h, nsplits_w, kernel_w).transpose(0, 2, 1, 3)
+        tiles = tiles.reshape(nsplits_h * nsplits_w, kernel_h, kernel_w)
+
+        # Disregard slices that are only zeros
+        tiles = tiles[np.nanmax(tiles, axis=(1, 2)) != 0]
 
-        # Filter off slices that had only zeros
-        new_img_data = np.rot90(new_img_data[:, :, 0:slice_num], 3)
+        # Stack the remaining tiles along the slice dimension
+        new_img_data = np.rot90(tiles.transpose(1, 2, 0), 3)
         new_nifti = image.new_img_like(mosaic_nifti, new_img_data, affine=mosaic_nifti.affine)
         return new_nifti
 
@@ -893,16 +1407,13 @@ class DCM2NIFTI_Converter:
                     ]):
                 nifti_msg = f"NIFTI Additional Tweaks Scenario: Philips NIFTI featured Stored Values " \
                             f"that had to be converted to Philips Floating Point"
-                nifti_img: nib.Nifti1Image = image.load_img(str(self.path_final_nifti))
-                nifti_data: np.ndarray = image.get_data(nifti_img)
                 RI = json_sidecar_parms["PhilipsRescaleIntercept"]
                 RS = json_sidecar_parms["PhilipsRescaleSlope"]
                 SS = json_sidecar_parms["PhilipsScaleSlope"]
-                new_nifti_data = (nifti_data + (RI / RS)) / SS
-                new_nifti = nib.Nifti1Image(dataobj=new_nifti_data, header=nifti_img.header, affine=nifti_img.affine)
-                del nifti_img, nifti_data, RI, RS, SS, new_nifti_data
-                new_nifti.to_filename(str(self.path_final_nifti))
-                del new_nifti
+                # (value + RI / RS) / SS
+                applied_to = rescale_nifti(nifti_path=self.path_final_nifti, scale=1 / SS, offset=RI / (RS * SS),
+                                           rewrite_data=self.config.get("Rewrite Philips Data", False))
+                nifti_msg += f" (applied to the NIFTI {applied_to})"
                 json_sidecar_parms["UsePhilipsFloatNotDisplayScaling"] = 1
 
             # Another possibility: Array values were incorrectly converted to Display Values rather than Philips
@@ -915,14 +1426,10 @@ class DCM2NIFTI_Converter:
                       ]):
                 nifti_msg = f"NIFTI Additional Tweaks Scenario: Philips NIFTI featured arrays values " \
                             f"that were incorrectly converted to Display Values rather than Philips Floating Point."
-                nifti_img: nib.Nifti1Image = image.load_img(str(self.path_final_nifti))
-                nifti_data: np.ndarray = image.get_data(nifti_img)
                 RS, SS = json_sidecar_parms["PhilipsRescaleSlope"], json_sidecar_parms["PhilipsScaleSlope"]
-                new_nifti_data = nifti_data / (RS * SS)
-                new_nifti = nib.Nifti1Image(dataobj=new_nifti_data, header=nifti_img.header, affine=nifti_img.affine)
-                del nifti_img, nifti_data, RS, SS, new_nifti_data
-                new_nifti.to_filename(str(self.path_final_nifti))
-                del new_nifti
+                applied_to = rescale_nifti(nifti_path=self.path_final_nifti, scale=1 / (RS * SS), offset=0,
+                                           rewrite_data=self.config.get("Rewrite Philips Data", False))
+                nifti_msg += f" (applied to the NIFTI {applied_to})"
 
             else:
                 nifti_msg = f"NIFTI Additional Tweaks Scenario: Philips NIFTI already had proper values."
@@ -1,6 +1,9 @@
-from os import cpu_count, environ
+from os import cpu_count
+from os.path import normcase
 from itertools import chain
 from time import sleep
+from threading import Lock
+from typing import Dict
 from datetime import datetime
 from more_itertools import peekable
 from PySide2.QtCore import *
@@ -8,22 +11,24 @@ from PySide2.QtGui import *
 from PySide2.QtWidgets import *
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
+from watchdog.observers.api import ObservedWatch
 from src.xASL_GUI_HelperClasses import DandD_FileExplorer2LineEdit
 from src.xASL_GUI_Executor_ancillary import *
+from src.xASL_utils_CoreScheduler import CoreScheduler
+from src.xASL_utils_ExploreASL import (RUN_OPTION_MODULES, StudyPreparationError, ExploreASLOutputParser,
+                                       count_remaining_work, load_study_parms, check_matlab_version, prepare_worker_env,
+                                       get_worker_command, start_worker_process, monitor_worker_process, kill_proc_tree,
+                                       pause_resume_proc_tree, remove_locked_dirs, merge_worker_logs)
 from src.xASL_GUI_AnimationClasses import xASL_ImagePlayer, xASL_Lab
 from src.xASL_GUI_Executor_Modjobs import (xASL_GUI_RerunPrep, xASL_GUI_TSValter,
                                            xASL_GUI_ModSidecars, xASL_GUI_MergeDirs)
 from src.xASL_GUI_HelperFuncs_WidgetFuncs import (set_widget_icon, make_droppable_clearable_le, set_formlay_options,
-                                                  robust_qmsg, dir_check, robust_getdir)
+                                                  robust_qmsg, robust_getdir)
 from pprint import pprint
 from collections import defaultdict
-import subprocess
-from shutil import rmtree, which
 from pathlib import Path
 from functools import partial
 from platform import system
-import signal
-import psutil
 import re
 import logging
 
@@ -38,7 +43,11 @@ class ExploreASL_Worker(QRunnable):
     Worker thread for running lauching an ExploreASL MATLAB session with the given arguments
     """
 
-    def __init__(self, worker_parms, iworker, nworkers, imodules, worker_env):
+    def __init__(self, worker_parms, iworker, nworkers, imodules, worker_env, ilog=None):
+        """
+        :param ilog: the index of this worker among all workers launched for the study, which names its temporary log.
+        Defaults to iworker; it must differ from it once the same study has had several ExploreASL invocations.
+        """
         super().__init__()
         # Main Attributes
         self.worker_parms: dict = worker_parms
@@ -56,12 +65,7 @@ class ExploreASL_Worker(QRunnable):
         self.proc_gone, self.proc_alive = [], []
 
         # Parsing Attributes
-        self.regex_errstart = re.compile(r"ERROR: Job iteration terminated!")
-        self.regex_errend = re.compile(r"CONT: but continue with next iteration!")
-        self.regex_findtarget = re.compile(r"ASL_module_(ASL|Structural|Population)"
-                                           r"(?:%%%([^#%&{}\\<>*?/$!'\":@+`|=]+))?"
-                                           r"(?:%%%([^#%&{}\\<>*?/$!'\":@+`|=]+))?\b")
-        self.is_collecting_stdout_err = False
+        self.output_parser = ExploreASLOutputParser()
         self.has_easl_errors = False
 
         # Set up the Logging-related Attributes
@@ -70,7 +74,7 @@ class ExploreASL_Worker(QRunnable):
         except KeyError:
             study_name: str = f"Unspecified Study Name"
         self.logger = logging.Logger(name=study_name, level=logging.DEBUG)
-        basename = f"tmp_RunWorker_{str(self.iworker).zfill(3)}.log"
+        basename = f"tmp_RunWorker_{str(self.iworker if ilog is None else ilog).zfill(3)}.log"
         self.handler = logging.FileHandler(filename=Path(self.analysis_dir) / basename, mode='w')
         self.handler.setFormatter(logging.Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s\n%(message)s"))
         self.handler.setLevel(logging.DEBUG)
@@ -85,120 +89,27 @@ class ExploreASL_Worker(QRunnable):
                            f"\tDataPar Path: {self.par_path}\n"
                            f"\tIModules: {self.imodules}", msg_type="info")
 
-    # noinspection RegExpRedundantEscape
     def run(self):
         ##################################################
         # PREPARE ARGUMENTS AND RUN THE UNDERLYING PROGRAM
         ##################################################
         self.print_and_log(f"Worker {self.iworker}: Beginning Run", msg_type="info")
         self.print_and_log(f"Worker {self.iworker}: ExploreASL Type = {self.easl_scenario}", msg_type="info")
-        if self.easl_scenario == "LOCAL_UNCOMPILED":
-            mpath = self.worker_parms["WORKER_MATLAB_CMD_PATH"]
-            exploreasl_path = self.worker_parms["MyPath"]
-            process_data = 1
-            skip_pause = 1
-
-            # Generate the string that the command line will feed into the MATLAB session
-            func_line = f"('{self.par_path}', {process_data}, {skip_pause}, {self.iworker}, {self.nworkers}, " \
-                        f"[{' '.join([str(item) for item in self.imodules])}])"
-            matlab_cmd = "matlab" if which("matlab") is not None else mpath
-            if self.worker_parms["WORKER_MATLAB_VER"] >= 2019:
-                cmd_path = [f"{matlab_cmd}", "-nodesktop", "-nosplash", "-batch",
-                            f"cd('{exploreasl_path}'); ExploreASL_Master{func_line}; exit"]
-            else:
-                cmd_path = [f"{matlab_cmd}", "-nosplash", "-nodisplay", "-r",
-                            f"cd('{exploreasl_path}'); ExploreASL_Master{func_line}; exit"]
-
-            # Prepare the Subprocess
-            self.print_and_log(f"Worker {self.iworker}: Preparing subprocess with the following commands:\n"
-                               f"{cmd_path}", msg_type="info")
-            if system() == "Windows":
-                self.print_and_log(f"Worker {self.iworker}: Was instructed to not create any windows as well.", "info")
-                self.proc = psutil.Popen(cmd_path, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                         creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                self.proc = psutil.Popen(cmd_path, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        elif self.easl_scenario == "LOCAL_COMPILED":
-            process_data = 1
-            skip_pause = 1
-            compiled_easl_path = self.worker_parms["MyCompiledPath"]
-            glob_pat = "*.exe" if system() == "Windows" else "*.sh"
-
-            # Ensure the easl launch script actually has executable permissions
-            compiled_easl_script = next(Path(compiled_easl_path).glob(glob_pat))
-            compiled_easl_script.chmod(0o775)
-            compiled_easl_script = str(compiled_easl_script)
-            # On Linux and Mac, the xASL_latest script also needs to be granted permission
-            if system() != "Windows":
-                ancillary_script = Path(compiled_easl_path).resolve() / "xASL_latest"
-                ancillary_script.chmod(0o775)
-
-            # Generate the string that the command line will feed into the complied MATLAB session
-            if system() == "Windows":
-                func_line = f'{self.par_path} {process_data} {skip_pause} {self.iworker} {self.nworkers} ' \
-                            f'"[{" ".join([str(item) for item in self.imodules])}]"'
-                cmd_line = f"{compiled_easl_script} {func_line}"
-                self.print_and_log(f"Worker {self.iworker}: Preparing subprocess with the following commands:\n"
-                                   f"{cmd_line}", msg_type="info")
-                self.proc = psutil.Popen(cmd_line, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                         env=self.worker_env, creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                linux_bs = f"'{self.imodules}'"
-                func_line = f'"{self.par_path} {process_data} {skip_pause} {self.iworker} {self.nworkers} {linux_bs}"'
-                cmd_line = [compiled_easl_script, self.worker_parms["MCRPath"], func_line]
-                self.print_and_log(f"Worker {self.iworker}: Preparing subprocess with the following commands:\n"
-                                   f"{' '.join(cmd_line)}", msg_type="info")
-                self.proc = psutil.Popen(cmd_line, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                         env=self.worker_env)
+        command = get_worker_command(self.worker_parms, self.iworker, self.nworkers, self.imodules)
+        self.print_and_log(f"Worker {self.iworker}: Preparing subprocess with the following commands:\n"
+                           f"{command if isinstance(command, str) else ' '.join(command)}", msg_type="info")
+        self.proc = start_worker_process(command, self.worker_env)
 
         #######################
         # LISTEN DURING THE RUN
         #######################
-        err_container, n_collected, module, subject, run, context = [], 0, None, None, None, ""
         self.is_running = True
-        while self.proc.is_running():
-
-            try:
-                if self.terminate_attempted or self.proc.status() == psutil.STATUS_ZOMBIE:
-                    break
-            except psutil.NoSuchProcess:
-                break
-
-            output = self.proc.stdout.readline().strip()  # This line is blocking in nature
-            print(f"{output=}")
-            # Break out of the process is no longer running
-            if output == '' and self.proc.poll() is not None:
-                break
-
-            # TODO When ExploreASL grants the ability to latch onto a new module/subject/run, get those givens to
-            #  refresh the context of the error
-            # elif self.regex_findtarget.search(output):
-            #     module, subject, run = self.regex_findtarget.search(output).groups()
-            #     context = f"Given the following context:\nModule:\t{module}\nSubject:\t{subject}\nRun:\t{run}"
-
-            # If the line is the start of an error message, activate collecting mode
-            elif self.regex_errstart.search(output):
-                self.is_collecting_stdout_err = True
-                self.has_easl_errors = True
-
-            # If the line is the end of an error message, deactivate collecting mode and log the error away
-            elif self.regex_errend.search(output) or n_collected > 50:
-                err_container.append("")
-                msg = "\n".join(err_container)
-                self.print_and_log(f"Worker {self.iworker} detected the following Error message from "
-                                   f"ExploreASL:{context}\n{msg}")
-                err_container.clear()
-                self.is_collecting_stdout_err = False
-                n_collected = 0
-
-            # Collect ExploreASL error output if collecting mode is on
-            if self.is_collecting_stdout_err and output not in {"", " ", "\n"}:
-                err_container.append(output)
-                n_collected += 1
-                print(output)
-
-        _, stderr = self.proc.communicate()
+        stderr = monitor_worker_process(
+            self.proc, self.logger, self.output_parser,
+            on_error=lambda err_msg: self.print_and_log(f"Worker {self.iworker} detected the following Error "
+                                                        f"message from ExploreASL:\n{err_msg}"),
+            should_stop=lambda: self.terminate_attempted)
+        self.has_easl_errors = self.output_parser.has_easl_errors
         self.print_and_log(f"Worker {self.iworker}: has received return code {self.proc.returncode}", msg_type="info")
         self.is_running = False
         if self.terminate_attempted:
@@ -239,13 +150,13 @@ class ExploreASL_Worker(QRunnable):
     def terminate_run(self):
         # First attempt to wake all processes back up
         if self.is_paused:
-            self.pause_resume_proc_tree(pid=self.proc.pid, pause=False, include_parent=True)
+            pause_resume_proc_tree(pid=self.proc.pid, pause=False, include_parent=True)
 
         self.terminate_attempted = True
         if self.is_running:
             self.print_and_log(f"Worker {self.iworker}: Received a TERMINATE signal. Stopping all child processes now",
                                msg_type="warning")
-            self.proc_gone, self.proc_alive = self.kill_proc_tree(pid=self.proc.pid, include_parent=True)
+            self.proc_gone, self.proc_alive = kill_proc_tree(pid=self.proc.pid, include_parent=True)
             self.signals.signal_inform_output.emit(f"Worker {self.iworker} of {self.nworkers} for study "
                                                    f"{str(self.analysis_dir)} is now terminating")
 
@@ -253,7 +164,7 @@ class ExploreASL_Worker(QRunnable):
     def pause_run(self):
         self.print_and_log(f"Worker {self.iworker}: Received a Request to Pause all Work. Attempting to pause all "
                            f"child processes now", msg_type="info")
-        self.pause_resume_proc_tree(pid=self.proc.pid, pause=True, include_parent=True)
+        pause_resume_proc_tree(pid=self.proc.pid, pause=True, include_parent=True)
         self.is_paused = True
         self.signals.signal_inform_output.emit(f"Worker {self.iworker} of {self.nworkers} for study "
                                                f"{str(self.analysis_dir)} is now pausing")
@@ -267,47 +178,12 @@ class ExploreASL_Worker(QRunnable):
     def resume_run(self):
         self.print_and_log(f"Worker {self.iworker}: Received a Request to Resume all Work. Attempting to wake up all "
                            f"child processes now", msg_type="info")
-        self.pause_resume_proc_tree(pid=self.proc.pid, pause=False, include_parent=True)
+        pause_resume_proc_tree(pid=self.proc.pid, pause=False, include_parent=True)
         print(f"{self.proc.status()=}")
         self.is_paused = False
         self.signals.signal_inform_output.emit(f"Worker {self.iworker} of {self.nworkers} for study"
                                                f"{str(self.analysis_dir)} is now resuming")
 
-    @staticmethod
-    def kill_proc_tree(pid, sig=signal.SIGTERM, include_parent=True, timeout=None, on_terminate=None):
-        """Kill a process tree (including grandchildren) with signal "sig" and return a (gone, still_alive) tuple.
-        "on_terminate", if specified, is a callback function which is called as soon as a child terminates.
-        """
-        parent = psutil.Process(pid)
-        children = parent.children(recursive=True)
-        if include_parent:
-            children.append(parent)
-        for p in children:
-            try:
-                p.send_signal(sig)
-            except psutil.NoSuchProcess as no_proc_err:
-                print(f"Received a NoSuchProcessError: {no_proc_err}")
-        gone, alive = psutil.wait_procs(children, timeout=timeout, callback=on_terminate)
-        return gone, alive
-
-    @staticmethod
-    def pause_resume_proc_tree(pid, pause: bool, include_parent=True):
-        """Pause a process tree (including grandchildren)
-        """
-        parent = psutil.Process(pid)
-        children = parent.children(recursive=True)
-        if include_parent:
-            children.append(parent)
-        proc: psutil.Process
-        for proc in children:
-            try:
-                if pause:
-                    proc.suspend()
-                else:
-                    proc.resume()
-            except psutil.NoSuchProcess:
-                pass
-
 
 # noinspection PyCallingNonCallable,PyAttributeOutsideInit,PyCallByClass
 class xASL_Executor(QMainWindow):
@@ -330,6 +206,7 @@ class xASL_Executor(QMainWindow):
 
         # Other instance variables
         self.threadpool = QThreadPool()
+        self.status_monitor = None
         self.movie_path = Path(self.config["ProjectDir"]) / "media" / "EASL_Running.gif"
 
         # MISC VARIABLES
@@ -337,7 +214,9 @@ class xASL_Executor(QMainWindow):
         self.red_palette.setColor(QPalette.Highlight, Qt.red)
         self.green_palette = QPalette()
         self.green_palette.setColor(QPalette.Highlight, Qt.green)
-        self.total_process_dbt = 0
+        self.core_scheduler = None
+        self.study_runs: Dict[str, dict] = {}
+        self.btn_connections = []
         with open(Path(self.config["ProjectDir"]) / "JSON_LOGIC" / "ExecutorTranslators.json") as translator_reader:
             self.exec_translators = json.load(translator_reader)
         with open(Path(self.config["ProjectDir"]) / "JSON_LOGIC" / "ErrorsListing.json") as exec_err_reader:
@@ -790,23 +669,102 @@ class xASL_Executor(QMainWindow):
             print(f"The progressbar's value after update: {selected_progbar.value()} "
                   f"out of maximum {selected_progbar.maximum()}")
 
+        # Progress may allow the core scheduler to hand idle cores to the study with the most remaining work
+        if self.core_scheduler is not None and not self.core_scheduler.is_finished:
+            self.launch_scheduled_workers()
+
+    @staticmethod
+    def report_workload_progress(progressbar: QProgressBar, n_done: int, n_total: int):
+        """
+        Shows the progress of calculating the anticipated workload of a study on its progressbar
+        :param progressbar: the progressbar of the study
+        :param n_done: the number of subjects gone through so far
+        :param n_total: the total number of subjects
+        """
+        progressbar.setMaximum(n_total)
+        progressbar.setValue(n_done)
+        # Repaint without accepting user input, which could otherwise start another run while this one is prepared
+        QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+    def launch_scheduled_workers(self):
+        """
+        Launches the workers that the core scheduler has assigned the free cores to
+        """
+        for launch in self.core_scheduler.schedule():
+            study_run = self.study_runs[launch.study_key]
+            worker = ExploreASL_Worker(
+                worker_parms=study_run["parms"],
+                iworker=launch.iworker,  # iWorker
+                nworkers=launch.nworkers,  # nWorkers
+                imodules=list(launch.imodules),  # Which modules Structural, ASL, Both, Population
+                worker_env=study_run["worker_env"],
+                ilog=launch.ilog
+            )
+            worker.signals.signal_finished_processing.connect(self.slot_post_run_processing)
+            worker.signals.signal_inform_output.connect(self.textedit_textoutput.append)
+            # Resume, Pause, and Stop Button Signals
+            stop_btn, pause_btn, resume_btn = study_run["buttons"]
+            for btn_signal, btn_slot in [(pause_btn.clicked, worker.pause_run), (resume_btn.clicked, worker.resume_run),
+                                         (stop_btn.clicked, worker.terminate_run)]:
+                btn_signal.connect(btn_slot)
+                self.btn_connections.append((btn_signal, btn_slot))
+
+            # The watcher of the study keeps watching for as long as any of the study's workers are running
+            study_run["watcher"].watch_debt -= 1
+            self.textedit_textoutput.append(f"Launching Worker {launch.iworker} of {launch.nworkers} (modules "
+                                            f"{list(launch.imodules)}) for study:\n{launch.study_key}")
+            self.threadpool.start(worker)
+
+    def slot_cancel_study(self, study_key: str):
+        """
+        Prevents any further workers from being launched for a study whose stop button was pressed. Its running workers
+        are terminated through their own connections to that button.
+        """
+        self.core_scheduler.cancel(study_key)
+        # If the study had yet to receive any cores, nothing else remains to end the run
+        if self.core_scheduler.is_finished:
+            self.post_run_processing()
+
+    def slot_hold_study(self, study_key: str, is_held: bool):
+        """
+        Holds back the launching of further workers for a paused study, or resumes it
+        """
+        self.core_scheduler.set_held(study_key, is_held)
+        if not is_held:
+            self.launch_scheduled_workers()
+
     @Slot(tuple, str)
     def slot_post_run_processing(self, exit_signature: Tuple[bool], study_dir: str):
         """
         exit_signature is a tuple of booleans in the form: has_been_terminated, has_easl_errs, has_crashed
         """
-        self.total_process_dbt += 1
         self.processing_summary_dict[study_dir].append(exit_signature)
 
-        # Do not proceed until the total debt is cleared
-        if self.total_process_dbt != 0:
-            return
-
-        ###################################
-        # Otherwise post-processing happens
+        # The core of the finished worker is handed over to any workers that should now be launched; only then may the
+        # watcher of the study account for the finished worker, lest it stop watching before the study's next worker
+        self.core_scheduler.release(study_dir)
+        self.launch_scheduled_workers()
+        self.study_runs[study_dir]["watcher"].slot_increment_debt()
 
-        # Re-activate all relevant widgets
+        # Do not proceed until every study has finished
+        if not self.core_scheduler.is_finished:
+            return
+        self.post_run_processing()
+
+    def post_run_processing(self):
+        # Every worker has finished by this point; stop the watchers of any studies that never received a core, then
+        # the monitor they shared
+        for study_run in self.study_runs.values():
+            study_run["watcher"].stop()
+        if self.status_monitor is not None:
+            self.status_monitor.stop()
+            self.status_monitor = None
+
+        # Re-activate all relevant widgets and detach the buttons from this run's workers
         self.set_widgets_activation_states(True)
+        for btn_signal, btn_slot in self.btn_connections:
+            btn_signal.disconnect(btn_slot)
+        self.btn_connections.clear()
 
         # Stop the movies
         movie: xASL_ImagePlayer
@@ -821,31 +779,36 @@ class xASL_Executor(QMainWindow):
         for (study_dir, exit_signatures), progbar in zip(self.processing_summary_dict.items(),
                                                          self.formlay_progbars_list):
 
-            # TODO Perhaps re-introduce checking which .status files were actually made. The attribute
-            #  self.expected_status_files can still be used for this purpose
-            # For a given study, make sure the progressbar is full, which implies all files have been made
-            if progbar.value() != progbar.maximum():
+            # For a given study, make sure all the expected .status files have been made; the study's index is
+            # queried instead of the lock dir, since the watcher kept it up to date during the run. It is refreshed
+            # first, as the events of the last STATUS files may not have been delivered before watching stopped; only
+            # the lock dirs modified since they were last listed are listed again
+            study_dir = Path(study_dir).resolve()
+            status_index = get_status_index(study_dir)
+            status_index.refresh()
+            is_complete, incomplete_files = calculate_missing_STATUS(study_dir,
+                                                                     self.expected_status_files.get(study_dir, []),
+                                                                     status_index=status_index)
+            status_index.save()
+            # The progressbar is also fed by the watcher's events; bring it in line with the refreshed index
+            if is_complete and progbar.value() != progbar.maximum():
+                progbar.setValue(progbar.maximum())
+            if not is_complete or progbar.value() != progbar.maximum():
                 progbar.setPalette(self.red_palette)
-                s_missinglocks.append(study_dir)
+                s_missinglocks.append(str(study_dir))
+            if not is_complete:
+                interpreted = interpret_statusfile_errors(study_dir, incomplete_files, self.exec_translators)
+                for module_msg in chain(*interpreted) if interpreted is not None else []:
+                    self.textedit_textoutput.append(module_msg)
+
+            # A study without any exit signatures is one that was stopped before it received a core
+            if len(exit_signatures) == 0:
+                s_terminated.append(str(study_dir))
+                continue
 
             # Next, for a given study, clean up the temporary worker log files into a single log
-            study_dir = Path(study_dir).resolve()
-            tmp_worker_files = sorted(study_dir.glob("tmp_RunWorker_*.log"))
-            if len(tmp_worker_files) == 0:
+            if merge_worker_logs(study_dir) is None:
                 continue
-            content = []
-            for tmp_file in tmp_worker_files:
-                with open(tmp_file) as tmp_reader:
-                    content.append(tmp_reader.read())
-                tmp_file.unlink(missing_ok=True)
-
-            # Concatenate content to write, prepare the log dir & file, then write to it
-            to_write = "\n\n".join(content)
-            err_write_date_str = datetime.now().strftime("%a-%b-%d-%Y_%H-%M-%S")
-            dst_logfile = study_dir / "Logs" / "Processing Logs" / f"Run_Log_{err_write_date_str}.log"
-            dst_logfile.parent.mkdir(parents=True, exist_ok=True)
-            with open(dst_logfile, "w") as log_writer:
-                log_writer.write(to_write)
 
             # Finally, parse the exit signatures
             b_userterm, b_has_easlerrs, b_has_crashed = tuple(zip(*exit_signatures))
@@ -908,54 +871,20 @@ class xASL_Executor(QMainWindow):
                 pause_btn.setEnabled(not state)
                 resume_btn.setEnabled(not state)
 
-    ###################
-    # PRE-RUN QC CHECKS
-    ###################
-    def runcheck_matlab_ver(self):
-        # Immediately abandon this if the MATLAB version is not compatible with batch commands
-        mlab_ver = self.config.get("MATLAB_VER", None)
-        mlab_path = self.config.get("MATLAB_CMD_PATH", None)
-        if mlab_ver is None or not isinstance(mlab_ver, str):
-            robust_qmsg(self, title=self.exec_errs["Unknown MATLAB VERSION"][0],
-                        body=self.exec_errs["Unknown MATLAB VERSION"][1])
-            return False, None
-
-        # Immediately abandone this if the MATLAB command path is not known
-        if mlab_path is None or not Path(mlab_path).resolve().exists():
-            robust_qmsg(self, title=self.exec_errs["Unknown MATLAB CMD_PATH"][0],
-                        body=self.exec_errs["Unknown MATLAB CMD_PATH"][1])
-            return False, None
-
-        try:
-            mlab_ver = int(re.search(r"R(\d{4})[ab]", mlab_ver).group(1))
-            # Immediately abandon this if the MATLAB version is too old
-            if mlab_ver < 2016:
-                robust_qmsg(self, title=self.exec_errs["Incompatible MATLAB Version"][0],
-                            body=self.exec_errs["Incompatible MATLAB Version"][1], variables=[str(mlab_ver)])
-                return False, None
-            # Or if too old for Windows due to the lack of the -nodisplay option
-            if system() == "Windows" and not mlab_ver >= 2019:
-                robust_qmsg(self, title=self.exec_errs["Incompatible MATLAB Version"][0],
-                            body=self.exec_errs["Incompatible MATLAB Version"][1], variables=[str(mlab_ver)])
-                return False, None
-        # Or if something went wrong getting the version
-        except AttributeError:
-            robust_qmsg(self, title=self.exec_errs["Unknown MATLAB VERSION"][0],
-                        body=self.exec_errs["Unknown MATLAB VERSION"][1])
-            return False, None
-        return True, mlab_ver
-
     ###################################################################################################################
     #                                              THE MAIN RUN FUNCTION
     ###################################################################################################################
     def run_Explore_ASL(self):
         if self.config["DeveloperMode"]:
             print("%" * 60)
-        translator = {"Structural": [1], "ASL": [2], "Both": [1, 2], "Population": [3]}
-        self.workers = []
         self.watchers = []
-        self.total_process_dbt = 0
+        self.status_monitor = ExploreASL_StatusMonitor()
         self.expected_status_files = {}
+        # The cores selected across all rows form a single budget; cores freed by one study are handed to the others
+        self.core_scheduler = CoreScheduler(total_cores=sum(int(box.currentText())
+                                                            for box in self.formlay_cmbs_ncores_list))
+        # Dict whose keys are study dirs paths (str) and values are what is needed to launch that study's workers
+        self.study_runs = {}
 
         # Dict whose keys are study dirs paths (str) and values are lists of booleans of whether a worker had errors
         self.processing_summary_dict = defaultdict(list)
@@ -977,11 +906,6 @@ class xASL_Executor(QMainWindow):
             #########################################
             # INNER FOR LOOP - For a particular study
             #########################################
-            # Create a container to keep a block of workers in for a particular study
-            # Also create a debt counter to be fed to the watcher so that it can eventually disengage
-            inner_worker_block = []
-            debt = 0
-
             # Step 1 - For the study, load in the parameters
             forbidden = {"", ".", "/", "\\", "~"}
             if path.text() in forbidden:
@@ -992,172 +916,34 @@ class xASL_Executor(QMainWindow):
 
             ana_path = Path(path.text().replace("~", str(Path.home()))).resolve()
             try:
-                parms_file = next(ana_path.glob("DataPar*.json"))
-            except StopIteration:
-                robust_qmsg(self, title=self.exec_errs["DataPar File Not Found"][0],
-                            body=self.exec_errs["DataPar File Not Found"][1], variables=[str(ana_path)])
-                return
-
-            # Load in the DataPar.json file and Extract essential parameters
-            try:
-                # First load in the file
-                with open(parms_file) as f:
-                    parms: dict = json.load(f)
-
-                str_regex: str = parms["subject_regexp"].strip("^$")
-                regex: re.Pattern = re.compile(str_regex)
-                easl_scenario: str = parms["EXPLOREASL_TYPE"]
-                excluded_subjects: list = parms["exclusion"]
-                root_in_parms: str = parms["D"]["ROOT"]
-
-            except json.decoder.JSONDecodeError as json_read_error:
-                robust_qmsg(self, title=self.exec_errs["BadDataParFileJson"][0],
-                            body=self.exec_errs["BadDataParFileJson"][1],
-                            variables=[str(ana_path), f"{json_read_error}"])
-                return
-            except KeyError as parms_keyerror:
-                robust_qmsg(self, title=self.exec_errs["BadDataParFileKeys"][0],
-                            body=self.exec_errs["BadDataParFileKeys"][1],
-                            variables=[str(ana_path), f"{parms_keyerror}"])
-                return
-
-            # Check that the parms file's D.ROOT matches the lineedit's resolved filepath
-            if root_in_parms != str(ana_path):
-                robust_qmsg(self, title=self.exec_errs["NoStartExploreASL"][0],
-                            body=self.exec_errs["NoStartExploreASL"][1], variables=[str(ana_path)])
-                return
-
-            # Regex check for subject hits
-            hits = []
-            for subject_path in ana_path.iterdir():
-                if any([subject_path.name in {"lock", "Population", "Logs"}, subject_path.is_file(),
-                        subject_path.name in excluded_subjects]):
-                    continue
-                hits.append(bool(regex.search(subject_path.name)))
-            if not any(hits):
-                robust_qmsg(self, title=self.exec_errs["NoStartExploreASL"][0],
-                            body=self.exec_errs["NoStartExploreASL"][1], variables=[str(ana_path)])
-                return
-
-            # Perform the appropriate checks depending on the ExploreASL Scenario (local, compiled, docker, etc.)
-            if easl_scenario == "LOCAL_UNCOMPILED":
-                # If it is a local version, then the MATLAB version and the path to the MATLAB command must be legit
-                can_proceed, int_mlab_ver = self.runcheck_matlab_ver()
-                if not can_proceed:
-                    return
-                else:
-                    parms["WORKER_MATLAB_VER"] = int_mlab_ver
+                parms = load_study_parms(ana_path)
+                # Perform the appropriate checks depending on the ExploreASL Scenario (local, compiled, docker, etc.)
+                if parms["EXPLOREASL_TYPE"] == "LOCAL_UNCOMPILED":
+                    # If it is a local version, then the MATLAB version and the path to the MATLAB command must be legit
+                    parms["WORKER_MATLAB_VER"] = check_matlab_version(self.config.get("MATLAB_VER", None),
+                                                                      self.config.get("MATLAB_CMD_PATH", None))
                     parms["WORKER_MATLAB_CMD_PATH"] = self.config["MATLAB_CMD_PATH"]
-            elif easl_scenario == "LOCAL_COMPILED":
-                pass
-            else:
-                robust_qmsg(self, title=self.exec_errs["Unsupported ExploreASL Scenario"][0],
-                            body=self.exec_errs["Unsupported ExploreASL Scenario"][1], variables=[str(ana_path)])
-                return
-
-            # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 2 - Prepare the environment for that study
-            worker_env = environ.copy()
-            if easl_scenario == "LOCAL_UNCOMPILED":
-                pass
-            elif easl_scenario == "LOCAL_COMPILED":
-                # First, get the Runtime path
-                runtime_path = parms.get("MCRPath", None)
-                if runtime_path is None:
-                    robust_qmsg(self, title=self.exec_errs["Unknown MATLAB Runtime"][0],
-                                body=self.exec_errs["Unknown MATLAB Runtime"][1])
-                    return
-                runtime_path = Path(runtime_path).resolve()
-
-                # Last-minute quality control for the nature of the MATLAB Runtime path
-                system_dict = {"Windows": ["PATH", ";", "win64"],
-                               "Linux": ["LD_LIBRARY_PATH", ":", "glnxa64"],
-                               "Darwin": ["DYLD_LIBRARY_PATH", ":", "maci64"]}
-                x = system()
-                runtime_paths = peekable(runtime_path.rglob(system_dict[x][2]))
-                is_dir_valid, runtime_path = dir_check(runtime_path, self,
-                                                       {"basename_fits_regex": ["v\\d{2}", []],
-                                                        "rcontains": [system_dict[x][2], []]
-                                                        }, qmsgs=False)
-                if not is_dir_valid:
-                    robust_qmsg(self, title=self.exec_errs["Bad MATLAB Runtime"][0],
-                                body=self.exec_errs["Bad MATLAB Runtime"][1],
-                                variables=[str(ana_path)])
-                    return
 
-                try:
-                    current_paths = worker_env.get(system_dict[x][0], "")
-                    if isinstance(current_paths, (list, tuple)):
-                        current_paths = "".join(current_paths)
-                    located_paths = [str(path) for path in runtime_paths if
-                                     all([path.is_dir(), str(path) not in current_paths])]
-                    paths2add = system_dict[x][1].join(located_paths)
-                    current_paths += paths2add
-                    worker_env[system_dict[x][0]] = current_paths
-                except KeyError:
-                    return
-
-                # Next, check the compiled EASL Directory
-                compiled_easl = parms.get("MyCompiledPath", None)
-                if compiled_easl is None:
-                    robust_qmsg(self, title=self.exec_errs["Unknown CompiledEASL Directory"][0],
-                                body=self.exec_errs["Unknown CompiledEASL Directory"][1],
-                                variables=[str(ana_path)])
-                    return
-                if system() == "Windows":
-                    is_dir_valid, compiled_easl = dir_check(compiled_easl, self,
-                                                            {"contains": ["*.ctf", []]
-                                                             }, qmsgs=False)
-                else:
-                    is_dir_valid, compiled_easl = dir_check(compiled_easl, self,
-                                                            {"contains": ["*.ctf", []],
-                                                             "child_file_exists": ["xASL_latest", []]
-                                                             }, qmsgs=False)
-                if not is_dir_valid:
-                    robust_qmsg(self, title=self.exec_errs["Bad CompiledEASL Directory"][0],
-                                body=self.exec_errs["Bad CompiledEASL Directory"][1],
-                                variables=[str(ana_path)])
-                    return
-
-            # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 3 - Prepare the workers for that study
-            # Inner for loop: loops over the range of the num of cores within a study. Each core will be an iWorker
-            for ii in range(box.count()):
-                if ii < int(box.currentText()):
-                    worker = ExploreASL_Worker(
-                        worker_parms=parms,
-                        iworker=ii + 1,  # iWorker
-                        nworkers=int(box.currentText()),  # nWorkers
-                        imodules=translator[run_opts.currentText()],  # Which modules Structural, ASL, Both, Population
-                        worker_env=worker_env
-                    )
-
-                    inner_worker_block.append(worker)
-                    debt -= 1
-                    self.total_process_dbt -= 1
-
-            # Add the block to the main workers argument
-            self.workers.append(inner_worker_block)
+                # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+                # Step 2 - Prepare the environment for that study
+                worker_env = prepare_worker_env(parms, ana_path)
+            except StudyPreparationError as prep_err:
+                err_title, err_body = prep_err.get_title_and_body(self.exec_errs)
+                robust_qmsg(self, title=err_title, body=err_body, variables=prep_err.variables)
+                return
+            str_regex: str = parms["subject_regexp"].strip("^$")
 
             # %%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 4 - Calculate the anticipated workload based on missing .STATUS files; adjust the progressbar's
+            # Step 3 - Calculate the anticipated workload based on missing .STATUS files; adjust the progressbar's
             # maxvalue from that
             # This now ALSO makes the lock dirs that do not exist
-            workload, expected_status_files = calculate_anticipated_workload(parmsdict=parms,
-                                                                             run_options=run_opts.currentText(),
-                                                                             translators=self.exec_translators)
+            # The progressbar shows how many subjects have been gone through while the workload is being calculated
+            workload, expected_status_files = calculate_anticipated_workload(
+                parmsdict=parms, run_options=run_opts.currentText(), translators=self.exec_translators,
+                progress_callback=partial(self.report_workload_progress, progressbar))
 
             # Also delete any directories called "locked" in the study
-            locked_dirs = peekable(ana_path.rglob("locked"))
-            if locked_dirs:
-                if self.config["DeveloperMode"]:
-                    print(f"Detected locked direcorties in {ana_path} prior to starting ExploreASL. Removing.")
-                for lock_dir in locked_dirs:
-                    try:
-                        lock_dir.rmdir()
-                    except OSError as lock_err:  # Just in case a user tampers with the lock directory
-                        print(f"{lock_err}...but proceeding to recursive delete")
-                        rmtree(path=lock_dir, ignore_errors=True)
+            remove_locked_dirs(ana_path, verbose=self.config["DeveloperMode"])
 
             # Abort if no viable workload was detected
             if not workload or len(expected_status_files) == 0:
@@ -1175,26 +961,30 @@ class xASL_Executor(QMainWindow):
 
             # Save the expected status files to the dict container; these will be iterated over after workers are done
             self.expected_status_files[ana_path] = expected_status_files
+            # Bring the index of the study's STATUS files up to date once; the watcher keeps it so during the run
+            status_index = get_status_index(ana_path, refresh=True)
             if self.config["DeveloperMode"]:
                 print(f"EXPECTED STATUS FILES TO BE GENERATED FOR STUDY: {str(ana_path)}")
                 pprint(sorted(expected_status_files))
 
             # %%%%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 5 - Create a Watcher for that study
-            watcher = ExploreASL_Watcher(target=path.text(),  # the analysis directory
+            # Step 4 - Create a Watcher for that study
+            watcher = ExploreASL_Watcher(target=str(ana_path),  # the resolved analysis directory
                                          regex=str_regex,  # the regex used to recognize subjects
-                                         watch_debt=debt,  # the debt used to determine when to stop watching
+                                         watch_debt=0,  # the debt used to determine when to stop watching
                                          study_idx=study_idx,
                                          # the identifier used to know which progressbar to signal
                                          translators=self.exec_translators,
                                          config=self.config,
                                          anticipated_paths=set(expected_status_files),
-                                         datapar_dict=parms
+                                         datapar_dict=parms,
+                                         monitor=self.status_monitor,
+                                         status_index=status_index
                                          )
-            self.textedit_textoutput.append(f"Setting a Watcher thread on {str(ana_path)}")
+            self.textedit_textoutput.append(f"Setting a Watcher on {str(ana_path)}")
 
             # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 6 - Set up watcher connections
+            # Step 5 - Set up watcher connections
             # Connect the watcher to signal to the text output
             watcher.signals.update_text_output_signal.connect(self.textedit_textoutput.append)
             # Connect the watcher to signal to the progressbar
@@ -1204,30 +994,34 @@ class xASL_Executor(QMainWindow):
             self.watchers.append(watcher)
 
             # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-            # Step 7 - Set up worker connections
-            # Worker connections setup within a study
-            for idx, worker in enumerate(inner_worker_block):
-                # Revamped worker signals
-                worker.signals.signal_finished_processing.connect(watcher.slot_increment_debt)
-                worker.signals.signal_finished_processing.connect(self.slot_post_run_processing)
-                worker.signals.signal_inform_output.connect(self.textedit_textoutput.append)
-                # Resume, Pause, and Stop Button Signals
-                pause_btn.clicked.connect(worker.pause_run)
-                resume_btn.clicked.connect(worker.resume_run)
-                stop_btn.clicked.connect(worker.terminate_run)
-
-                self.textedit_textoutput.append(
-                    f"Preparing Worker {idx + 1} of {len(inner_worker_block)} for study:\n{ana_path}")
+            # Step 6 - Register the study with the core scheduler, which launches its workers as cores become
+            # available; the studies higher up in the Task Scheduler take priority
+            study_key = str(ana_path)
+            self.study_runs[study_key] = {"parms": parms, "worker_env": worker_env, "watcher": watcher,
+                                          "buttons": (stop_btn, pause_btn, resume_btn)}
+            self.core_scheduler.add_study(study_key, n_cores=int(box.currentText()),
+                                          remaining_work=partial(count_remaining_work, watcher.pending_status_files,
+                                                                 RUN_OPTION_MODULES[run_opts.currentText()]))
+            # Keeps the studies in the same order as their progressbars for the post-run summary
+            self.processing_summary_dict[study_key] = []
 
         ######################################
         # THIS IS NOW OUTSIDE OF THE FOR LOOPS
 
-        # self.watchers is nested at this point; we need to flatten it
-        self.workers = list(chain(*self.workers))
-
-        # Launch all threads in one go
-        for runnable in self.workers + self.watchers:
-            self.threadpool.start(runnable)
+        # Every study is ready; only now are the buttons of each study connected to the core scheduler
+        for study_key, study_run in self.study_runs.items():
+            stop_btn, pause_btn, resume_btn = study_run["buttons"]
+            for btn_signal, btn_slot in [(stop_btn.clicked, partial(self.slot_cancel_study, study_key)),
+                                         (pause_btn.clicked, partial(self.slot_hold_study, study_key, True)),
+                                         (resume_btn.clicked, partial(self.slot_hold_study, study_key, False))]:
+                btn_signal.connect(btn_slot)
+                self.btn_connections.append((btn_signal, btn_slot))
+
+        # The watchers share the single observer of the status monitor rather than occupying the pool
+        for watcher in self.watchers:
+            watcher.start()
+        self.status_monitor.start()
+        self.launch_scheduled_workers()
 
         self.set_widgets_activation_states(False)
 
@@ -1237,7 +1031,7 @@ class xASL_Executor(QMainWindow):
 
 class ExploreASL_WatcherSignals(QObject):
     """
-    Defines the signals avaliable from a running watcher thread.
+    Defines the signals avaliable from a running watcher.
     """
     update_progbar_signal = Signal(int, int)
     update_text_output_signal = Signal(str)
@@ -1245,22 +1039,41 @@ class ExploreASL_WatcherSignals(QObject):
 
 
 # noinspection PyCallingNonCallable
-class ExploreASL_Watcher(QRunnable):
+class ExploreASL_Watcher(QObject):
     """
     Modified file system watcher. Will monitor the appearance of STATUS files within the lock dirs of the analysis
     directory. If it detects a STATUS file, it will emit signals to:
     1) update the progress bars
     2) inform the text editor view of which STATUS file was made so as to give user feedback
-    3)
+    The watcher lives in the main thread and holds no thread of its own; the watchdog observer delivers events to the
+    handler, which queues them until the watcher processes them as a single batch. Watching stops as soon as the
+    last worker of the study has finished.
     """
 
     def __init__(self, target, regex, watch_debt, study_idx, translators, config, anticipated_paths: set,
-                 datapar_dict: dict):
+                 datapar_dict: dict, monitor: "ExploreASL_StatusMonitor" = None, debounce_ms: int = 250,
+                 status_index: StatusIndex = None):
+        """
+        :param monitor: the status monitor through which many studies share a single observer. The owner of the
+        monitor is responsible for starting and stopping it. If None, the watcher creates, starts, and stops its own
+        observer, which recursively watches the whole lock dir of the study.
+        :param debounce_ms: the milliseconds for which events are accumulated before being processed as a batch. Only
+        used without a monitor, which otherwise does the batching.
+        :param status_index: the index of the study's STATUS files, which the watcher keeps up to date. If None, the
+        shared index of the study is used.
+        """
         super().__init__()
         self.signals = ExploreASL_WatcherSignals()
         self.dir_to_watch = Path(target) / "lock"
         self.anticipated_paths: set = anticipated_paths
         self.datapar_dict = datapar_dict
+        self.status_index = get_status_index(target) if status_index is None else status_index
+
+        # The anticipated STATUS filenames of each lock dir that have yet to appear; this replaces globbing the lock
+        # dir for the STATUS files already present whenever a module starts
+        self.pending_status_files: Dict[Path, set] = defaultdict(set)
+        for anticipated_path in self.anticipated_paths:
+            self.pending_status_files[Path(anticipated_path).parent].add(Path(anticipated_path).name)
 
         # Regexes
         self.subject_regex = re.compile(regex)
@@ -1275,6 +1088,7 @@ class ExploreASL_Watcher(QRunnable):
         self.watch_debt = watch_debt
         self.study_idx = study_idx
         self.config = config
+        self.is_watching = False
 
         self.pop_mod_started = False
         self.struct_mod_started = False
@@ -1282,21 +1096,24 @@ class ExploreASL_Watcher(QRunnable):
 
         self.msgs_seen: set = set()
 
-        self.observer = Observer()
+        self.monitor = monitor
+        self.observer = Observer() if monitor is None else None
         self.event_handler = ExploreASL_EventHandler()
-        self.event_handler.signals.inform_file_creation.connect(self.process_message)
-        self.observer.schedule(event_handler=self.event_handler,
-                               path=str(self.dir_to_watch),
-                               recursive=True)
+        self.event_handler.signals.inform_events_pending.connect(self.slot_events_pending)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(debounce_ms)
+        self.flush_timer.timeout.connect(self.process_pending_events)
         path_key = "MyPath" if self.datapar_dict["EXPLOREASL_TYPE"] == "LOCAL_UNCOMPILED" else "MyCompiledPath"
 
-        if all([is_earlier_version(easl_dir=self.datapar_dict[path_key], threshold_higher=120, higher_eq=False),
+        easl_version = get_exploreasl_version(self.datapar_dict[path_key])
+        if all([is_version_before(easl_version, ExploreASLVersion(1, 2, 0)),
                 len(list(self.dir_to_watch.parent.glob("*/*FLAIR*"))) == 0
                 ]):
             self.struct_status_file_translator = translators["Structural_Module_Filename2Description_PRE120_NOFLAIR"]
         else:
             self.struct_status_file_translator: dict = translators["Structural_Module_Filename2Description"]
-        if is_earlier_version(easl_dir=self.datapar_dict[path_key], threshold_higher=140, higher_eq=False):
+        if is_version_before(easl_version, ExploreASLVersion(1, 4, 0)):
             self.asl_status_file_translator: dict = translators["ASL_Module_Filename2Description_PRE140"]
         else:
             self.asl_status_file_translator: dict = translators["ASL_Module_Filename2Description"]
@@ -1342,9 +1159,19 @@ class ExploreASL_Watcher(QRunnable):
 
         return msgs_to_return
 
+    @Slot()
+    def slot_events_pending(self):
+        # Events arriving within the debounce interval of the first are processed together
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    @Slot()
+    def process_pending_events(self):
+        for created_path, is_directory in self.event_handler.drain():
+            self.process_message(created_path, is_directory)
+
     # Processes the information sent from the event hander and emits signals to update widgets in the main Executor
-    @Slot(str)
-    def process_message(self, created_path):
+    def process_message(self, created_path: str, is_directory: bool):
         if created_path in self.msgs_seen:
             print(f"{created_path} was already seen")
             return
@@ -1353,6 +1180,8 @@ class ExploreASL_Watcher(QRunnable):
 
         detected_subject = self.subject_regex.search(created_path)
         detected_module = self.module_regex.search(created_path)
+        if detected_module is None:
+            return
 
         created_path = Path(created_path)
         msg = None
@@ -1360,10 +1189,10 @@ class ExploreASL_Watcher(QRunnable):
         files_to_skip = []
 
         if created_path.name == "locked":  # Lock dir
-            n_statfile = len(list(created_path.parent.glob("*.status")))
-            if detected_module.group(1) == "Structural" and n_statfile < len(self.struct_status_file_translator.keys()):
+            is_incomplete = len(self.pending_status_files.get(created_path.parent, ())) > 0
+            if detected_module.group(1) == "Structural" and is_incomplete:
                 msg = f"Structural Module has started for subject: {detected_subject.group()}"
-            elif detected_module.group(1) == "ASL" and n_statfile < len(self.asl_status_file_translator.keys()):
+            elif detected_module.group(1) == "ASL" and is_incomplete:
                 msg = f"ASL Module has started for subject: {detected_subject.group()}"
             elif detected_module.group(1) == "Population" and not self.pop_mod_started:
                 self.pop_mod_started = True
@@ -1371,7 +1200,9 @@ class ExploreASL_Watcher(QRunnable):
             else:
                 pass
 
-        elif created_path.is_file():  # Status file
+        elif not is_directory and created_path.suffix == ".status":  # Status file
+            self.pending_status_files[created_path.parent].discard(created_path.name)
+            self.status_index.add(created_path)
             if detected_module.group(1) == "Structural" and detected_subject:
                 msg = f"Completed {self.struct_status_file_translator[created_path.name]} in the Structural module " \
                       f"for subject: {detected_subject.group()}"
@@ -1387,7 +1218,7 @@ class ExploreASL_Watcher(QRunnable):
                 msg = f"Completed {self.pop_status_file_translator[created_path.name]} in the Population module"
                 # files_to_skip = self.determine_skip(which_dict="Population", created_status_path=created_path)
 
-            workload_val = self.workload_translator[created_path.name]
+            workload_val = self.workload_translator.get(created_path.name)
 
         else:
             pass
@@ -1412,38 +1243,165 @@ class ExploreASL_Watcher(QRunnable):
     @Slot(tuple, str)
     def slot_increment_debt(self):
         self.watch_debt += 1
+        if self.watch_debt >= 0:
+            self.stop()
 
-    def run(self):
-        self.observer.start()
+    @property
+    def watch_dirs(self) -> List[Path]:
+        """
+        The lock dirs in which STATUS files (and the "locked" dirs of running modules) are anticipated to appear.
+        These are the only parts of the lock tree that have to be watched.
+        """
+        return sorted(self.pending_status_files.keys())
+
+    def start(self):
+        """
+        Begins watching the lock dir of the study. Does not block.
+        """
+        if self.monitor is None:
+            self.observer.schedule(event_handler=self.event_handler, path=str(self.dir_to_watch), recursive=True)
+            self.observer.start()
+        else:
+            self.monitor.register(self)
+        self.is_watching = True
         if self.config["DeveloperMode"]:
             print(f"THE WATCHER FOR {self.dir_to_watch} HAS STARTED")
-        while self.watch_debt < 0:
-            sleep(10)
-        self.observer.stop()
-        self.observer.join()
+
+    def stop(self):
+        """
+        Stops watching the lock dir of the study, after processing any events that have yet to be processed
+        """
+        if not self.is_watching:
+            return
+        self.is_watching = False
+        if self.monitor is None:
+            self.observer.stop()
+            self.observer.join()
+            self.flush_timer.stop()
+            self.process_pending_events()
+        else:
+            self.monitor.unregister(self)
         if self.config["DeveloperMode"]:
             print(f"THE WATCHER FOR {self.dir_to_watch} IS SHUTTING DOWN")
-        return
+
+
+class ExploreASL_StatusMonitor(QObject):
+    """
+    Central monitor of the STATUS files of every study being run. A single watchdog observer and event handler serve
+    all studies, with a single recursive watch on the lock dir of each study (each watch costs the observer a thread
+    and, on Linux, an inotify instance, so the individual lock dirs within are not watched separately). Events are
+    accumulated for a short interval and then routed by their path to the watcher of the study whose anticipated lock
+    dirs contain them; events elsewhere in the lock tree are disregarded.
+    """
+
+    def __init__(self, debounce_ms: int = 250):
+        """
+        :param debounce_ms: the milliseconds for which events are accumulated before being processed as a batch
+        """
+        super().__init__()
+        self.observer = Observer()
+        self.event_handler = ExploreASL_EventHandler()
+        self.event_handler.signals.inform_events_pending.connect(self.slot_events_pending)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(debounce_ms)
+        self.flush_timer.timeout.connect(self.process_pending_events)
+
+        # Anticipated lock dir (as a case-normalized string, like the parents of its events) -> the watcher of its study
+        self.routes: Dict[str, ExploreASL_Watcher] = {}
+        # Watched lock dir of a study -> its watch, alongside the watchers making use of it
+        self.watches: Dict[str, ObservedWatch] = {}
+        self.watch_users: Dict[str, set] = defaultdict(set)
+        self.is_running = False
+
+    def register(self, watcher: ExploreASL_Watcher):
+        """
+        Begins watching the lock dir of a study on behalf of its watcher
+        """
+        lock_dir = str(watcher.dir_to_watch)
+        if lock_dir not in self.watches:
+            # Only the lock dir itself must exist; ExploreASL creates the lock dirs within as it reaches them
+            watcher.dir_to_watch.mkdir(exist_ok=True)
+            self.watches[lock_dir] = self.observer.schedule(event_handler=self.event_handler, path=lock_dir,
+                                                            recursive=True)
+        self.watch_users[lock_dir].add(watcher)
+        for watch_dir in watcher.watch_dirs:
+            self.routes[normcase(str(watch_dir))] = watcher
+
+    def unregister(self, watcher: ExploreASL_Watcher):
+        """
+        Stops watching the lock dir of a study, after routing any events that have yet to be processed
+        """
+        self.process_pending_events()
+        lock_dir = str(watcher.dir_to_watch)
+        self.watch_users[lock_dir].discard(watcher)
+        if len(self.watch_users[lock_dir]) == 0 and lock_dir in self.watches:
+            try:
+                self.observer.unschedule(self.watches.pop(lock_dir))
+            except KeyError:  # The observer was already stopped
+                pass
+        self.routes = {watch_dir: routed_to for watch_dir, routed_to in self.routes.items() if routed_to is not watcher}
+
+    def start(self):
+        self.observer.start()
+        self.is_running = True
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.observer.stop()
+        self.observer.join()
+        self.flush_timer.stop()
+        self.process_pending_events()
+
+    @Slot()
+    def slot_events_pending(self):
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    @Slot()
+    def process_pending_events(self):
+        for created_path, is_directory in self.event_handler.drain():
+            watcher = self.routes.get(normcase(str(Path(created_path).parent)))
+            if watcher is not None:
+                watcher.process_message(created_path, is_directory)
 
 
 class ExploreASL_EventHanderSignals(QObject):
     """
     Defines the signals used by the EventHandler class
     """
-    inform_file_creation = Signal(str)
+    inform_events_pending = Signal()
 
 
 class ExploreASL_EventHandler(FileSystemEventHandler):
     """
-    The real watcher behind the scenes
+    The real watcher behind the scenes. Runs within the watchdog observer's thread, where it queues created paths
+    and informs the watcher only when the queue goes from empty to non-empty, such that a burst of events results in
+    a single cross-thread signal.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.signals = ExploreASL_EventHanderSignals()
+        self.pending: List[Tuple[str, bool]] = []
+        self.lock = Lock()
 
     def on_created(self, event):
-        self.signals.inform_file_creation.emit(event.src_path)
+        with self.lock:
+            self.pending.append((event.src_path, event.is_directory))
+            was_empty = len(self.pending) == 1
+        if was_empty:
+            self.signals.inform_events_pending.emit()
+
+    def drain(self) -> List[Tuple[str, bool]]:
+        """
+        :return: the (path, is_directory) pairs of the creation events received since the last drain, in order
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        return pending
 
 
 class RowAwareQPushButton(QPushButton):
@@ -4,6 +4,7 @@ from PySide2.QtCore import Signal, QSize, Slot
 from src.xASL_GUI_HelperClasses import DandD_FileExplorer2LineEdit, DandD_FileExplorer2ListWidget
 from src.xASL_GUI_HelperFuncs_DirOps import *
 from src.xASL_GUI_HelperFuncs_WidgetFuncs import set_formlay_options, robust_qmsg, robust_getdir, robust_getfile
+from src.xASL_utils_StatusIndex import get_status_index
 import pandas as pd
 from functools import partial
 from pathlib import Path
@@ -358,8 +359,10 @@ class xASL_GUI_RerunPrep(QWidget):
         self.setWindowTitle("Explore ASL - Re-run setup")
         self.setMinimumSize(400, 720)
         self.mainlay = QVBoxLayout(self)
+        # The lock tree is taken from the study's index of STATUS files rather than listed anew
+        self.status_index = get_status_index(self.root_dir, refresh=True)
         self.directory_struct = dict()
-        self.directory_struct["lock"] = self.get_path_directory_structure(self.root_dir / "lock")
+        self.directory_struct["lock"] = self.status_index.get_tree()
 
         self.lock_tree = QTreeWidget(self)
         self.lock_tree.setToolTip(self.parent.exec_tips["Modjob_RerunPrep"]["lock_tree"])
@@ -377,15 +380,6 @@ class xASL_GUI_RerunPrep(QWidget):
         self.mainlay.addWidget(self.lock_tree)
         self.mainlay.addWidget(self.btn)
 
-    def get_path_directory_structure(self, rootdir: Path):
-        directory = {}
-        for path in sorted(rootdir.iterdir()):
-            if path.is_dir():
-                directory[path.name] = self.get_path_directory_structure(path)
-            else:
-                directory[path.name] = None
-        return directory
-
     def fill_tree(self, parent, d):
         if isinstance(d, dict):
             for key, value in d.items():
@@ -434,12 +428,14 @@ class xASL_GUI_RerunPrep(QWidget):
 
         for filepath in filepaths:
             filepath.unlink(missing_ok=True)
+            self.status_index.discard(filepath)
+        self.status_index.save()
 
         # Clear the tree
         self.lock_tree.clear()
         # Refresh the file structure
         self.directory_struct.clear()
-        self.directory_struct["lock"] = self.get_path_directory_structure(self.root_dir / "lock")
+        self.directory_struct["lock"] = self.status_index.get_tree()
         # Refresh the tree
         self.fill_tree(self.lock_tree.invisibleRootItem(), self.directory_struct)
         self.lock_tree.expandToDepth(2)
@@ -1,40 +1,30 @@
 from pathlib import Path
 import re
 from platform import system
-from typing import List, Tuple, Union
+from typing import Callable, Iterable, List, Tuple, Union
+from src.xASL_utils_Version import ExploreASLVersion, get_exploreasl_version, is_version_before
+from src.xASL_utils_StatusIndex import StatusIndex, get_status_index
+import fnmatch
 import json
+import os
 
 
 def is_earlier_version(easl_dir: Union[Path, str], threshold_higher: int = 140, higher_eq: bool = True,
                        threshold_lower: int = 0, lower_eq: bool = True):
     """
     Helper function to determine whether a given ExploreASL directory is between some set of integer thresholds
-    representing the versions.
+    representing the versions. Kept for callers of the integer thresholds; see get_exploreasl_version for the
+    structured version.
 
     Returns True if no Version file can be ascertained
     """
-    flags = []
-    ver_regex = re.compile(r"VERSION_(.*)")
-    easl_dir = Path(easl_dir).resolve()
-    if not easl_dir.exists():
+    ver = get_exploreasl_version(easl_dir)
+    if ver is None:
         return True
-    try:
-        ver_file = next(easl_dir.rglob("VERSION_*"))
-    except StopIteration:
-        return True
-    ver = int(ver_regex.search(str(ver_file)).group(1).replace(".", ""))
-    if higher_eq:
-        flags.append(True if ver <= threshold_higher else False)
-    else:
-        flags.append(True if ver < threshold_higher else False)
-    if lower_eq:
-        flags.append(True if ver >= threshold_lower else False)
-    else:
-        flags.append(True if ver > threshold_lower else False)
-    if all(flags):
-        return True
-    else:
-        return False
+    higher = ExploreASLVersion.from_legacy_int(threshold_higher)
+    lower = ExploreASLVersion.from_legacy_int(threshold_lower)
+    return all([ver <= higher if higher_eq else ver < higher,
+                ver >= lower if lower_eq else ver > lower])
 
 
 def is_valid_for_analysis(path: Path, parms: dict, glob_dict: dict):
@@ -62,194 +52,169 @@ def is_valid_for_analysis(path: Path, parms: dict, glob_dict: dict):
     return True
 
 
-def calculate_anticipated_workload(parmsdict, run_options, translators):
+# The STATUS files anticipated from each module; which files are made depends on the version of ExploreASL
+STRUCTURAL_STATUS_FILES = ("010_LinearReg_T1w2MNI.status", "020_LinearReg_FLAIR2T1w.status",
+                           "030_FLAIR_BiasfieldCorrection.status", "040_LST_Segment_FLAIR_WMH.status",
+                           "050_LST_T1w_LesionFilling_WMH.status", "060_Segment_T1w.status",
+                           "070_CleanUpWMH_SEGM.status", "080_Resample2StandardSpace.status",
+                           "090_GetVolumetrics.status", "100_VisualQC_Structural.status", "999_ready.status")
+STRUCTURAL_STATUS_FILES_PRE130_NOFLAIR = ("010_LinearReg_T1w2MNI.status", "060_Segment_T1w.status",
+                                          "080_Resample2StandardSpace.status", "090_GetVolumetrics.status",
+                                          "100_VisualQC_Structural.status", "999_ready.status")
+ASL_STATUS_FILES_PRE140 = ("020_RealignASL.status", "030_RegisterASL.status", "040_ResampleASL.status",
+                           "050_PreparePV.status", "060_ProcessM0.status", "070_Quantification.status",
+                           "080_CreateAnalysisMask.status", "090_VisualQC_ASL.status", "999_ready.status")
+ASL_STATUS_FILES = ("020_RealignASL.status", "030_RegisterASL.status", "040_ResampleASL.status",
+                    "050_PreparePV.status", "060_ProcessM0.status", "070_CreateAnalysisMask.status",
+                    "080_Quantification.status", "090_VisualQC_ASL.status", "999_ready.status")
+POPULATION_STATUS_FILES = ("010_CreatePopulationTemplates.status", "020_CreateAnalysisMask.status",
+                           "030_CreateBiasfield.status", "040_GetDICOMStatistics.status",
+                           "050_GetVolumeStatistics.status", "060_GetMotionStatistics.status",
+                           "065_GetRegistrationStatistics.status", "070_GetROIstatistics.status",
+                           "080_SortBySpatialCoV.status", "090_DeleteAndZip.status", "999_ready.status")
+
+
+def scan_dir_names(directory: Union[Path, str]) -> Tuple[List[str], List[str]]:
+    """
+    Lists a directory once
+    :param directory: the directory to list
+    :return: the names of all entries, and the names of the entries that are directories. Both are empty if the
+    directory does not exist or cannot be read.
+    """
+    names, dir_names = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        dir_names.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return names, dir_names
+
+
+def is_valid_listing(parms: dict, has_flair_img: bool, has_m0_img: bool, has_asl_img: bool):
     """
-    Convenience function for calculating the anticipated workload
+    Helper function. Given the parameters from DataPar.json and which images a subject or session has, determine
+    whether it should be processed or skipped.
+    """
+    return not any([parms["SkipIfNoM0"] and not has_m0_img,
+                    parms["SkipIfNoASL"] and not has_asl_img,
+                    parms["SkipIfNoFlair"] and not has_flair_img])
+
+
+def calculate_anticipated_workload(parmsdict, run_options, translators,
+                                   progress_callback: Callable[[int, int], None] = None):
+    """
+    Convenience function for calculating the anticipated workload. The study is gone through in a single pass; each
+    subject directory, run directory and lock dir is listed only once, and the ExploreASL version is resolved only
+    once. Does not interact with any widgets and may therefore be run off the GUI thread.
     :param parmsdict: the parameter file of the study; given parameters such as the regex are used from this
     :param run_options: "Structural", "ASL", "Both" or "Population"; which module is being run
     :param translators: The ExecutorTranslators, primarily for calculating the workload
+    :param progress_callback: an optional function receiving the number of subjects gone through so far and the total
+    number of subjects, called after each subject
     :return: workload; a numerical representation of the cumulative value of all status files made; these will be
-    used to determine the appropriate maximum value for the progressbar
+    used to determine the appropriate maximum value for the progressbar. Also returns the sorted list of the expected
+    status files.
     """
-
-    def get_structural_workload(analysis_directory: Path, parms: dict, incl_regex: re.Pattern,
-                                workload_translator: dict):
-        path_key = "MyPath"
-        structuralmod_dict = {}
-        status_files = []
-        workload = {"010_LinearReg_T1w2MNI.status", "020_LinearReg_FLAIR2T1w.status",
-                    "030_FLAIR_BiasfieldCorrection.status", "040_LST_Segment_FLAIR_WMH.status",
-                    "050_LST_T1w_LesionFilling_WMH.status", "060_Segment_T1w.status", "070_CleanUpWMH_SEGM.status",
-                    "080_Resample2StandardSpace.status", "090_GetVolumetrics.status", "100_VisualQC_Structural.status",
-                    "999_ready.status"}
-        glob_dictionary = {"ASL": "*/*ASL*.nii*", "FLAIR": "*FLAIR.nii*", "M0": "*/*M0.nii*"}
-
-        for subject_path in analysis_directory.iterdir():
-            # Disregard files, standard directories, subjects that fail regex, and subjects that are to be excluded
-            if any([subject_path.is_file(), subject_path.name in ["Population", "lock", "Logs"],
-                    # subject_path.name in parms["dataset"]["exclusion"],
-                    not incl_regex.search(subject_path.name)]):
-                continue
-            # Account for SkipIfNo flags
-            if not is_valid_for_analysis(path=subject_path, parms=parms, glob_dict=glob_dictionary):
-                continue
-
-            # Account for version 1.2.1 and earlier
-            has_flair = len(list(subject_path.glob(glob_dictionary["FLAIR"]))) > 0
-            if is_earlier_version(parms[path_key], threshold_higher=130) and not has_flair:
-                workload = {"010_LinearReg_T1w2MNI.status", "060_Segment_T1w.status",
-                            "080_Resample2StandardSpace.status", "090_GetVolumetrics.status",
-                            "100_VisualQC_Structural.status", "999_ready.status"}
-
-            lock_dir: Path = analysis_directory / "lock" / "xASL_module_Structural" / subject_path.name / \
-                             "xASL_module_Structural"
-            if not lock_dir.exists():
-                lock_dir.mkdir(parents=True)
-            filtered_workload = [lock_dir / name for name in workload if not (lock_dir / name).exists()]
-            # Filter out any anticipated status files that are already present in the lock dirs
-            status_files.extend(filtered_workload.copy())
-            num_repr = sum([workload_translator[stat_file.name] for stat_file in filtered_workload])
-            structuralmod_dict[subject_path.name] = num_repr
-
-        return structuralmod_dict, status_files
-
-    def get_asl_workload(analysis_directory, parms: dict, workload_translator: dict, incl_regex: re.Pattern,
-                         conditions: List[Tuple[str, bool]] = None):
-        path_key = "MyPath"
-        aslmod_dict = {}
-        status_files = []
-        glob_dictionary = {"ASL": "*ASL*.nii*", "FLAIR": "*FLAIR.nii*", "M0": "*M0.nii*"}
-        # OLD EXPECTATION
-        if is_earlier_version(parms[path_key], threshold_higher=140, higher_eq=False):
-            workload = {"020_RealignASL.status", "030_RegisterASL.status", "040_ResampleASL.status",
-                        "050_PreparePV.status", "060_ProcessM0.status", "070_Quantification.status",
-                        "080_CreateAnalysisMask.status", "090_VisualQC_ASL.status", "999_ready.status"}
-        # NEW EXPECTATION
-        else:
-            workload = {"020_RealignASL.status", "030_RegisterASL.status", "040_ResampleASL.status",
-                        "050_PreparePV.status", "060_ProcessM0.status", "070_CreateAnalysisMask.status",
-                        "080_Quantification.status", "090_VisualQC_ASL.status", "999_ready.status"}
-
-        # The "060_ProcessM0.status" file is never generated if an integer or float is the value for the M0 parameter
-        if isinstance(parms["M0"], (int, float)):
-            workload.remove("060_ProcessM0.status")
-
-        # conditions is a list of tuples whose first element is a workload filename that may be impacted and whose
-        # second element is a boolean that defines whether to remove it or not
-        if conditions is None:
-            conditions = []
-        for condition in conditions:
-            filename, to_remove = condition
-            if to_remove:
-                workload.remove(filename)
-
-        # Must iterate through both the subject level listing AND the session level (ASL_1, ASL_2, etc.) listing
-        for subject_path in analysis_directory.iterdir():
-            # Disregard files, standard directories, subjects that fail regex and subjects that are to be excluded
-            if any([subject_path.is_file(), subject_path.name in ["Population", "lock", "Logs"],
-                    # subject_path.name in parms["dataset"]["exclusion"],
-                    not incl_regex.search(subject_path.name)]):
-                continue
-            aslmod_dict[subject_path.name] = {}
-            for run_path in subject_path.iterdir():
-                if run_path.is_file():  # This is kept separate since many files are expected
-                    continue
-                if not is_valid_for_analysis(path=run_path, parms=parms, glob_dict=glob_dictionary):
-                    continue
-
-                # Deduce the lock dir path and make it if it doesn't exist
-                lock_dir: Path = analysis_directory / "lock" / "xASL_module_ASL" / subject_path.name / \
-                                 f"xASL_module_ASL_{run_path.name}"
-                if not lock_dir.exists():
-                    lock_dir.mkdir(parents=True)
-
-                # Filter out any anticipated status files that are already present in the lock dirs
-                filtered_workload = [lock_dir / name for name in workload if not (lock_dir / name).exists()]
-                status_files.extend(filtered_workload)
-                # Calculate the numerical representation of the STATUS files workload
-                num_repr = sum([workload_translator[stat_file.name] for stat_file in filtered_workload])
-                aslmod_dict[subject_path.name][run_path.name] = num_repr
-
-        return aslmod_dict, status_files
-
-    def get_population_workload(analysis_directory, workload_translator):
-        workload = {"010_CreatePopulationTemplates.status", "020_CreateAnalysisMask.status",
-                    "030_CreateBiasfield.status", "040_GetDICOMStatistics.status", "050_GetVolumeStatistics.status",
-                    "060_GetMotionStatistics.status", "065_GetRegistrationStatistics.status",
-                    "070_GetROIstatistics.status", "080_SortBySpatialCoV.status", "090_DeleteAndZip.status",
-                    "999_ready.status"}
-        directory = analysis_directory / "lock" / "xASL_module_Population" / "xASL_module_Population"
-        if not directory.exists():
-            directory.mkdir(parents=True)
-        status_files = [directory / name for name in workload if not (directory / name).exists()]
-        numerical_representation = sum([workload_translator[stat_file.name] for stat_file in status_files])
-        return numerical_representation, status_files
+    if run_options not in {"Structural", "ASL", "Both", "Population"}:
+        print("THIS SHOULD NEVER PRINT AS YOU HAVE SELECTED AN IMPOSSIBLE WORKLOAD OPTION")
+        return None
 
     # Define the individual translators and analysis directory
     filename2workload = translators["ExploreASL_Filename2Workload"]
     analysis_dir = Path(parmsdict["D"]["ROOT"])
+    lock_root = analysis_dir / "lock"
     subject_regex = re.compile(parmsdict["subject_regexp"])
 
-    # Account for conditions that influence whether a .status file is to be removed from the expected workload or not
-    asl_conditions = []
-    # for statfile, corresponding_key, default in zip(["085_PVCorrection.status"],
-    #                                                 ["bPVCorrectionNativeSpace"],
-    #                                                 [True]):
-    #     try:
-    #         asl_conditions.append((statfile, not parmsdict[corresponding_key]))
-    #     except KeyError:
-    #         asl_conditions.append((statfile, default))
-
-    # Update the dicts as appropriate
-    if run_options == "Both":
-        s_res = get_structural_workload(analysis_dir, parms=parmsdict, workload_translator=filename2workload,
-                                        incl_regex=subject_regex)
-        struct_dict, struct_status = s_res
-        a_res = get_asl_workload(analysis_dir, parms=parmsdict, workload_translator=filename2workload,
-                                 conditions=asl_conditions, incl_regex=subject_regex)
-        asl_dict, asl_status = a_res
-
-        struct_totalworkload = sum(struct_dict.values())
-        asl_totalworkload = sum([sum(subject_dict.values()) for subject_dict in asl_dict.values()])
-
-        print(f"Structural Calculated Workload: {struct_totalworkload}")
-        print(f"ASL Calculated Workload: {asl_totalworkload}")
-        # Return the numerical sum of the workload and the combined list of the expected status files
-        return struct_totalworkload + asl_totalworkload, sorted(struct_status + asl_status)
-
-    elif run_options == "ASL":
-        a_res = get_asl_workload(analysis_dir, parms=parmsdict, workload_translator=filename2workload,
-                                 conditions=asl_conditions, incl_regex=subject_regex)
-        asl_dict, asl_status = a_res
-        asl_totalworkload = sum([sum(subject_dict.values()) for subject_dict in asl_dict.values()])
-        print(f"ASL Calculated Workload: {asl_totalworkload}")
-        # Return the numerical sum of the workload and the list of expected status files
-        return asl_totalworkload, asl_status
-
-    elif run_options == "Structural":
-        s_res = get_structural_workload(analysis_dir, parms=parmsdict, workload_translator=filename2workload,
-                                        incl_regex=subject_regex)
-        struct_dict, struct_status = s_res
-        struct_totalworkload = sum(struct_dict.values())
-        print(f"Structural Calculated Workload: {struct_totalworkload}")
-        # Return the numerical sum of the workload and the list of expected status files
-        return struct_totalworkload, sorted(struct_status)
-
-    elif run_options == "Population":
-        pop_totalworkload, pop_status = get_population_workload(analysis_dir, workload_translator=filename2workload)
+    def get_pending_status_files(lock_dir: Path, workload: Iterable[str]) -> List[Path]:
+        # Filter out any anticipated status files that are already present in the lock dir, making it if it is absent
+        present, _ = scan_dir_names(lock_dir)
+        if len(present) == 0 and not lock_dir.exists():
+            lock_dir.mkdir(parents=True)
+        present = set(present)
+        return [lock_dir / name for name in workload if name not in present]
+
+    if run_options == "Population":
+        pop_status = get_pending_status_files(lock_root / "xASL_module_Population" / "xASL_module_Population",
+                                              POPULATION_STATUS_FILES)
+        pop_totalworkload = sum([filename2workload[stat_file.name] for stat_file in pop_status])
         print(f"Population Calculated Workload: {pop_totalworkload}")
         # Return the numerical sum of the workload and the list of expected status files
-        return pop_totalworkload, pop_status
+        return pop_totalworkload, sorted(pop_status)
+
+    do_structural, do_asl = run_options in {"Structural", "Both"}, run_options in {"ASL", "Both"}
+
+    # The version of ExploreASL determines which STATUS files are anticipated
+    path_key = "MyPath"
+    easl_version = get_exploreasl_version(parmsdict[path_key])
+    is_pre130 = is_version_before(easl_version, ExploreASLVersion(1, 3, 0), inclusive=True)
+    asl_workload = list(ASL_STATUS_FILES_PRE140 if is_version_before(easl_version, ExploreASLVersion(1, 4, 0))
+                        else ASL_STATUS_FILES)
+    # The "060_ProcessM0.status" file is never generated if an integer or float is the value for the M0 parameter
+    if isinstance(parmsdict["M0"], (int, float)):
+        asl_workload.remove("060_ProcessM0.status")
+
+    # Disregard files, standard directories, and subjects that fail regex
+    _, subject_names = scan_dir_names(analysis_dir)
+    subject_names = sorted(name for name in subject_names
+                           if name not in {"Population", "lock", "Logs"} and subject_regex.search(name))
+
+    struct_totalworkload, asl_totalworkload, struct_status, asl_status = 0, 0, [], []
+    for n_done, subject in enumerate(subject_names, start=1):
+        subject_dir = analysis_dir / subject
+        subject_names_listing, run_names = scan_dir_names(subject_dir)
+        run_listings = {run: scan_dir_names(subject_dir / run)[0] for run in sorted(run_names)}
+
+        if do_structural:
+            has_flair = len(fnmatch.filter(subject_names_listing, "*FLAIR.nii*")) > 0
+            # Account for SkipIfNo flags; the ASL and M0 images are searched for within the runs of the subject
+            if is_valid_listing(parms=parmsdict, has_flair_img=has_flair,
+                                has_m0_img=any(fnmatch.filter(names, "*M0.nii*") for names in run_listings.values()),
+                                has_asl_img=any(fnmatch.filter(names, "*ASL*.nii*")
+                                                for names in run_listings.values())):
+                # Account for version 1.2.1 and earlier
+                workload = STRUCTURAL_STATUS_FILES_PRE130_NOFLAIR if is_pre130 and not has_flair \
+                    else STRUCTURAL_STATUS_FILES
+                pending = get_pending_status_files(lock_root / "xASL_module_Structural" / subject /
+                                                   "xASL_module_Structural", workload)
+                struct_status.extend(pending)
+                struct_totalworkload += sum([filename2workload[stat_file.name] for stat_file in pending])
+
+        if do_asl:
+            for run, run_names_listing in run_listings.items():
+                if not is_valid_listing(parms=parmsdict,
+                                        has_flair_img=len(fnmatch.filter(run_names_listing, "*FLAIR.nii*")) > 0,
+                                        has_m0_img=len(fnmatch.filter(run_names_listing, "*M0.nii*")) > 0,
+                                        has_asl_img=len(fnmatch.filter(run_names_listing, "*ASL*.nii*")) > 0):
+                    continue
+                pending = get_pending_status_files(lock_root / "xASL_module_ASL" / subject / f"xASL_module_ASL_{run}",
+                                                   asl_workload)
+                asl_status.extend(pending)
+                asl_totalworkload += sum([filename2workload[stat_file.name] for stat_file in pending])
 
-    else:
-        print("THIS SHOULD NEVER PRINT AS YOU HAVE SELECTED AN IMPOSSIBLE WORKLOAD OPTION")
+        if progress_callback is not None:
+            progress_callback(n_done, len(subject_names))
+
+    if do_structural:
+        print(f"Structural Calculated Workload: {struct_totalworkload}")
+    if do_asl:
+        print(f"ASL Calculated Workload: {asl_totalworkload}")
+    # Return the numerical sum of the workload and the combined list of the expected status files
+    return struct_totalworkload + asl_totalworkload, sorted(struct_status + asl_status)
 
 
 # Called after processing is done to compare the present status files against the files that were expected to be created
-# at the time the run was initialized
-def calculate_missing_STATUS(analysis_dir: Path, expected_status_files: List[Path]):
-    postrun_status_files = set((analysis_dir / "lock").rglob("*.status"))
-    incomplete = [file for file in expected_status_files if file not in postrun_status_files]
+# at the time the run was initialized. The status files present are taken from the study's index, which the watchers
+# keep up to date during the run, rather than by searching the lock dir again.
+def calculate_missing_STATUS(analysis_dir: Path, expected_status_files: List[Path], status_index: StatusIndex = None):
+    if status_index is None:
+        status_index = get_status_index(analysis_dir)
+    incomplete = status_index.get_missing(expected_status_files)
     if len(incomplete) == 0:
         return True, incomplete
     else:
@@ -279,10 +244,10 @@ def interpret_statusfile_errors(study_dir: Path, incomplete_files: List[Path], t
     struct_msgs = []  # list whose elements are string messages pertaining to the Structural module
     pop_msgs = []  # list whose elements are string messages pertaining to the Population
     stuct_status_file_translator = translators["Structural_Module_Filename2Description"]
-    if is_earlier_version(easl_dir=Path(parms[path_key]), threshold_higher=140, higher_eq=False):
-        asl_status_file_translator = translators["ASL_Module_Filename2Description"]
-    else:
+    if is_version_before(get_exploreasl_version(parms[path_key]), ExploreASLVersion(1, 4, 0)):
         asl_status_file_translator = translators["ASL_Module_Filename2Description_PRE140"]
+    else:
+        asl_status_file_translator = translators["ASL_Module_Filename2Description"]
     population_file_translator = translators["Population_Module_Filename2Description"]
 
     # Prepare regex detectors
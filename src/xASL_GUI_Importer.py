@@ -5,17 +5,20 @@ from src.xASL_GUI_HelperClasses import DandD_FileExplorer2LineEdit, xASL_PushBut
 from src.xASL_GUI_HelperFuncs_WidgetFuncs import set_formlay_options, robust_qmsg
 from src.xASL_GUI_Dehybridizer import xASL_GUI_Dehybridizer
 from src.xASL_GUI_DCM2NIFTI import *
+from src.xASL_utils_ImportEngine import DCM2NIFTI_ImportEngine, get_default_nworkers
+from src.xASL_utils_ImportSummary import ImportSummaryAccumulator
 from tdda import rexpy
 from pprint import pprint
 from collections import OrderedDict
-from more_itertools import divide, flatten, collapse
+from more_itertools import collapse
 import json
-from os import chdir
+from os import cpu_count
 from platform import system
 from pathlib import Path
-from typing import List, Iterator, Set
+from typing import Dict, List, Iterator, Set, Tuple
 import logging
 from datetime import datetime
+from math import ceil
 
 
 class Importer_WorkerSignals(QObject):
@@ -24,58 +27,101 @@ class Importer_WorkerSignals(QObject):
     """
     signal_send_summaries = Signal(list)  # Signal sent by worker to process the summaries of imported files
     signal_send_errors = Signal(list)  # Signal sent by worker to indicate the file where something has failed
+    signal_send_logs = Signal(list)  # Signal sent by worker to deliver the log records of converted directories
+    signal_send_timings = Signal(list)  # Signal sent by worker to deliver the per-stage timings of directories
+    signal_update_discovered = Signal(int)  # Signal sent by worker with the number of DICOM dirs discovered so far
     signal_update_progressbar = Signal()  # Signal sent by worker to indicate a completed directory
+    signal_finished = Signal()  # Signal sent by worker to indicate that all directories have been processed
     signal_confirm_terminate = Signal()  # Signal sent by worker to indicate a termination had occurred
 
 
 # noinspection PyUnresolvedReferences
 class Importer_Worker(QRunnable):
     """
-    Worker thread for running the import for a particular group.
+    Worker thread for running the import. The conversion itself takes place within a pool of processes managed by
+    DCM2NIFTI_ImportEngine; this thread streams the results of each DICOM directory back to the GUI as they arrive.
     """
 
-    def __init__(self, dcm_dirs: Iterator[Path], config: dict, use_legacy_mode: bool, name: str = None):
-        self.dcm_dirs: Iterator[Path] = dcm_dirs
+    def __init__(self, config: dict, use_legacy_mode: bool, n_workers: int = None, resume: bool = False,
+                 print_discovered: bool = False):
         self.import_config: dict = config
         self.use_legacy_mode: bool = use_legacy_mode
+        self.print_discovered: bool = print_discovered
         super().__init__()
         self.signals = Importer_WorkerSignals()
-        self.import_summaries = []
-        self.failed_runs = []
-        self.name = name
-        self._terminated = False
-
-        logger = logging.Logger(name=name, level=logging.DEBUG)
-        self.converter = DCM2NIFTI_Converter(config=config, name=name, logger=logger, b_legacy=use_legacy_mode)
-        print("Initialized Worker with args:\n")
+        self.engine = DCM2NIFTI_ImportEngine(config=config, use_legacy_mode=use_legacy_mode, n_workers=n_workers,
+                                             resume=resume)
+        print(f"Initialized Worker with {self.engine.n_workers} processes and args:\n")
         pprint(self.import_config)
 
+    def discover(self) -> Iterator[Path]:
+        """
+        Discovers the DICOM directories of each subject, handing them over to the engine as they are found such that
+        conversion starts while the remaining subjects are still being discovered
+        """
+        n_discovered = 0
+        for subject_dirs in iter_dicom_directories(config=self.import_config):
+            subject_dirs = list(collapse(subject_dirs))
+            if self.print_discovered:
+                print("Detected the following dicom directories:")
+                pprint(subject_dirs)
+            n_discovered += len(subject_dirs)
+            self.signals.signal_update_discovered.emit(n_discovered)
+            yield from subject_dirs
+
     def run(self):
-        for dicom_dir in self.dcm_dirs:
-            if not self._terminated:
-                success, job_description = self.converter.process_dcm_dir(dcm_dir=dicom_dir)
-                if success:
-                    self.import_summaries.append(self.converter.summary_data.copy())
-                    self.signals.signal_update_progressbar.emit()
-                else:
-                    self.failed_runs.append(job_description)
-                    self.signals.signal_update_progressbar.emit()
-
-        # Cleanup handlers and such
-        if not self._terminated:
-            self.converter.logger.removeHandler(self.converter.handler)
-
-            self.signals.signal_send_summaries.emit(self.import_summaries)
-            if len(self.failed_runs) > 0:
-                self.signals.signal_send_errors.emit(self.failed_runs)
+        for result in self.engine.run(self.discover()):
+            self.signals.signal_send_logs.emit([result["log"]])
+            self.signals.signal_send_timings.emit(result["timings"])
+            if result["success"]:
+                self.signals.signal_send_summaries.emit([result["summary"]])
+            else:
+                self.signals.signal_send_errors.emit([result["description"]])
+            self.signals.signal_update_progressbar.emit()
 
+        if not self.engine.terminated:
+            self.signals.signal_finished.emit()
         else:
             self.signals.signal_confirm_terminate.emit()
 
     @Slot()
     def slot_stop_import(self):
-        print(f"{self.name} received a termination signal! Terminating at the next available DICOM dir.")
-        self._terminated = True
+        print(f"Import worker received a termination signal! Terminating once the current DICOM dirs are finished.")
+        self.engine.stop()
+
+
+class Importer_LevelPreviewSignals(QObject):
+    """
+    Class for handling the signals sent by the level preview worker
+    """
+    signal_send_preview = Signal(str, int, dict)  # Sends the raw directory, the level index and the level's preview
+
+
+class Importer_LevelPreviewWorker(QRunnable):
+    """
+    Worker thread for listing the names found at a single depth below the raw directory and inferring a regex that
+    matches them, such that the GUI remains responsive when the raw directory is large
+    """
+
+    def __init__(self, raw_dir: str, level: int, max_regex_samples: int = 500):
+        """
+        :param raw_dir: the raw directory
+        :param level: the python index of the depth below the raw directory
+        :param max_regex_samples: the maximum number of names that the regex is inferred from
+        """
+        self.raw_dir: str = raw_dir
+        self.level: int = level
+        self.max_regex_samples: int = max_regex_samples
+        super().__init__()
+        self.signals = Importer_LevelPreviewSignals()
+
+    def run(self):
+        basenames = list_level_basenames(raw_dir=self.raw_dir, level=self.level)
+        # The names are already unique; an evenly-spaced subset of them keeps the inference time bounded
+        step = max(ceil(len(basenames) / self.max_regex_samples), 1)
+        samples = basenames[::step]
+        regex = xASL_GUI_Importer.infer_regex(samples) if len(samples) > 0 else None
+        self.signals.signal_send_preview.emit(self.raw_dir, self.level, {"basenames": basenames, "regex": regex})
 
 
 # noinspection PyCallingNonCallable
@@ -107,9 +153,13 @@ class xASL_GUI_Importer(QMainWindow):
         self.scan_aliases = dict.fromkeys(["ASL4D", "T1", "T2" "M0", "FLAIR"])
         self.cmb_runaliases_dict = {}
         self.threadpool = QThreadPool()
-        self.import_summaries = []
+        self.import_summaries = ImportSummaryAccumulator()
         self.failed_runs = []
+        self.import_logs = []
+        self.import_timings = []
         self.import_workers = []
+        self.level_previews: Dict[Tuple[str, int], dict] = {}  # The listing of each (raw directory, level) pair
+        self.level_preview_workers: Dict[Tuple[str, int], Importer_LevelPreviewWorker] = {}
 
         # Window Size and initial visual setup
         self.setWindowTitle("ExploreASL - DICOM to NIFTI Import")
@@ -159,8 +209,12 @@ class xASL_GUI_Importer(QMainWindow):
                                                 icon_size=QSize(40, 40))
         self.btn_terminate_importer = xASL_PushButton(enabled=False, icon=icon_terminate, icon_size=QSize(40, 40),
                                                       func=self.signal_stop_import.emit)
+        self.txt_timings = QPlainTextEdit(readOnly=True)
+        self.txt_timings.setPlaceholderText("A summary of the slowest import stages and subjects will appear here "
+                                            "once an import has finished")
+        self.txt_timings.setToolTip(self.import_tips["txt_timings"])
         self.vlay_runbtns.addStretch(1)
-        for widget in [self.progbar_import, self.btn_run_importer, self.btn_terminate_importer]:
+        for widget in [self.txt_timings, self.progbar_import, self.btn_run_importer, self.btn_terminate_importer]:
             self.vlay_runbtns.addWidget(widget)
         self.vlay_import.addWidget(self.mainsplit)
 
@@ -194,8 +248,18 @@ class xASL_GUI_Importer(QMainWindow):
         self.hlay_rootdir.addWidget(self.btn_setrootdir)
         self.chk_uselegacy = QCheckBox(checked=True)
         self.chk_uselegacy.setToolTip(self.import_tips["chk_uselegacy"])
+        self.spinbox_nworkers = QSpinBox(minimum=1, maximum=max(cpu_count() or 1, get_default_nworkers()),
+                                         value=get_default_nworkers())
+        self.spinbox_nworkers.setToolTip(self.import_tips["spinbox_nworkers"])
+        self.chk_directconvert = QCheckBox(checked=False)
+        self.chk_directconvert.setToolTip(self.import_tips["chk_directconvert"])
+        self.chk_resume = QCheckBox(checked=False)
+        self.chk_resume.setToolTip(self.import_tips["chk_resume"])
         self.formlay_rootdir.addRow("Source Root Directory", self.hlay_rootdir)
         self.formlay_rootdir.addRow("Use Legacy Import", self.chk_uselegacy)
+        self.formlay_rootdir.addRow("Number of Import Processes", self.spinbox_nworkers)
+        self.formlay_rootdir.addRow("Move Unchanged NIFTIs As-Is", self.chk_directconvert)
+        self.formlay_rootdir.addRow("Resume Previous Import", self.chk_resume)
 
         # Next specify the QLabels that can be dragged to have their text copied elsewhere
         self.hlay_placeholders = QHBoxLayout()
@@ -306,6 +370,9 @@ class xASL_GUI_Importer(QMainWindow):
         path = Path(path)
         if path.exists() and path.is_dir():
             self.rawdir = self.le_rootdir.text()
+            # Re-selecting a raw directory should reflect any changes made to it since it was last previewed
+            self.level_previews = {key: preview for key, preview in self.level_previews.items()
+                                   if key[0] != self.rawdir}
 
     def get_nth_level_dirs(self, dir_type: str, level: int):
         """
@@ -327,55 +394,74 @@ class xASL_GUI_Importer(QMainWindow):
         if dir_type == '':
             return
 
-        try:
-            delimiter = "\\" if system() == "Windows" else "/"
-            glob_string = delimiter.join(["*"] * (level + 1))
-            paths = [(str(direc), str(direc.name)) for direc in Path(self.rawdir).glob(glob_string)]
-            directories, basenames = zip(*paths)
-
-        except ValueError:
+        # Levels already listed for this raw directory are served from the cache; otherwise, the level is listed in
+        # the background and applied once the listing arrives
+        preview = self.level_previews.get((self.rawdir, level))
+        if preview is not None:
+            self.apply_level_preview(dir_type=dir_type, level=level, preview=preview)
+            return
+        if (self.rawdir, level) in self.level_preview_workers:
+            return
+        worker = Importer_LevelPreviewWorker(raw_dir=self.rawdir, level=level)
+        worker.signals.signal_send_preview.connect(self.slot_receive_level_preview)
+        self.level_preview_workers[(self.rawdir, level)] = worker
+        self.btn_run_importer.setEnabled(False)
+        self.threadpool.start(worker)
+
+    @Slot(str, int, dict)
+    def slot_receive_level_preview(self, raw_dir: str, level: int, preview: dict):
+        """
+        Caches the listing of a level and applies it, provided that the raw directory and the label dropped at that
+        level have not been changed or cleared in the meantime
+        :param raw_dir: the raw directory that was listed
+        :param level: the python index of the level that was listed
+        :param preview: a dict with the keys "basenames" (the unique names at that level) and "regex"
+        """
+        self.level_preview_workers.pop((raw_dir, level), None)
+        self.level_previews[(raw_dir, level)] = preview
+        dir_type = list(self.levels.values())[level].text()
+        if raw_dir == self.rawdir and dir_type != "":
+            self.apply_level_preview(dir_type=dir_type, level=level, preview=preview)
+        self.is_ready_import()
+
+    def apply_level_preview(self, dir_type: str, level: int, preview: dict):
+        """
+        Sets the regex and the alias widgets appropriate to the label dropped at a level
+        :param dir_type: whether this is a subject, visit, run, scan or dummy level
+        :param level: which lineedit, in python index terms, the label was dropped into
+        :param preview: a dict with the keys "basenames" (the unique names at that level) and "regex"
+        """
+        basenames, regex = preview["basenames"], preview["regex"]
+        # Do not proceed if no directories were found and clear the linedit that emitted the textChanged signal
+        if len(basenames) == 0:
             robust_qmsg(self, title=self.import_errs["ImpossibleDirDepth"][0],
                         body=self.import_errs["ImpossibleDirDepth"][1])
-            # Clear the appropriate lineedit that called this function after the error message
             list(self.levels.values())[level].clear()
             return
 
-        # Do not proceed if no directories were found and clear the linedit that emitted the textChanged signal
-        if len(directories) == 0:
-            idx = list(self.levels.keys())[level]
-            print(f"{idx=}")
-            self.levels[idx].clear()
-            return
-
         # Otherwise, make the appropriate adjustment depending on which label was dropped in
         if dir_type == "Subject":
-            self.subject_regex = self.infer_regex(list(basenames))
+            self.subject_regex = regex
             print(f"Subject regex: {self.subject_regex}")
-            del directories, basenames
 
         elif dir_type == "Visit":
-            self.visit_regex = self.infer_regex(list(basenames))
+            self.visit_regex = regex
             print(f"Visit regex: {self.visit_regex}")
-            del directories, basenames
 
         elif dir_type == "Run":
-            self.run_regex = self.infer_regex(list(set(basenames)))
+            self.run_regex = regex
             print(f"Run regex: {self.run_regex}")
-            self.reset_run_aliases(basenames=list(set(basenames)))
-            del directories, basenames
+            self.reset_run_aliases(basenames=basenames)
 
         elif dir_type == "Scan":
-            self.scan_regex = self.infer_regex(list(set(basenames)))
+            self.scan_regex = regex
             print(f"Scan regex: {self.scan_regex}")
-            self.reset_scan_alias_cmbs(basenames=sorted(set(basenames)))
-            del directories, basenames
+            self.reset_scan_alias_cmbs(basenames=basenames)
 
         elif dir_type == "Dummy":
-            del directories, basenames
             return
 
         else:
-            del directories, basenames
             print("Error. This should never print")
             return
 
@@ -557,6 +643,11 @@ class xASL_GUI_Importer(QMainWindow):
             self.btn_run_importer.setEnabled(False)
             return
 
+        # Next requirement; no level may still be in the process of being listed
+        if len(self.level_preview_workers) > 0:
+            self.btn_run_importer.setEnabled(False)
+            return
+
         # Next requirement; at least one scan must be indicated
         cmb_texts: Set[str] = {cmb.currentText() for cmb in self.cmb_scanaliases_dict.values()}
         if len(cmb_texts) <= 1:
@@ -585,6 +676,9 @@ class xASL_GUI_Importer(QMainWindow):
         self.btn_clear_receivers.setEnabled(state)
         self.btn_setrootdir.setEnabled(state)
         self.le_rootdir.setEnabled(state)
+        self.spinbox_nworkers.setEnabled(state)
+        self.chk_directconvert.setEnabled(state)
+        self.chk_resume.setEnabled(state)
 
         le: QLineEdit
         for le in self.levels.values():
@@ -700,6 +794,7 @@ class xASL_GUI_Importer(QMainWindow):
         import_parms["Directory Structure"] = valid_directories
         import_parms["Scan Aliases"] = scan_aliases
         import_parms["Ordered Run Aliases"] = run_aliases
+        import_parms["Direct Conversion"] = self.chk_directconvert.isChecked()
 
         # Save a copy of the import parms to the raw directory in question
         with open(Path(self.le_rootdir.text()) / "ImportConfig.json", 'w') as w:
@@ -714,6 +809,14 @@ class xASL_GUI_Importer(QMainWindow):
     def slot_update_progressbar(self):
         self.progbar_import.setValue(self.progbar_import.value() + 1)
 
+    @Slot(int)
+    def slot_update_progressbar_maximum(self, n_discovered: int):
+        """
+        Grows the progressbar as DICOM directories are discovered by the import worker
+        :param n_discovered: the number of DICOM directories discovered thus far
+        """
+        self.progbar_import.setMaximum(n_discovered)
+
     @Slot()
     def slot_cleanup_postterminate(self):
         self.n_import_workers -= 1
@@ -721,6 +824,8 @@ class xASL_GUI_Importer(QMainWindow):
             self.import_summaries.clear()
         if len(self.failed_runs) > 0:
             self.failed_runs.clear()
+        if len(self.import_logs) > 0:
+            self.import_logs.clear()
 
         # Don't proceed until all importer workers are finished
         if self.n_import_workers > 0 or self.import_parms is None:
@@ -737,15 +842,36 @@ class xASL_GUI_Importer(QMainWindow):
         QApplication.restoreOverrideCursor()
 
     @Slot(list)
-    def slot_is_ready_postprocessing(self, signalled_summaries: list):
+    def slot_update_import_summaries(self, signalled_summaries: list):
         """
-        Creates the summary file. Increments the "debt" due to launching workers back towards zero. Resets widgets
-        once importer workers are done.
-        :param signalled_summaries: A list of dicts, each dict being all the relevant DICOM and NIFTI parameters of
-        a converted directory
+        Stockpiles the summaries of converted directories as they are streamed in from the import worker
+        :param signalled_summaries: A list of dicts, each dict being the compact summary row (see compact_summary) of a
+        converted directory
         """
-        # Stockpile the completed summaries and increment the "debt" back towards zero
         self.import_summaries.extend(signalled_summaries)
+
+    @Slot(list)
+    def slot_update_import_logs(self, signalled_logs: list):
+        """
+        Stockpiles the log records of converted directories as they are streamed in from the import worker
+        :param signalled_logs: A list of strings, each being the log of a single converted directory
+        """
+        self.import_logs.extend(signalled_logs)
+
+    @Slot(list)
+    def slot_update_import_timings(self, signalled_timings: list):
+        """
+        Stockpiles the per-stage timings of converted directories as they are streamed in from the import worker
+        :param signalled_timings: A list of dicts, each being the timing of a single stage of a converted directory
+        """
+        self.import_timings.extend(signalled_timings)
+
+    @Slot()
+    def slot_is_ready_postprocessing(self):
+        """
+        Increments the "debt" due to launching workers back towards zero. Creates the summary file and resets widgets
+        once importer workers are done.
+        """
         self.n_import_workers -= 1
 
         # Don't proceed until all importer workers are finished
@@ -769,62 +895,34 @@ class xASL_GUI_Importer(QMainWindow):
         """
         Performs the bulk of the post-import work, especially if the import type was specified to be BIDS
         """
-        print("Clearing Import workers from memory, re-enabling widgets, and resetting current directory")
+        print("Clearing Import workers from memory and re-enabling widgets")
         self.import_workers.clear()
         self.set_widgets_on_or_off(state=True)
         self.btn_terminate_importer.setEnabled(False)
         QApplication.restoreOverrideCursor()
 
-        chdir(self.config["ScriptsDir"])
         analysis_dir = Path(self.import_parms["RawDir"]).parent / "analysis"
         if not analysis_dir.exists():
             robust_qmsg(self, title=self.import_errs["StudyDirNeverMade"][0],
                         body=self.import_errs["StudyDirNeverMade"][1], variables=[str(analysis_dir)])
             return
 
-        # Concatenate the tmpImport_Converter_###.log files into a single log placed in the study directory
-        # Also, remove the log files in the process
-        logs = []
-        log_files = sorted(Path(self.import_parms["RawDir"]).glob("tmpImport_Converter*.log"))
-        for log_file in log_files:
-            with open(log_file, "r") as log_reader:
-                logs.append(log_reader.read())
-            log_file.unlink(missing_ok=True)
-
-        now_str = datetime.now().strftime("%a-%b-%d-%Y_%H-%M-%S")
-        try:
-            log_path = analysis_dir / "Logs" / "Import Logs" / f"Import_Log_{now_str}.log"
-            log_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(log_path, "w") as log_writer:
-                log_writer.write(f"\n{'#' * 50}\n".join(logs))
-        except PermissionError:
-            log_path = analysis_dir / "Logs" / "Import Logs" / f"Import_Log_{now_str}_backup.log"
-            log_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(log_path, "w") as log_writer:
-                log_writer.write("\n\n".join(logs))
+        # Concatenate the logs streamed back from each converted directory into a single log placed in the study
+        # directory
+        log_path = write_import_log(analysis_dir=analysis_dir, logs=self.import_logs)
 
         # Create the import summary
         create_import_summary(import_summaries=self.import_summaries, config=self.import_parms)
+        self.txt_timings.setPlainText(create_timing_summary(timings=self.import_timings, analysis_dir=analysis_dir))
 
-        # If the settings is BIDS...
+        # If the settings is BIDS, adjust the M0 sidecars and create the dataset description and bidsignore files
         if not self.chk_uselegacy.isChecked():
-            # Ensure all M0 jsons have the appropriate "IntendedFor" field if this is in BIDS
-            bids_m0_followup(analysis_dir=analysis_dir)
-
-            # Create the template for the dataset description
-            self.create_dataset_description_template(analysis_dir)
-
-            # Create the "bidsignore" file
-            with open(analysis_dir / ".bidsignore", 'w') as ignore_writer:
-                to_ignore = ["Import_Log_*.log\n", "Import_Failed*.txt\n", "Import_Dataframe_*.tsv\n"]
-                ignore_writer.writelines(to_ignore)
-                del to_ignore
+            bids_import_followup(analysis_dir=analysis_dir)
 
         # If there were any failures, write them to disk now
         if len(self.failed_runs) > 0:
             try:
-                with open(analysis_dir / "Import_Failed_Imports.txt", "w") as failed_writer:
-                    failed_writer.writelines([line + "\n" for line in self.failed_runs])
+                write_failed_imports(analysis_dir=analysis_dir, failed_runs=self.failed_runs)
                 robust_qmsg(self, title=self.import_errs["ImportErrors"][0], body=self.import_errs["ImportErrors"][1],
                             variables=[log_path.name, str(analysis_dir)])
             except FileNotFoundError:
@@ -836,83 +934,55 @@ class xASL_GUI_Importer(QMainWindow):
                                     f"You have successfully imported the DICOM dataset into NIFTI format.\n"
                                     f"The study directory is located at:\n{str(analysis_dir)}", QMessageBox.Ok)
 
-    @staticmethod
-    def create_dataset_description_template(analysis_dir: Path):
-        """
-        Creates a template for the dataset description file for the user to complete at a later point in time
-        :param analysis_dir: The analysis directory where the dataset description will be saved to.
-        """
-        template = {
-            "BIDSVersion": "0.1.0",
-            "License": "CC0",
-            "Name": "A multi-subject, multi-modal human neuroimaging dataset",
-            "Authors": [],
-            "Acknowledgements": "",
-            "HowToAcknowledge": "This data was obtained from [owner]. "
-                                "Its accession number is [id number]'",
-            "ReferencesAndLinks": ["https://www.ncbi.nlm.nih.gov/pubmed/25977808",
-                                   "https://openfmri.org/dataset/ds000117/"],
-            "Funding": ["UK Medical Research Council (MC_A060_5PR10)"]
-        }
-        with open(analysis_dir / "dataset_description.json", 'w') as dataset_writer:
-            json.dump(template, dataset_writer, indent=3)
-
     ########################
     # SECTION - RUN FUNCTION
     ########################
     def run_importer(self):
         """
-        First confirms that all import parameters are set, then runs ASL2BIDS using multi-threading
+        First confirms that all import parameters are set, then runs ASL2BIDS using a pool of processes
         """
         # Set (or reset if this is another run) the essential variables
         self.n_import_workers = 0
         self.import_parms = None
         self.import_summaries.clear()
         self.failed_runs.clear()
+        self.import_logs.clear()
+        self.import_timings.clear()
         self.import_workers.clear()
 
         # Disable the run button to prevent accidental re-runs
         self.set_widgets_on_or_off(state=False)
 
-        # Ensure the dcm2niix path is visible
-        chdir(Path(self.config["ProjectDir"]) / "External" / "DCM2NIIX" / f"DCM2NIIX_{system()}")
-
         # Get the import parameters
         self.import_parms = self.get_import_parms()
         if self.import_parms is None:
-            # Reset widgets back to normal and change the directory back
+            # Reset widgets back to normal
             self.set_widgets_on_or_off(state=True)
-            chdir(self.config["ScriptsDir"])
             return
 
-        # Get the dicom directories
-        subject_dirs: List[Tuple[Path]] = get_dicom_directories(config=self.import_parms)
-
-        # Set the progressbar
+        # Set the progressbar; it remains a busy indicator until the first DICOM directories are discovered
         self.progbar_import.setValue(0)
-        self.progbar_import.setMaximum(len(list(collapse(subject_dirs))))
-
-        if self.config["DeveloperMode"]:
-            print("Detected the following dicom directories:")
-            pprint(subject_dirs)
-            print('\n')
-
-        NTHREADS = min([len(subject_dirs), 4])
-        # NTHREADS = 1  # For troubleshooting
-        for idx, subjects_subset in enumerate(divide(NTHREADS, subject_dirs)):
-            dicom_dirs = flatten(subjects_subset)
-            worker = Importer_Worker(dcm_dirs=dicom_dirs,  # The list of dicom directories
-                                     config=self.import_parms,  # The import parameters
-                                     use_legacy_mode=self.chk_uselegacy.isChecked(),
-                                     name=f"Converter_{str(idx).zfill(3)}"
-                                     )  # Whether to use legacy mode or not
-            self.signal_stop_import.connect(worker.slot_stop_import)
-            worker.signals.signal_send_summaries.connect(self.slot_is_ready_postprocessing)
-            worker.signals.signal_send_errors.connect(self.slot_update_failed_runs_log)
-            worker.signals.signal_confirm_terminate.connect(self.slot_cleanup_postterminate)
-            worker.signals.signal_update_progressbar.connect(self.slot_update_progressbar)
-            self.import_workers.append(worker)
-            self.n_import_workers += 1
+        self.progbar_import.setMaximum(0)
+
+        # All DICOM directories are placed into a single work queue as they are discovered by the worker; the worker
+        # processes take from it as they become available rather than being pre-assigned a fixed subset of subjects
+        worker = Importer_Worker(config=self.import_parms,  # The import parameters
+                                 use_legacy_mode=self.chk_uselegacy.isChecked(),  # Whether to use legacy mode or not
+                                 n_workers=self.spinbox_nworkers.value(),  # The number of processes to convert with
+                                 resume=self.chk_resume.isChecked(),  # Whether to skip already-converted directories
+                                 print_discovered=self.config["DeveloperMode"]  # Whether to print the DICOM dirs
+                                 )
+        self.signal_stop_import.connect(worker.slot_stop_import)
+        worker.signals.signal_send_summaries.connect(self.slot_update_import_summaries)
+        worker.signals.signal_send_errors.connect(self.slot_update_failed_runs_log)
+        worker.signals.signal_send_logs.connect(self.slot_update_import_logs)
+        worker.signals.signal_send_timings.connect(self.slot_update_import_timings)
+        worker.signals.signal_finished.connect(self.slot_is_ready_postprocessing)
+        worker.signals.signal_confirm_terminate.connect(self.slot_cleanup_postterminate)
+        worker.signals.signal_update_progressbar.connect(self.slot_update_progressbar)
+        worker.signals.signal_update_discovered.connect(self.slot_update_progressbar_maximum)
+        self.import_workers.append(worker)
+        self.n_import_workers += 1
 
         # Launch them
         for worker in self.import_workers:
@@ -10,13 +10,13 @@ import json
 import re
 from pathlib import Path
 from tdda import rexpy
-from more_itertools import peekable
 from functools import partial
 from shutil import which
 from typing import List, Union
 from platform import system
 from nilearn import image
 from pydantic import ValidationError
+from src.xASL_utils_Sidecars import rewrite_json_sidecars
 
 
 class xASL_Parms(QMainWindow):
@@ -471,7 +471,6 @@ class xASL_Parms(QMainWindow):
 
     def overwrite_bids_fields(self):
         self.flag_impossible_m0 = False
-        bad_jsons = []
 
         if self.config["DeveloperMode"]:
             print("Overwriting BIDS ASL json sidecar fields\n")
@@ -482,17 +481,25 @@ class xASL_Parms(QMainWindow):
                         body=self.parms_errs["BIDSoverwriteforNonBIDS"][1])
             return
 
-        asl_jsons = peekable(analysis_dir.rglob("*_asl.json"))
+        # The whole study is searched rather than only the outputs of the import manifest, as the study may also hold
+        # sidecars from older imports or that were placed there by hand
+        asl_jsons = sorted(analysis_dir.rglob("*_asl.json"))
         # If json sidecars cannot be found, exit early
-        if not asl_jsons:
+        if len(asl_jsons) == 0:
             robust_qmsg(self, title=self.parms_errs["NoJsonSidecars"][0], body=self.parms_errs["NoJsonSidecars"][1])
             return
 
-        for asl_sidecar in asl_jsons:
-            # Load in the data
-            with open(asl_sidecar) as asl_sidecar_reader:
-                asl_sidecar_data = json.load(asl_sidecar_reader)
-
+        # The widget values are read once, here in the GUI thread; the sidecars themselves are rewritten in parallel
+        m0_choice = self.cmb_m0_isseparate.currentText()
+        m0_posinasl = self.le_m0_posinasl.text()
+        labeling_type = self.cmb_labelingtype.currentText()
+        initial_pld = self.spinbox_initialpld.value() / 1000
+        labeling_duration = self.spinbox_labdur.value() / 1000
+        background_suppression = False if self.cmb_nsup_pulses.currentText() == "0" else True
+        sequence_type = self.d_sequencetype[self.cmb_sequencetype.currentText()]
+
+        def update_asl_sidecar(asl_sidecar: Path, asl_sidecar_data: dict) -> bool:
+            m0_is_possible = True
             # M0 key behavior
             # Priority 1 - if there is an M0 present, use its path as the value
             possible_m0_json = Path(str(asl_sidecar).replace("_asl.json", "_m0scan.json"))
@@ -501,36 +508,40 @@ class xASL_Parms(QMainWindow):
             if possible_m0_json.exists():
                 asl_sidecar_data["M0"] = relative_path.replace("_m0scan.json", "_m0scan.nii")
             # Priority 2 - if the M0 is present within the asl nifti, as indicated by the user, go with that
-            elif self.cmb_m0_isseparate.currentText() == "Proton density scan (M0) was acquired":
+            elif m0_choice == "Proton density scan (M0) was acquired":
 
-                if self.le_m0_posinasl.text() != "":
+                if m0_posinasl != "":
                     asl_sidecar_data["M0"] = True
                 else:
-                    self.flag_impossible_m0 = True
-                    bad_jsons.append(asl_sidecar)
+                    m0_is_possible = False
 
-            elif self.cmb_m0_isseparate.currentText() == "Use mean control ASL as M0 mimic":
+            elif m0_choice == "Use mean control ASL as M0 mimic":
                 asl_sidecar_data["M0"] = False
 
             else:
-                self.flag_impossible_m0 = True
-                bad_jsons.append(asl_sidecar)
+                m0_is_possible = False
 
             # Polish up certain fields
-            asl_sidecar_data["LabelingType"] = TRANSLATOR["LablingType"][self.cmb_labelingtype.currentText()]
-            asl_sidecar_data["PostLabelingDelay"] = self.spinbox_initialpld.value() / 1000
-            if self.cmb_labelingtype.currentText() in ["Pseudo-continuous ASL", "Continuous ASL"]:
-                asl_sidecar_data["LabelingDuration"] = self.spinbox_labdur.value() / 1000
-            asl_sidecar_data["BackgroundSuppression"] = False if self.cmb_nsup_pulses.currentText() == "0" else True
-            asl_sidecar_data["PulseSequenceType"] = self.d_sequencetype[self.cmb_sequencetype.currentText()]
+            asl_sidecar_data["LabelingType"] = TRANSLATOR["LablingType"][labeling_type]
+            asl_sidecar_data["PostLabelingDelay"] = initial_pld
+            if labeling_type in ["Pseudo-continuous ASL", "Continuous ASL"]:
+                asl_sidecar_data["LabelingDuration"] = labeling_duration
+            asl_sidecar_data["BackgroundSuppression"] = background_suppression
+            asl_sidecar_data["PulseSequenceType"] = sequence_type
+            return m0_is_possible
 
-            with open(asl_sidecar, 'w') as asl_sidecar_writer:
-                json.dump(asl_sidecar_data, asl_sidecar_writer, indent=3)
+        bad_jsons, unwritable_jsons = rewrite_json_sidecars(sidecars=asl_jsons, update=update_asl_sidecar)
+        self.flag_impossible_m0 = len(bad_jsons) > 0
 
         if self.flag_impossible_m0:
             bad_jsons = "; ".join([asl_json.stem for asl_json in bad_jsons])
             robust_qmsg(self, title=self.parms_errs["ImpossibleM0"][0],
                         body=self.parms_errs["ImpossibleM0"][1] + f"{bad_jsons}")
+        # Sidecars that could not be read or written are a filesystem problem, not an M0 setting problem
+        if len(unwritable_jsons) > 0:
+            robust_qmsg(self, title=self.parms_errs["UnwritableJsonSidecars"][0],
+                        body=self.parms_errs["UnwritableJsonSidecars"][1],
+                        variables=[str(asl_json) for asl_json in unwritable_jsons])
 
     ################
     # Misc Functions
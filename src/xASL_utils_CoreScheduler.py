@@ -0,0 +1,185 @@
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the distribution of a budget of cores over the ExploreASL workers of several studies. Studies
+# are started in order of priority, each with up to the number of workers it was given (but no more than it has
+# subjects, as ExploreASL divides its workers over the subjects). Whenever a core frees up (i.e. a study with few
+# subjects has finished), it is handed to the study of highest priority that has more units of work (subjects, runs or
+# the population) remaining than it has workers running. That study receives an additional ExploreASL invocation
+# covering all of its subjects, which leaves the subjects locked or completed by the study's other workers alone, so
+# that the cores of the batch are kept busy until its end.
+# The modules of a study are run one after the other, as the later modules depend on the outputs of the earlier ones
+# (i.e. the ASL module of a subject requires that subject's Structural module to have finished). Every worker only runs
+# the module that the study is currently at; once that module has no units remaining, or all of its workers have
+# finished, the study's next module is started with a fresh set of workers. A worker running several modules could
+# otherwise reach a subject whose Structural module is still being run by an additional invocation.
+# An additional invocation is only launched for a study that still has workers running and that has completed work
+# since its last invocation was launched. Units that ExploreASL fails on remain incomplete; this prevents them from
+# being retried indefinitely.
+# Current Main Classes/Functions:
+#       - RemainingWork ; the work of a study that has yet to be completed
+#       - WorkerLaunch ; a single ExploreASL worker that should be launched
+#       - CoreScheduler ; decides which workers of which studies to launch as cores become available
+########################################################################################################################
+
+
+class RemainingWork(NamedTuple):
+    units: Dict[int, int]  # Each ExploreASL module of the run, in order -> the number of its units yet to be completed
+    n_subjects: int  # The number of subjects (or 1 for the population) with units yet to be completed
+
+    @property
+    def n_units(self) -> int:
+        return sum(self.units.values())
+
+
+class WorkerLaunch(NamedTuple):
+    study_key: str  # The study that the worker belongs to
+    iworker: int  # The index (starting at 1) of the worker within its ExploreASL invocation
+    nworkers: int  # The number of workers of its ExploreASL invocation
+    ilog: int  # The index of the worker among all workers launched for its study; used to name its temporary log
+    imodules: Tuple[int, ...]  # The ExploreASL modules that the worker should run
+
+
+class CoreScheduler:
+    """
+    Decides which ExploreASL workers to launch such that no more than a budget of cores is in use at any time. The
+    scheduler launches nothing itself; the owner asks it which workers to launch (schedule) and informs it whenever one
+    of them has finished (release).
+    """
+
+    def __init__(self, total_cores: int):
+        """
+        :param total_cores: the maximum number of workers that may be running at any time across all studies
+        """
+        if total_cores < 1:
+            raise ValueError(f"The core budget must be at least 1; received {total_cores}")
+        self.total_cores = total_cores
+        # Study key -> the state of that study; the insertion order is the order of priority
+        self.studies: Dict[str, dict] = {}
+
+    def add_study(self, study_key: str, n_cores: int, remaining_work: Callable[[], RemainingWork]):
+        """
+        Adds a study with a lower priority than the studies added before it
+        :param study_key: the key identifying the study (i.e. its analysis directory)
+        :param n_cores: the number of workers each module of the study should start with, if that many cores and
+        subjects are available
+        :param remaining_work: returns the units of work (subjects, runs or the population) of each module of the study
+        that have yet to be completed
+        """
+        self.studies[study_key] = {"n_cores": max(n_cores, 1), "remaining_work": remaining_work, "n_running": 0,
+                                   "n_launched": 0, "remaining_at_last_launch": 0, "is_started": False,
+                                   "is_cancelled": False, "is_held": False,
+                                   # The module currently being run, and the later modules with units yet to be run
+                                   "imodule": None, "next_modules": []}
+
+    @property
+    def n_running(self) -> int:
+        """
+        The number of workers currently running across all studies
+        """
+        return sum(study["n_running"] for study in self.studies.values())
+
+    @property
+    def is_finished(self) -> bool:
+        """
+        Whether no workers are running and no further workers will be launched
+        """
+        return all(self.is_study_finished(study_key) for study_key in self.studies)
+
+    def is_study_finished(self, study_key: str) -> bool:
+        """
+        Whether none of the study's workers are running and no further workers will be launched for it. A study that
+        was held before it could start, or before it could start its next module, is not finished.
+        """
+        study = self.studies[study_key]
+        return study["n_running"] == 0 and \
+            (study["is_cancelled"] or (study["is_started"] and len(study["next_modules"]) == 0))
+
+    def cancel(self, study_key: str):
+        """
+        Prevents any further workers from being launched for a study (i.e. when the user terminates it)
+        """
+        self.studies[study_key]["is_cancelled"] = True
+
+    def set_held(self, study_key: str, is_held: bool):
+        """
+        Holds back (or releases) the launching of further workers for a study (i.e. while the user has paused it)
+        """
+        self.studies[study_key]["is_held"] = is_held
+
+    def release(self, study_key: str):
+        """
+        Informs the scheduler that one of the workers of a study has finished, freeing up its core
+        """
+        study = self.studies[study_key]
+        study["n_running"] = max(study["n_running"] - 1, 0)
+
+    def _launch(self, study_key: str, iworker: int, nworkers: int, remaining: RemainingWork,
+                imodules: Tuple[int, ...]) -> WorkerLaunch:
+        study = self.studies[study_key]
+        study["n_running"] += 1
+        study["n_launched"] += 1
+        study["remaining_at_last_launch"] = remaining.n_units
+        return WorkerLaunch(study_key, iworker, nworkers, study["n_launched"], imodules)
+
+    def _start_next_module(self, study_key: str, remaining: RemainingWork, free: int) -> List[WorkerLaunch]:
+        """
+        Launches the workers of the study's next module with units remaining. ExploreASL divides the workers of an
+        invocation over the subjects, so a study is not given more workers than it has subjects with work remaining.
+        """
+        study = self.studies[study_key]
+        study["next_modules"] = [imodule for imodule in study["next_modules"] if remaining.units[imodule] > 0]
+        if len(study["next_modules"]) == 0:
+            return []
+        study["imodule"] = study["next_modules"].pop(0)
+        nworkers = min(study["n_cores"], free, remaining.n_subjects)
+        return [self._launch(study_key, iworker, nworkers, remaining, (study["imodule"],))
+                for iworker in range(1, nworkers + 1)]
+
+    def schedule(self) -> List[WorkerLaunch]:
+        """
+        Claims the free cores for the workers that should be launched now. The workers returned are regarded as
+        running from this point on.
+        :return: the workers to launch, in order of priority
+        """
+        launches = []
+        free = self.total_cores - self.n_running
+
+        # First, in order of priority, start the studies that have yet to start on their first module, and move the
+        # studies whose current module is done (no units remain, or none of its workers are left) onto their next one
+        for study_key, study in self.studies.items():
+            if free <= 0:
+                break
+            if study["is_cancelled"] or study["is_held"]:
+                continue
+            if not study["is_started"]:
+                study["is_started"] = True
+                remaining = study["remaining_work"]()
+                study["next_modules"] = list(remaining.units)
+            elif len(study["next_modules"]) > 0:
+                remaining = study["remaining_work"]()
+                if study["n_running"] > 0 and remaining.units[study["imodule"]] > 0:
+                    continue
+            else:
+                continue
+            module_launches = self._start_next_module(study_key, remaining, free)
+            launches.extend(module_launches)
+            free -= len(module_launches)
+
+        # Then, hand the cores left over to the started studies that have more work of their current module than
+        # workers, in order of priority
+        while free > 0:
+            for study_key, study in self.studies.items():
+                if any([not study["is_started"], study["is_cancelled"], study["is_held"], study["n_running"] == 0]):
+                    continue
+                remaining = study["remaining_work"]()
+                if study["n_running"] < remaining.units[study["imodule"]] and \
+                        remaining.n_units < study["remaining_at_last_launch"]:
+                    launches.append(self._launch(study_key, 1, 1, remaining, (study["imodule"],)))
+                    free -= 1
+                    break
+            else:
+                break
+        return launches
@@ -0,0 +1,84 @@
+from platform import system
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, List, NamedTuple, Optional, Union
+import subprocess
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the execution layer for the dcm2niix program bundled under External/DCM2NIIX. The program is
+# called by its absolute path without a shell, such that no process needs to change its working directory. Its output
+# is streamed line by line as it runs. Optionally, a semaphore (shared across the import worker processes) bounds how
+# many dcm2niix processes may run at once, independently of the number of worker processes.
+# Current Main Classes/Functions:
+#       - run_dcm2niix ; runs dcm2niix on a single DICOM directory
+#       - get_dcm2niix_path ; the absolute path to the dcm2niix program for this operating system
+#       - set_dcm2niix_semaphore ; sets the semaphore used to bound the number of concurrent dcm2niix processes
+########################################################################################################################
+
+# Set within each import worker process by the pool initializer; shared by all the worker processes of a pool
+_dcm2niix_semaphore = None
+
+
+class DCM2NIIX_Result(NamedTuple):
+    return_code: int
+    output: str  # The combined stdout and stderr of dcm2niix
+    elapsed: float  # Seconds spent running dcm2niix
+    waited: float  # Seconds spent waiting for a free dcm2niix slot
+
+
+def get_dcm2niix_path() -> Path:
+    """
+    Convenience function for getting the dcm2niix program bundled for this operating system
+    :return: the absolute path to the dcm2niix program
+    """
+    dcm2niix_dir = Path(__file__).resolve().parent.parent / "External" / "DCM2NIIX" / f"DCM2NIIX_{system()}"
+    return dcm2niix_dir / ("dcm2niix.exe" if system() == "Windows" else "dcm2niix")
+
+
+def set_dcm2niix_semaphore(semaphore):
+    """
+    Sets the semaphore that bounds the number of concurrent dcm2niix processes within this process
+    :param semaphore: a multiprocessing semaphore shared with the other worker processes, or None for no bound
+    """
+    global _dcm2niix_semaphore
+    _dcm2niix_semaphore = semaphore
+
+
+def run_dcm2niix(dcm_dir: Union[str, Path], output_dir: Union[str, Path], filename_format: str,
+                 on_line: Optional[Callable[[str], None]] = None) -> DCM2NIIX_Result:
+    """
+    Runs dcm2niix on a single DICOM directory, producing uncompressed NIFTIs with BIDS sidecars
+    :param dcm_dir: the directory of DICOM files to convert
+    :param output_dir: the directory that dcm2niix should write its output files to
+    :param filename_format: the dcm2niix format string for the output filenames (its -f option)
+    :param on_line: an optional callback receiving each line of output as it is produced
+    :return: the result of the dcm2niix invocation
+    """
+    command: List[str] = [str(get_dcm2niix_path()), "-b", "y", "-z", "n", "-x", "n", "-t", "n", "-m", "n",
+                          "-s", "n", "-v", "n", "-f", filename_format, "-o", str(output_dir), str(dcm_dir)]
+    kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if system() == "Windows" else {}
+
+    wait_start = perf_counter()
+    if _dcm2niix_semaphore is not None:
+        _dcm2niix_semaphore.acquire()
+    try:
+        run_start = perf_counter()
+        output_lines = []
+        # stderr is merged into stdout such that a single pipe is read; two separate pipes read one after the other
+        # may deadlock once the unread pipe's buffer fills up
+        with subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, errors="replace", **kwargs) as proc:
+            for line in proc.stdout:
+                output_lines.append(line)
+                if on_line is not None:
+                    on_line(line.rstrip("\n"))
+            return_code = proc.wait()
+        run_end = perf_counter()
+    finally:
+        if _dcm2niix_semaphore is not None:
+            _dcm2niix_semaphore.release()
+
+    return DCM2NIIX_Result(return_code=return_code, output="".join(output_lines), elapsed=run_end - run_start,
+                           waited=run_start - wait_start)
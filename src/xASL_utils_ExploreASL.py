@@ -0,0 +1,439 @@
+from src.xASL_utils_ProcessOutput import ProcessOutputReader
+from src.xASL_utils_CoreScheduler import RemainingWork
+from more_itertools import interleave_longest
+from shutil import rmtree, which
+from pathlib import Path
+from platform import system
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+import subprocess
+import logging
+import signal
+import psutil
+import json
+import os
+import re
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the parts of running ExploreASL on a study that do not depend on Qt, such that both the
+# Executor window and the headless command-line executor (see xASL_CLI_Executor) validate studies, launch the
+# ExploreASL worker processes and interpret their output in the same way.
+# Problems found while preparing a study are raised as StudyPreparationError, which carries the key of the problem
+# within the Executor section of JSON_LOGIC/ErrorsListing.json so that callers can present it as they see fit.
+# Current Main Classes/Functions:
+#       - StudyPreparationError ; a problem that prevents ExploreASL from being run on a study
+#       - load_study_parms ; loads and validates the DataPar.json file of a study
+#       - check_matlab_version ; validates the MATLAB version and command used for uncompiled ExploreASL
+#       - prepare_worker_env ; the environment variables under which the ExploreASL workers of a study should run
+#       - count_remaining_work ; the units of work of each module of a study that have yet to be completed
+#       - get_worker_command ; the command that launches a single ExploreASL worker
+#       - start_worker_process ; launches a single ExploreASL worker
+#       - monitor_worker_process ; follows the output of a running worker until it exits or should stop
+#       - ExploreASLOutputParser ; recognizes the error messages within the output of ExploreASL
+#       - kill_proc_tree / pause_resume_proc_tree ; signal a worker process along with all of its descendants
+#       - remove_locked_dirs ; removes the "locked" directories left behind by an interrupted run
+#       - merge_worker_logs ; combines the temporary logs of the workers of a study into a single processing log
+########################################################################################################################
+
+# The ExploreASL modules (by their index) run for each of the run options of the Executor
+RUN_OPTION_MODULES: Dict[str, List[int]] = {"Structural": [1], "ASL": [2], "Both": [1, 2], "Population": [3]}
+
+# The index of each ExploreASL module, by its name within the lock dir
+MODULE_INDICES: Dict[str, int] = {"Structural": 1, "ASL": 2, "Population": 3}
+
+SUPPORTED_SCENARIOS = {"LOCAL_UNCOMPILED", "LOCAL_COMPILED"}
+
+# The module and subject (or the population) of a lock dir, such as lock/xASL_module_ASL/sub-001/xASL_module_ASL_ASL_1
+REGEX_LOCK_DIR = re.compile(r"[\\/]lock[\\/]xASL_module_(Structural|ASL|Population)[\\/]([^\\/]+)")
+
+
+class StudyPreparationError(Exception):
+    """
+    A problem that prevents ExploreASL from being run on a study
+    """
+
+    def __init__(self, err_key: str, variables: Union[str, List[str]] = None):
+        """
+        :param err_key: the key of the problem within the Executor errors of JSON_LOGIC/ErrorsListing.json
+        :param variables: the variables that are interleaved with the body of that error's message
+        """
+        super().__init__(err_key)
+        self.err_key = err_key
+        self.variables = variables
+
+    def get_title_and_body(self, errs_listing: dict) -> Tuple[str, Union[str, List[str]]]:
+        """
+        :param errs_listing: the Executor errors of JSON_LOGIC/ErrorsListing.json
+        :return: the title and the body of this error's message. Entries lacking a title are given the error's key.
+        """
+        entry = errs_listing.get(self.err_key, [])
+        if len(entry) >= 2:
+            return entry[0], entry[1]
+        return self.err_key, entry[0] if len(entry) > 0 else ""
+
+    def format(self, errs_listing: dict) -> str:
+        """
+        :param errs_listing: the Executor errors of JSON_LOGIC/ErrorsListing.json
+        :return: the title and the content of the error message, in the same form as shown by robust_qmsg
+        """
+        title, body = self.get_title_and_body(errs_listing)
+        if isinstance(body, list) and isinstance(self.variables, list):
+            content = "".join(interleave_longest(body, self.variables))
+        elif isinstance(body, str) and isinstance(self.variables, str):
+            content = body + self.variables
+        elif isinstance(body, str) and isinstance(self.variables, list):
+            content = body + "\n".join(self.variables)
+        else:
+            content = body if isinstance(body, str) else "".join(body)
+        return f"{title}\n{content}"
+
+
+def load_study_parms(ana_path: Path) -> dict:
+    """
+    Loads the DataPar.json file of a study and checks that ExploreASL can be run on the study with it
+    :param ana_path: the resolved analysis directory of the study
+    :return: the contents of the DataPar.json file
+    """
+    try:
+        parms_file = next(ana_path.glob("DataPar*.json"))
+    except StopIteration:
+        raise StudyPreparationError("DataPar File Not Found", [str(ana_path)])
+
+    # Load in the DataPar.json file and Extract essential parameters
+    try:
+        with open(parms_file) as parms_reader:
+            parms: dict = json.load(parms_reader)
+        regex: re.Pattern = re.compile(parms["subject_regexp"].strip("^$"))
+        easl_scenario: str = parms["EXPLOREASL_TYPE"]
+        excluded_subjects: list = parms["exclusion"]
+        root_in_parms: str = parms["D"]["ROOT"]
+    except json.decoder.JSONDecodeError as json_read_error:
+        raise StudyPreparationError("BadDataParFileJson", [str(ana_path), f"{json_read_error}"])
+    except KeyError as parms_keyerror:
+        raise StudyPreparationError("BadDataParFileKeys", [str(ana_path), f"{parms_keyerror}"])
+
+    # Check that the parms file's D.ROOT matches the resolved filepath of the study
+    if root_in_parms != str(ana_path):
+        raise StudyPreparationError("NoStartExploreASL", [str(ana_path)])
+
+    # Regex check for subject hits
+    hits = []
+    for subject_path in ana_path.iterdir():
+        if any([subject_path.name in {"lock", "Population", "Logs"}, subject_path.is_file(),
+                subject_path.name in excluded_subjects]):
+            continue
+        hits.append(bool(regex.search(subject_path.name)))
+    if not any(hits):
+        raise StudyPreparationError("NoStartExploreASL", [str(ana_path)])
+
+    if easl_scenario not in SUPPORTED_SCENARIOS:
+        raise StudyPreparationError("Unsupported ExploreASL Scenario", [str(ana_path)])
+    return parms
+
+
+def check_matlab_version(mlab_ver: Optional[str], mlab_path: Optional[str]) -> int:
+    """
+    Checks that the MATLAB installation can run uncompiled ExploreASL
+    :param mlab_ver: the MATLAB version (i.e. "R2019a")
+    :param mlab_path: the path to the MATLAB command
+    :return: the year of the MATLAB version
+    """
+    # Immediately abandon this if the MATLAB version is not compatible with batch commands
+    if mlab_ver is None or not isinstance(mlab_ver, str):
+        raise StudyPreparationError("Unknown MATLAB VERSION")
+    # Immediately abandon this if the MATLAB command path is not known
+    if mlab_path is None or not Path(mlab_path).resolve().exists():
+        raise StudyPreparationError("Unknown MATLAB CMD_PATH")
+    match = re.search(r"R(\d{4})[ab]", mlab_ver)
+    if match is None:
+        raise StudyPreparationError("Unknown MATLAB VERSION")
+    year = int(match.group(1))
+    # Abandon if the MATLAB version is too old, or too old for Windows due to the lack of the -nodisplay option
+    if year < 2016 or (system() == "Windows" and year < 2019):
+        raise StudyPreparationError("Incompatible MATLAB Version", [str(year)])
+    return year
+
+
+def prepare_worker_env(parms: dict, ana_path: Path, base_env: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Prepares the environment variables under which the ExploreASL workers of a study should run. For compiled
+    ExploreASL, the MATLAB Runtime libraries are added to the library path of this operating system and the compiled
+    ExploreASL directory is validated.
+    :param parms: the contents of the study's DataPar.json file
+    :param ana_path: the analysis directory of the study
+    :param base_env: the environment to extend; defaults to that of this process
+    :return: the environment variables
+    """
+    worker_env = dict(os.environ if base_env is None else base_env)
+    if parms["EXPLOREASL_TYPE"] != "LOCAL_COMPILED":
+        return worker_env
+
+    # First, get the Runtime path
+    runtime_path = parms.get("MCRPath", None)
+    if runtime_path is None:
+        raise StudyPreparationError("Unknown MATLAB Runtime")
+    runtime_path = Path(runtime_path).resolve()
+
+    # Last-minute quality control for the nature of the MATLAB Runtime path
+    env_key, env_sep, arch = {"Windows": ["PATH", ";", "win64"],
+                              "Linux": ["LD_LIBRARY_PATH", ":", "glnxa64"],
+                              "Darwin": ["DYLD_LIBRARY_PATH", ":", "maci64"]}[system()]
+    runtime_arch_dirs = [path for path in runtime_path.rglob(arch) if path.is_dir()] if runtime_path.is_dir() else []
+    if any([not runtime_path.is_dir(), not re.search(r"v\d{2}", runtime_path.name), len(runtime_arch_dirs) == 0]):
+        raise StudyPreparationError("Bad MATLAB Runtime", [str(ana_path)])
+    current_paths = worker_env.get(env_key, "")
+    located_paths = [str(path) for path in runtime_arch_dirs if str(path) not in current_paths]
+    worker_env[env_key] = env_sep.join([paths for paths in [current_paths] + located_paths if paths != ""])
+
+    # Next, check the compiled EASL Directory
+    compiled_easl = parms.get("MyCompiledPath", None)
+    if compiled_easl is None:
+        raise StudyPreparationError("Unknown CompiledEASL Directory", [str(ana_path)])
+    compiled_easl = Path(compiled_easl).resolve()
+    if any([not compiled_easl.is_dir(), next(compiled_easl.glob("*.ctf"), None) is None,
+            system() != "Windows" and not (compiled_easl / "xASL_latest").is_file()]):
+        raise StudyPreparationError("Bad CompiledEASL Directory", [str(ana_path)])
+    return worker_env
+
+
+def count_remaining_work(pending_status_files: Dict[Union[str, Path], Set[str]],
+                         imodules: List[int]) -> RemainingWork:
+    """
+    Counts the units of work of a study that have yet to be completed. Each lock dir in which STATUS files are
+    anticipated is a unit of work; one per subject (Structural), per run of a subject (ASL), or the population.
+    :param pending_status_files: the STATUS filenames yet to be created, by the lock dir in which they will appear
+    :param imodules: which ExploreASL modules are being run (see RUN_OPTION_MODULES)
+    :return: the number of units remaining for each module being run, alongside the number of subjects they concern
+    """
+    units = {imodule: 0 for imodule in imodules}
+    subjects = set()
+    for lock_dir, pending_names in pending_status_files.items():
+        match = REGEX_LOCK_DIR.search(str(lock_dir))
+        if len(pending_names) == 0 or match is None:
+            continue
+        imodule = MODULE_INDICES[match.group(1)]
+        units[imodule] = units.get(imodule, 0) + 1
+        subjects.add(match.group(2))
+    return RemainingWork(units, len(subjects))
+
+
+def get_worker_command(parms: dict, iworker: int, nworkers: int, imodules: List[int]) -> Union[List[str], str]:
+    """
+    Produces the command that launches a single ExploreASL worker. For compiled ExploreASL, this also ensures that the
+    launch scripts are executable.
+    :param parms: the contents of the study's DataPar.json file. For uncompiled ExploreASL, this must also contain the
+    "WORKER_MATLAB_VER" (year) and "WORKER_MATLAB_CMD_PATH" keys.
+    :param iworker: the index (starting at 1) of this worker among the workers of the study
+    :param nworkers: the number of workers of the study
+    :param imodules: which ExploreASL modules to run (see RUN_OPTION_MODULES)
+    :return: the command; a list of arguments, or a single string for compiled ExploreASL under Windows
+    """
+    par_path = str(next(Path(parms["D"]["ROOT"].rstrip("/\\")).glob("DataPar*.json")))
+    process_data = 1
+    skip_pause = 1
+    if parms["EXPLOREASL_TYPE"] == "LOCAL_UNCOMPILED":
+        # Generate the string that the command line will feed into the MATLAB session
+        func_line = f"('{par_path}', {process_data}, {skip_pause}, {iworker}, {nworkers}, " \
+                    f"[{' '.join([str(item) for item in imodules])}])"
+        matlab_cmd = "matlab" if which("matlab") is not None else parms["WORKER_MATLAB_CMD_PATH"]
+        if parms["WORKER_MATLAB_VER"] >= 2019:
+            return [f"{matlab_cmd}", "-nodesktop", "-nosplash", "-batch",
+                    f"cd('{parms['MyPath']}'); ExploreASL_Master{func_line}; exit"]
+        return [f"{matlab_cmd}", "-nosplash", "-nodisplay", "-r",
+                f"cd('{parms['MyPath']}'); ExploreASL_Master{func_line}; exit"]
+
+    # Ensure the easl launch script actually has executable permissions
+    compiled_easl_path = parms["MyCompiledPath"]
+    compiled_easl_script = next(Path(compiled_easl_path).glob("*.exe" if system() == "Windows" else "*.sh"))
+    compiled_easl_script.chmod(0o775)
+    # On Linux and Mac, the xASL_latest script also needs to be granted permission
+    if system() != "Windows":
+        (Path(compiled_easl_path).resolve() / "xASL_latest").chmod(0o775)
+
+    # Generate the string that the command line will feed into the complied MATLAB session
+    if system() == "Windows":
+        func_line = f'{par_path} {process_data} {skip_pause} {iworker} {nworkers} ' \
+                    f'"[{" ".join([str(item) for item in imodules])}]"'
+        return f"{compiled_easl_script} {func_line}"
+    linux_bs = f"'{imodules}'"
+    func_line = f'"{par_path} {process_data} {skip_pause} {iworker} {nworkers} {linux_bs}"'
+    return [str(compiled_easl_script), parms["MCRPath"], func_line]
+
+
+def start_worker_process(command: Union[List[str], str], worker_env: Dict[str, str]) -> psutil.Popen:
+    """
+    Launches a single ExploreASL worker, with its stdout and stderr as binary pipes
+    """
+    kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if system() == "Windows" else {}
+    return psutil.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=worker_env, **kwargs)
+
+
+class ExploreASLOutputParser:
+    """
+    Recognizes the error messages within the stdout of ExploreASL. An error message starts with a line announcing that
+    the job iteration was terminated and ends with a line announcing that the next iteration continues (or after a
+    maximum number of lines). A single combined regex for both markers is first run over a whole batch of lines, such
+    that batches without any error output need no further parsing.
+    """
+
+    def __init__(self, max_error_lines: int = 50):
+        """
+        :param max_error_lines: the number of lines after which an error message is considered complete
+        """
+        self.regex_errstart = re.compile(r"ERROR: Job iteration terminated!")
+        self.regex_errend = re.compile(r"CONT: but continue with next iteration!")
+        self.regex_errmarkers = re.compile(f"(?P<errstart>{self.regex_errstart.pattern})|"
+                                           f"(?P<errend>{self.regex_errend.pattern})")
+        self.regex_findtarget = re.compile(r"ASL_module_(ASL|Structural|Population)"
+                                           r"(?:%%%([^#%&{}\\<>*?/$!'\":@+`|=]+))?"
+                                           r"(?:%%%([^#%&{}\\<>*?/$!'\":@+`|=]+))?\b")
+        self.max_error_lines = max_error_lines
+        self.is_collecting_stdout_err = False
+        self.has_easl_errors = False
+        self.err_container: List[str] = []
+
+    def feed(self, lines: List[str]) -> List[str]:
+        """
+        :param lines: the next lines of stdout
+        :return: the error messages completed within these lines
+        """
+        # Most output is neither part of nor a marker of an error message; such batches need no further parsing
+        if not self.is_collecting_stdout_err and not self.regex_errmarkers.search("\n".join(lines)):
+            return []
+
+        completed = []
+        for line in lines:
+            line = line.strip()
+            # TODO When ExploreASL grants the ability to latch onto a new module/subject/run, get those givens from
+            #  self.regex_findtarget to refresh the context of the error
+            marker = self.regex_errmarkers.search(line)
+            marker = marker.lastgroup if marker else None
+
+            # If the line is the start of an error message, activate collecting mode
+            if marker == "errstart":
+                self.is_collecting_stdout_err = True
+                self.has_easl_errors = True
+
+            # If the line is the end of an error message, deactivate collecting mode and hand the error back
+            elif marker == "errend" or len(self.err_container) > self.max_error_lines:
+                self.err_container.append("")
+                completed.append("\n".join(self.err_container))
+                self.err_container.clear()
+                self.is_collecting_stdout_err = False
+
+            # Collect ExploreASL error output if collecting mode is on
+            if self.is_collecting_stdout_err and line != "":
+                self.err_container.append(line)
+        return completed
+
+
+def monitor_worker_process(proc: psutil.Popen, logger: logging.Logger, parser: ExploreASLOutputParser,
+                           on_error: Callable[[str], None], should_stop: Callable[[], bool]) -> str:
+    """
+    Follows the output of a running ExploreASL worker until the worker exits or should stop. The raw output is written
+    to the logger in batches; error messages are handed to a callback as they are completed.
+    :param proc: the worker process, as launched by start_worker_process
+    :param logger: the logger receiving the raw output
+    :param parser: the parser of the worker's stdout; its has_easl_errors attribute tells whether errors occurred
+    :param on_error: called with each error message of ExploreASL
+    :param should_stop: called at least twice a second; returns whether following the worker should stop early
+    :return: the stderr of the worker
+    """
+    stderr_lines = []
+    reader = ProcessOutputReader(proc)
+    while not reader.at_eof and not should_stop():
+        # Wake up at least twice a second to remain responsive to termination while the program is silent
+        output = reader.read_lines(timeout=0.5)
+        if len(output) == 0:
+            # A descendant process may keep the pipes open after the program itself has exited
+            if proc.poll() is not None:
+                output = reader.read_lines(timeout=0.5)
+                if len(output) == 0:
+                    break
+            else:
+                continue
+
+        stderr_lines.extend(output.get("stderr", []))
+        for stream_name, lines in output.items():
+            logger.debug(f"{stream_name}:\n" + "\n".join(lines))
+        for err_msg in parser.feed(output.get("stdout", [])):
+            on_error(err_msg)
+    proc.wait()
+    return "\n".join(stderr_lines)
+
+
+def kill_proc_tree(pid, sig=signal.SIGTERM, include_parent=True, timeout=None, on_terminate=None):
+    """Kill a process tree (including grandchildren) with signal "sig" and return a (gone, still_alive) tuple.
+    "on_terminate", if specified, is a callback function which is called as soon as a child terminates.
+    """
+    parent = psutil.Process(pid)
+    children = parent.children(recursive=True)
+    if include_parent:
+        children.append(parent)
+    for p in children:
+        try:
+            p.send_signal(sig)
+        except psutil.NoSuchProcess as no_proc_err:
+            print(f"Received a NoSuchProcessError: {no_proc_err}")
+    gone, alive = psutil.wait_procs(children, timeout=timeout, callback=on_terminate)
+    return gone, alive
+
+
+def pause_resume_proc_tree(pid, pause: bool, include_parent=True):
+    """Pause a process tree (including grandchildren)
+    """
+    parent = psutil.Process(pid)
+    children = parent.children(recursive=True)
+    if include_parent:
+        children.append(parent)
+    proc: psutil.Process
+    for proc in children:
+        try:
+            if pause:
+                proc.suspend()
+            else:
+                proc.resume()
+        except psutil.NoSuchProcess:
+            pass
+
+
+def remove_locked_dirs(ana_path: Path, verbose: bool = False):
+    """
+    Removes any directories called "locked" within a study, which ExploreASL would otherwise regard as another process
+    being busy with that part of the study
+    """
+    for lock_dir in ana_path.rglob("locked"):
+        if verbose:
+            print(f"Detected locked direcorties in {ana_path} prior to starting ExploreASL. Removing.")
+        try:
+            lock_dir.rmdir()
+        except OSError as lock_err:  # Just in case a user tampers with the lock directory
+            print(f"{lock_err}...but proceeding to recursive delete")
+            rmtree(path=lock_dir, ignore_errors=True)
+
+
+def merge_worker_logs(study_dir: Path) -> Optional[Path]:
+    """
+    Combines the temporary logs of the workers of a study into a single log within its Logs/Processing Logs directory
+    :param study_dir: the analysis directory of the study
+    :return: the filepath of the combined log, or None if there were no worker logs
+    """
+    tmp_worker_files = sorted(study_dir.glob("tmp_RunWorker_*.log"))
+    if len(tmp_worker_files) == 0:
+        return None
+    content = []
+    for tmp_file in tmp_worker_files:
+        with open(tmp_file) as tmp_reader:
+            content.append(tmp_reader.read())
+        tmp_file.unlink(missing_ok=True)
+
+    # Concatenate content to write, prepare the log dir & file, then write to it
+    to_write = "\n\n".join(content)
+    err_write_date_str = datetime.now().strftime("%a-%b-%d-%Y_%H-%M-%S")
+    dst_logfile = study_dir / "Logs" / "Processing Logs" / f"Run_Log_{err_write_date_str}.log"
+    dst_logfile.parent.mkdir(parents=True, exist_ok=True)
+    with open(dst_logfile, "w") as log_writer:
+        log_writer.write(to_write)
+    return dst_logfile
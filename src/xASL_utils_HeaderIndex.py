@@ -0,0 +1,126 @@
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import sqlite3
+import json
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the on-disk index of DICOM header fields that is kept within the raw directory of a study. Each
+# DICOM file is keyed by its path alongside its size and modification time, such that re-running an import (i.e. after
+# correcting the aliases of a single subject) does not require the headers of unchanged files to be parsed again.
+# Files which could not be parsed as DICOM are also remembered so that they are skipped over on subsequent imports.
+# Current Main Classes/Functions:
+#       - DicomHeaderIndex ; the SQLite-backed index used by the converter
+#       - to_index_value ; converts a value retrieved from a DICOM dataset into a form that can be stored in the index
+########################################################################################################################
+
+INDEX_FILENAME = "DicomHeaderIndex.sqlite"
+
+
+def to_index_value(value):
+    """
+    Converts a value retrieved from a DICOM dataset into plain python types, as the index stores them as JSON
+    :param value: the value to convert
+    :return: the converted value
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return None
+    try:
+        return [to_index_value(item) for item in value]
+    except TypeError:
+        return str(value)
+
+
+class DicomHeaderIndex:
+    """
+    SQLite-backed index of the header fields of each DICOM file within a raw directory. Several processes may share
+    the same index; each holds its own connection and SQLite serializes their writes.
+    """
+
+    def __init__(self, raw_dir: Union[str, Path], filename: str = INDEX_FILENAME):
+        """
+        :param raw_dir: the raw directory of the study, in which the index file is kept
+        :param filename: the name of the index file
+        """
+        self.path: Path = Path(raw_dir) / filename
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.path), timeout=60)
+            with self._connection:
+                self._connection.execute("CREATE TABLE IF NOT EXISTS headers ("
+                                         "path TEXT PRIMARY KEY, "
+                                         "dcm_dir TEXT NOT NULL, "
+                                         "size INTEGER NOT NULL, "
+                                         "mtime_ns INTEGER NOT NULL, "
+                                         "valid INTEGER NOT NULL, "
+                                         "manufacturer TEXT, "
+                                         "series_number TEXT, "
+                                         "acquisition_time TEXT, "
+                                         "fields TEXT)")
+                self._connection.execute("CREATE INDEX IF NOT EXISTS idx_headers_dcm_dir ON headers (dcm_dir)")
+        return self._connection
+
+    def get(self, dcm_file: Path) -> Optional[dict]:
+        """
+        Retrieves the indexed record of a DICOM file, provided that the file has not changed since it was indexed
+        :param dcm_file: the DICOM file
+        :return: None if the file is not indexed or has changed since. Otherwise, a dict with the keys "valid" (whether
+        the file could be parsed as DICOM) and "fields" (the header fields retrieved from it)
+        """
+        stat = dcm_file.stat()
+        row = self.connection.execute("SELECT size, mtime_ns, valid, fields FROM headers WHERE path = ?",
+                                      (str(dcm_file),)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return {"valid": bool(row[2]), "fields": json.loads(row[3]) if row[3] is not None else None}
+
+    def put(self, dcm_file: Path, fields: Optional[dict]):
+        """
+        Indexes a DICOM file
+        :param dcm_file: the DICOM file
+        :param fields: the header fields retrieved from it, or None if it could not be parsed as DICOM
+        """
+        stat = dcm_file.stat()
+        fields = {key: to_index_value(value) for key, value in fields.items()} if fields is not None else None
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(dcm_file), str(dcm_file.parent), stat.st_size, stat.st_mtime_ns, int(fields is not None),
+                 None if fields is None else fields.get("Manufacturer"),
+                 None if fields is None else fields.get("SeriesNumber"),
+                 None if fields is None else fields.get("AcquisitionTime"),
+                 None if fields is None else json.dumps(fields)))
+
+    def prune_directory(self, dcm_dir: Path, dcm_files: Iterable[Path]) -> int:
+        """
+        Removes the records of files which are no longer present within a DICOM directory. Only the directories being
+        imported are pruned, as they are already listed by the converter; the rest of the index is left untouched.
+        :param dcm_dir: the DICOM directory
+        :param dcm_files: the files currently present within the DICOM directory
+        :return: the number of records removed
+        """
+        present = {str(dcm_file) for dcm_file in dcm_files}
+        stale = [(path,) for (path,) in self.connection.execute("SELECT path FROM headers WHERE dcm_dir = ?",
+                                                                (str(dcm_dir),)).fetchall()
+                 if path not in present]
+        if len(stale) > 0:
+            with self.connection:
+                self.connection.executemany("DELETE FROM headers WHERE path = ?", stale)
+        return len(stale)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
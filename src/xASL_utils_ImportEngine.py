@@ -0,0 +1,276 @@
+from src.xASL_GUI_DCM2NIFTI import DCM2NIFTI_Converter
+from src.xASL_utils_ImportSummary import compact_summary
+from src.xASL_utils_DCM2NIIX import set_dcm2niix_semaphore
+from src.xASL_utils_ImportManifest import (ImportManifest, get_input_fingerprint, get_settings_fingerprint,
+                                           describe_outputs)
+from concurrent.futures import ProcessPoolExecutor, Future
+from queue import SimpleQueue, Empty
+from itertools import chain
+from multiprocessing import get_context
+from io import StringIO
+from os import cpu_count, getpid
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sized, Union
+import logging
+import psutil
+import signal
+import sys
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the process-pool engine used to convert DICOM directories to NIFTI format. Each DICOM directory
+# is an independent task placed into a shared work queue; whichever worker process is idle takes on the next directory.
+# Results are yielded back to the caller as soon as each directory has finished, so that a GUI or command line caller
+# may report on progress as it happens.
+# Current Main Classes/Functions:
+#       - DCM2NIFTI_ImportEngine ; the pool manager that the Importer and CLI both use to drive the conversion
+#       - get_default_nworkers ; the default number of worker processes (the number of physical cores)
+########################################################################################################################
+
+# Each worker process holds onto a single converter instance for its lifetime, alongside the in-memory buffer that
+# its log records are written to
+_converter: Union[DCM2NIFTI_Converter, None] = None
+_log_buffer: Union[StringIO, None] = None
+
+
+def get_default_nworkers() -> int:
+    """
+    Convenience function for getting the default number of import worker processes
+    :return: the number of physical cores on this machine, falling back to the number of logical cores if the former
+    cannot be determined
+    """
+    n_physical = psutil.cpu_count(logical=False)
+    if n_physical is None:
+        n_physical = cpu_count() or 1
+    return max(n_physical, 1)
+
+
+def _init_worker(config: dict, use_legacy_mode: bool, stdout_to_stderr: bool, dcm2niix_semaphore):
+    """
+    Initializer for each of the worker processes in the pool. Prepares the converter used by that process.
+    :param config: the import configuration (i.e. the contents of ImportConfig.json)
+    :param use_legacy_mode: whether the legacy (non-BIDS) import should be used
+    :param stdout_to_stderr: whether the converter's printed messages should be sent to stderr instead of stdout
+    :param dcm2niix_semaphore: the semaphore shared by all worker processes that bounds the number of concurrent
+    dcm2niix processes
+    """
+    global _converter, _log_buffer
+    # An interrupt (i.e. Ctrl+C in a terminal) is sent to the whole process group; it is the parent process that
+    # decides what to do about it, so the workers should carry on with the directory at hand
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr
+    set_dcm2niix_semaphore(dcm2niix_semaphore)
+    name = f"Converter_{str(getpid()).zfill(7)}"
+    _log_buffer = StringIO()
+    handler = logging.StreamHandler(_log_buffer)
+    logger = logging.Logger(name=name, level=logging.DEBUG)
+    _converter = DCM2NIFTI_Converter(config=config, name=name, logger=logger, b_legacy=use_legacy_mode,
+                                     handler=handler)
+
+
+def _process_dcm_dir(dcm_dir: str, previous: dict = None) -> dict:
+    """
+    The task run by a worker process for a single DICOM directory.
+    :param dcm_dir: the string filepath to the DICOM directory to convert
+    :param previous: the manifest record of a previous successful conversion of this DICOM directory, if resuming
+    :return: a dict with the keys "dcm_dir", "success", "description", "summary", "log", "timings",
+    "input_fingerprint", "outputs" and "skipped"
+    """
+    try:
+        input_fingerprint = get_input_fingerprint(dcm_dir)
+    except OSError:
+        input_fingerprint = None
+
+    # When resuming, the directory need not be converted again if its DICOM files and outputs are unchanged
+    if previous is not None and input_fingerprint is not None and previous["input_fingerprint"] == input_fingerprint \
+            and ImportManifest.outputs_intact(previous["outputs"]):
+        return {"dcm_dir": dcm_dir,
+                "success": True,
+                "description": f"{dcm_dir} was already converted by a previous import",
+                "summary": previous["summary"],
+                "log": "",
+                "timings": [],
+                "input_fingerprint": input_fingerprint,
+                "outputs": previous["outputs"],
+                "skipped": True}
+
+    try:
+        success, description = _converter.process_dcm_dir(dcm_dir=Path(dcm_dir))
+    except Exception as conversion_err:
+        _converter.logger.exception(f"Unhandled exception while converting {dcm_dir}")
+        _converter.cleanup()
+        success, description = False, f"\nERROR_LISTING FOR DICOM DIRECTORY {dcm_dir}:\n\t" \
+                                      f"Unhandled exception: {conversion_err}"
+
+    outputs = {}
+    if success:
+        try:
+            outputs = describe_outputs([_converter.path_final_nifti, _converter.path_final_json])
+        except OSError:
+            pass
+
+    # Retrieve the log records for this directory and reset the buffer for the next one
+    log_text = _log_buffer.getvalue()
+    _log_buffer.seek(0)
+    _log_buffer.truncate(0)
+
+    return {"dcm_dir": dcm_dir,
+            "success": success,
+            "description": description,
+            # Only the summary columns are sent back, not the entire JSON sidecar that the summary also contains
+            "summary": compact_summary(_converter.summary_data, _converter.config.get("Summary Extra Fields", []))
+            if success else None,
+            "log": log_text,
+            "timings": list(_converter.stage_timings),
+            "input_fingerprint": input_fingerprint,
+            "outputs": outputs,
+            "skipped": False}
+
+
+class DCM2NIFTI_ImportEngine:
+    """
+    Process-pool manager for converting many DICOM directories in parallel. Each DICOM directory is submitted as its
+    own task such that a slow directory only occupies one worker while the others continue through the queue.
+    """
+
+    def __init__(self, config: dict, use_legacy_mode: bool = True, n_workers: int = None,
+                 stdout_to_stderr: bool = False, n_dcm2niix: int = None, resume: bool = False):
+        """
+        :param config: the import configuration (i.e. the contents of ImportConfig.json)
+        :param use_legacy_mode: whether the legacy (non-BIDS) import should be used
+        :param n_workers: the number of worker processes to use. Defaults to the number of physical cores.
+        :param n_dcm2niix: the maximum number of dcm2niix processes that may run at once across all worker processes.
+        Defaults to the number of physical cores.
+        :param stdout_to_stderr: whether the worker processes should print their messages to stderr, keeping stdout
+        free for machine-readable output
+        :param resume: whether DICOM directories recorded in the import manifest as already converted, with the same
+        DICOM files and settings, should be skipped
+        """
+        self.config: dict = config
+        self.use_legacy_mode: bool = use_legacy_mode
+        self.stdout_to_stderr: bool = stdout_to_stderr
+        self.n_workers: int = n_workers if n_workers is not None and n_workers > 0 else get_default_nworkers()
+        self.n_dcm2niix: int = n_dcm2niix if n_dcm2niix is not None and n_dcm2niix > 0 else get_default_nworkers()
+        self.resume: bool = resume
+        self.manifest = ImportManifest(Path(config["RawDir"]).parent / "analysis")
+        self.settings_fingerprint: str = get_settings_fingerprint(config=config, use_legacy_mode=use_legacy_mode)
+        self._futures: List[Future] = []
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    def run(self, dcm_dirs: Iterable[Path]) -> Iterator[dict]:
+        """
+        Converts the given DICOM directories, yielding the result of each one as soon as it has completed. See
+        _process_dcm_dir for the structure of each result.
+        :param dcm_dirs: the DICOM directories to convert. May be a lazy iterator (i.e. iter_dicom_directories), in
+        which case conversion starts while the remaining directories are still being discovered.
+        """
+        self._terminated = False
+        self._futures = []
+        n_workers = min(self.n_workers, len(dcm_dirs)) if isinstance(dcm_dirs, Sized) else self.n_workers
+        dcm_dirs = iter(dcm_dirs)
+        first_dir = next(dcm_dirs, None)
+        if first_dir is None or n_workers < 1:
+            return
+        dcm_dirs = chain([first_dir], dcm_dirs)
+
+        # Spawned processes are used rather than forked ones; forking a process that is running Qt threads is unsafe
+        mp_context = get_context("spawn")
+        # Only bound the number of dcm2niix processes if it could otherwise be exceeded
+        dcm2niix_semaphore = mp_context.BoundedSemaphore(self.n_dcm2niix) if self.n_dcm2niix < n_workers else None
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context, initializer=_init_worker,
+                                 initargs=(self.config, self.use_legacy_mode, self.stdout_to_stderr,
+                                           dcm2niix_semaphore)) as executor:
+            try:
+                # Futures are placed into this queue as they finish (or are cancelled), in order of completion
+                finished: SimpleQueue = SimpleQueue()
+                future2dir = {}
+                n_collected = 0
+                for dcm_dir in dcm_dirs:
+                    if self._terminated:
+                        break
+                    dcm_dir = str(dcm_dir)
+                    previous = self.manifest.get_completed(dcm_dir, self.settings_fingerprint) if self.resume else None
+                    future = executor.submit(_process_dcm_dir, dcm_dir, previous)
+                    future2dir[future] = dcm_dir
+                    self._futures.append(future)
+                    future.add_done_callback(finished.put)
+                    # Report on the directories that finished while the remainder were still being submitted
+                    while True:
+                        try:
+                            done_future = finished.get_nowait()
+                        except Empty:
+                            break
+                        n_collected += 1
+                        result = self.collect_result(done_future, future2dir[done_future])
+                        if result is not None:
+                            yield result
+
+                while n_collected < len(future2dir):
+                    done_future = finished.get()
+                    n_collected += 1
+                    result = self.collect_result(done_future, future2dir[done_future])
+                    if result is not None:
+                        yield result
+            # If interrupted, or if the caller stops iterating over the results, the directories already being converted
+            # are allowed to finish but those still waiting in the queue are abandoned
+            except (KeyboardInterrupt, GeneratorExit):
+                self._terminated = True
+                executor.shutdown(wait=True, cancel_futures=True)
+                self._futures = []
+                raise
+        self._futures = []
+        try:
+            self.manifest.compact()
+        except OSError as manifest_err:
+            print(f"The import manifest {self.manifest.path} could not be compacted: {manifest_err}")
+
+    def collect_result(self, future: Future, dcm_dir: str) -> Optional[dict]:
+        """
+        Retrieves the result of a finished DICOM directory and records it in the import manifest
+        :param future: the finished future of the DICOM directory
+        :param dcm_dir: the DICOM directory
+        :return: the result, or None if the directory was cancelled before it began
+        """
+        if future.cancelled():
+            return None
+        try:
+            result = future.result()
+        # A worker process dying (i.e. out of memory) should be reported as a failure, not end the import
+        except Exception as pool_err:
+            return {"dcm_dir": dcm_dir,
+                    "success": False,
+                    "description": f"\nERROR_LISTING FOR DICOM DIRECTORY {dcm_dir}:\n\t"
+                                   f"Worker process failure: {pool_err}",
+                    "summary": None,
+                    "log": "",
+                    "timings": [],
+                    "skipped": False}
+        # Record the outcome as soon as it is known, such that an interrupted import can be resumed
+        if not result["skipped"]:
+            self.record_result(result)
+        return result
+
+    def record_result(self, result: dict):
+        """
+        Records the result of a single DICOM directory in the import manifest
+        :param result: the result of the DICOM directory, as returned by _process_dcm_dir
+        """
+        try:
+            self.manifest.record(result=result, settings_fingerprint=self.settings_fingerprint)
+        except OSError as manifest_err:
+            print(f"The import manifest {self.manifest.path} could not be updated: {manifest_err}")
+
+    def stop(self):
+        """
+        Requests that the engine stop. Directories currently being converted are allowed to finish; all directories
+        still waiting in the queue are cancelled.
+        """
+        self._terminated = True
+        for future in self._futures:
+            future.cancel()
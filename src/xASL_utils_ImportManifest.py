@@ -0,0 +1,174 @@
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+from datetime import datetime
+import hashlib
+import json
+import os
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the manifest of an import, which records the outcome of each DICOM directory as soon as it has
+# finished: its status, a fingerprint of its DICOM files, the output files produced alongside their checksums, and how
+# long it took. An interrupted import can then be resumed, skipping the DICOM directories that were already converted
+# with the same inputs and settings.
+# The manifest is an append-only journal of JSON lines (one per finished DICOM directory), such that recording a
+# directory never requires rewriting the records of the others. A record cut short by a crash is ignored when the
+# manifest is next loaded. The journal is compacted (atomically rewritten) once an import has finished.
+# Current Main Classes/Functions:
+#       - ImportManifest ; the manifest kept within the analysis directory
+#       - get_input_fingerprint ; summarizes the DICOM files of a directory by their names, sizes and modification times
+#       - get_settings_fingerprint ; summarizes the import settings that influence the converted output
+#       - get_file_checksum ; the SHA-256 checksum of an output file
+#       - describe_outputs ; the sizes and checksums of the output files of a conversion, as stored in the manifest
+########################################################################################################################
+
+MANIFEST_FILENAME = "Import_Manifest.jsonl"
+
+
+def get_input_fingerprint(dcm_dir: Union[str, Path]) -> str:
+    """
+    Summarizes the files of a DICOM directory without reading their contents
+    :param dcm_dir: the DICOM directory
+    :return: a hash of the names, sizes and modification times of the files within the directory
+    """
+    hasher = hashlib.sha256()
+    with os.scandir(dcm_dir) as entries:
+        file_stats = sorted((entry.name, stat.st_size, stat.st_mtime_ns)
+                            for entry in entries if entry.is_file() for stat in [entry.stat()])
+    for name, size, mtime_ns in file_stats:
+        hasher.update(f"{name}\0{size}\0{mtime_ns}\n".encode(errors="surrogateescape"))
+    return hasher.hexdigest()
+
+
+def get_settings_fingerprint(config: dict, use_legacy_mode: bool) -> str:
+    """
+    Summarizes the import settings which determine where and how each DICOM directory is converted
+    :param config: the import configuration (i.e. the contents of ImportConfig.json)
+    :param use_legacy_mode: whether the legacy (non-BIDS) import is used
+    :return: a hash of the relevant settings
+    """
+    relevant = {key: config.get(key) for key in ["RawDir", "Directory Structure", "Scan Aliases",
+                                                  "Ordered Run Aliases"]}
+    relevant["Legacy"] = use_legacy_mode
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def get_file_checksum(filepath: Union[str, Path], chunk_size: int = 2 ** 20) -> str:
+    """
+    Convenience function for getting the SHA-256 checksum of a file, reading it in chunks
+    """
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as reader:
+        for chunk in iter(lambda: reader.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _to_json_default(obj):
+    # numpy scalars (i.e. the zooms of a NIFTI) in the import summaries
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+class ImportManifest:
+    """
+    The manifest of the imports performed into a single analysis directory. Only the process driving the import
+    writes to it; the worker processes return their results to that process.
+    """
+
+    def __init__(self, analysis_dir: Union[str, Path], filename: str = MANIFEST_FILENAME):
+        """
+        :param analysis_dir: the analysis directory that the import writes to
+        :param filename: the name of the manifest file within the analysis directory
+        """
+        self.path: Path = Path(analysis_dir) / filename
+        self.records: Dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        """
+        (Re)loads the manifest from disk; later records of a DICOM directory take precedence over earlier ones
+        """
+        self.records.clear()
+        if not self.path.exists():
+            return
+        with open(self.path) as reader:
+            for line in reader:
+                try:
+                    record = json.loads(line)
+                    self.records[record["dcm_dir"]] = record
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+
+    def get_completed(self, dcm_dir: Union[str, Path], settings_fingerprint: str) -> Optional[dict]:
+        """
+        Retrieves the record of a DICOM directory if it was successfully converted using the same settings
+        :param dcm_dir: the DICOM directory
+        :param settings_fingerprint: the fingerprint of the current import settings
+        :return: the record, or None if the DICOM directory must be converted (again)
+        """
+        record = self.records.get(str(dcm_dir))
+        if record is None or record["status"] != "success" or record["settings_fingerprint"] != settings_fingerprint:
+            return None
+        return record
+
+    def record(self, result: dict, settings_fingerprint: str):
+        """
+        Appends the outcome of a single DICOM directory to the manifest
+        :param result: the result of the DICOM directory, as returned by the import engine
+        :param settings_fingerprint: the fingerprint of the current import settings
+        """
+        record = {"dcm_dir": result["dcm_dir"],
+                  "status": "success" if result["success"] else "failed",
+                  "finished": datetime.now().isoformat(timespec="seconds"),
+                  "settings_fingerprint": settings_fingerprint,
+                  "input_fingerprint": result.get("input_fingerprint"),
+                  "outputs": result.get("outputs", {}),
+                  "seconds": round(sum(timing["seconds"] for timing in result.get("timings", [])), 3),
+                  "summary": result["summary"],
+                  "description": result["description"]}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, default=_to_json_default) + "\n"
+        with open(self.path, "a") as writer:
+            writer.write(line)
+            writer.flush()
+            os.fsync(writer.fileno())
+        self.records[record["dcm_dir"]] = json.loads(line)
+
+    def compact(self):
+        """
+        Rewrites the manifest with only the latest record of each DICOM directory. The new manifest is written to a
+        temporary file which then replaces the old one, such that an interruption never leaves a partial manifest.
+        """
+        if len(self.records) == 0:
+            return
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as writer:
+            for record in self.records.values():
+                writer.write(json.dumps(record, default=_to_json_default) + "\n")
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def outputs_intact(outputs: Dict[str, dict]) -> bool:
+        """
+        Cheaply verifies that the output files of a previous conversion are still present and of the same size. The
+        JSON sidecars are only checked for their presence, as the steps following an import amend them.
+        :param outputs: a dict of output filepath to a dict with the keys "size" and "sha256"
+        """
+        return len(outputs) > 0 and all(Path(path).is_file() and
+                                        (path.endswith(".json") or Path(path).stat().st_size == output["size"])
+                                        for path, output in outputs.items())
+
+
+def describe_outputs(filepaths: Iterable[Union[str, Path]]) -> Dict[str, dict]:
+    """
+    Convenience function for describing the output files of a conversion, as stored in the manifest
+    :param filepaths: the output files
+    :return: a dict of output filepath to a dict with the keys "size" and "sha256"
+    """
+    return {str(filepath): {"size": Path(filepath).stat().st_size, "sha256": get_file_checksum(filepath)}
+            for filepath in filepaths if Path(filepath).is_file()}
@@ -0,0 +1,134 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+from datetime import datetime
+import pandas as pd
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the columnar accumulation of the import summary; the table of the key parameters of every
+# converted scan. Each worker process reduces the summary of a converted scan to a compact row of the fixed summary
+# columns (plus any extra fields requested through the "Summary Extra Fields" key of the import configuration) before
+# sending it back, rather than the full summary which includes the entire JSON sidecar. The rows are appended column
+# by column and only turned into a single dataframe once, at the end of the import.
+# Current Main Classes/Functions:
+#       - ImportSummaryAccumulator ; collects the compact rows and produces the final dataframe
+#       - compact_summary ; reduces the summary of a converted scan to a compact row
+#       - write_import_summary ; writes the final dataframe as TSV and, optionally, as Parquet
+########################################################################################################################
+
+SUMMARY_COLUMNS: List[str] = ['subject', 'visit', 'run', 'scan', 'dx', 'dy', 'dz', 'dt', 'nx', 'ny', 'nz', 'nt',
+                              "RepetitionTime", "EchoTime", "NumberOfAverages", "RescaleSlope", "RescaleIntercept",
+                              "MRScaleSlope", "AcquisitionTime",
+                              "AcquisitionMatrix", "TotalReadoutTime", "EffectiveEchoSpacing",
+                              "DCM2NIIXTime", "DCM2NIIXWaitTime"]
+
+
+def _to_plain(value):
+    # numpy scalars (i.e. the zooms of a NIFTI) are converted such that rows are small to pickle and JSON-serializable
+    if hasattr(value, "item") and not isinstance(value, (list, tuple, str)):
+        try:
+            return value.item()
+        except (TypeError, ValueError):
+            return value
+    return value
+
+
+def compact_summary(summary_data: dict, extra_fields: Iterable[str] = ()) -> dict:
+    """
+    Reduces the summary of a converted scan to a compact row
+    :param summary_data: the summary of the converted scan, as accumulated by the converter
+    :param extra_fields: the names of any fields beyond the fixed summary columns that should be kept
+    :return: a dict with the keys "values" (the values of the fixed summary columns, in order) and "extras" (a dict of
+    the extra fields that were present)
+    """
+    values = [_to_plain(summary_data.get("RepetitionTime" if column == "dt" else column))
+              for column in SUMMARY_COLUMNS]
+    extras = {field: _to_plain(summary_data[field]) for field in extra_fields if field in summary_data}
+    return {"values": values, "extras": extras}
+
+
+class ImportSummaryAccumulator:
+    """
+    Column-wise store of the compact rows of an import summary. Supports the list operations (extend, clear and len)
+    that callers previously used on lists of summary dicts.
+    """
+
+    def __init__(self, extra_fields: Iterable[str] = ()):
+        """
+        :param extra_fields: the names of any fields beyond the fixed summary columns to keep from full summaries
+        """
+        self.extra_fields: List[str] = list(extra_fields)
+        self.columns: Dict[str, list] = {column: [] for column in SUMMARY_COLUMNS}
+        self.extras: List[dict] = []
+
+    def __len__(self) -> int:
+        return len(self.extras)
+
+    def append(self, summary: dict):
+        """
+        Adds a single row
+        :param summary: either a compact row (see compact_summary) or the full summary of a converted scan
+        """
+        if summary.keys() != {"values", "extras"}:
+            summary = compact_summary(summary, self.extra_fields)
+        for column, value in zip(SUMMARY_COLUMNS, summary["values"]):
+            self.columns[column].append(value)
+        self.extras.append(summary["extras"])
+
+    def extend(self, summaries: Iterable[dict]):
+        for summary in summaries:
+            self.append(summary)
+
+    def clear(self):
+        for values in self.columns.values():
+            values.clear()
+        self.extras.clear()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Merges the accumulated rows into the final summary, sorted by scan, subject, visit and run
+        :return: the summary dataframe, with the fixed columns first and any extra fields after them
+        """
+        df = pd.DataFrame(self.columns, columns=SUMMARY_COLUMNS)
+        if any(len(extras) > 0 for extras in self.extras):
+            extras_df = pd.DataFrame(self.extras)
+            df = pd.concat([df, extras_df.drop(columns=[col for col in extras_df.columns if col in df.columns])],
+                           axis=1)
+        return df.sort_values(by=["scan", "subject", "visit", "run"]).reset_index(drop=True)
+
+
+def write_import_summary(summaries: ImportSummaryAccumulator, analysis_dir: Union[str, Path],
+                         write_parquet: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Writes the import summary to the analysis directory as a TSV file and, optionally, as a Parquet file
+    :param summaries: the accumulated summary rows
+    :param analysis_dir: the analysis directory
+    :param write_parquet: whether a Parquet file should also be written. Requires pyarrow or fastparquet.
+    :return: the summary dataframe, or None if there was nothing to summarize
+    """
+    if len(summaries) == 0:
+        print("No scans were imported; no import summary was created")
+        return None
+    df = summaries.to_dataframe()
+    analysis_dir = Path(analysis_dir)
+    now_str = datetime.now().strftime("%a-%b-%d-%Y %H-%M-%S")
+    try:
+        df.to_csv(analysis_dir / f"Import_Dataframe_{now_str}.tsv", sep='\t', index=False, na_rep='n/a')
+    except PermissionError:
+        df.to_csv(analysis_dir / f"Import_Dataframe_{now_str}_copy.tsv", sep='\t', index=False, na_rep='n/a')
+
+    if write_parquet:
+        # Parquet requires a single type per column; columns of mixed types (i.e. lists alongside missing values) are
+        # stored as their string representations
+        parquet_df = df.copy()
+        for column in parquet_df.columns:
+            if parquet_df[column].dtype == object:
+                parquet_df[column] = parquet_df[column].map(lambda value: None if value is None else str(value))
+        try:
+            parquet_df.to_parquet(analysis_dir / f"Import_Dataframe_{now_str}.parquet", index=False)
+        except ImportError as parquet_err:
+            print(f"The import summary could not be written as Parquet: {parquet_err}")
+        except PermissionError:
+            parquet_df.to_parquet(analysis_dir / f"Import_Dataframe_{now_str}_copy.parquet", index=False)
+    return df
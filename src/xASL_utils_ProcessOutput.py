@@ -0,0 +1,101 @@
+from queue import Queue, Empty
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+import codecs
+import os
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the reading of a running program's output without blocking on it. The stdout and stderr pipes
+# of the program are each read in large chunks by a background thread, which hands the chunks over through a queue.
+# The consumer waits on that queue with a timeout, such that it can react to other events (i.e. a request to
+# terminate) while the program is silent, and receives all the lines of a chunk at once rather than one line at a time.
+# Threads are used rather than selectors since pipes cannot be selected on under Windows.
+# Current Main Classes/Functions:
+#       - ProcessOutputReader ; reads the stdout and stderr of a process in chunks, returning them as complete lines
+########################################################################################################################
+
+
+class ProcessOutputReader:
+    """
+    Reads the stdout and stderr pipes of a process (opened in binary mode) in large chunks on background threads. The
+    chunks are decoded and split into complete lines; a partial line at the end of a chunk is held back until the
+    rest of it has been read.
+    """
+
+    def __init__(self, proc, chunk_size: int = 65536, encoding: str = "utf-8"):
+        """
+        :param proc: the process, whose stdout and stderr must be pipes opened in binary mode
+        :param chunk_size: the maximum number of bytes read from a pipe at once
+        :param encoding: the encoding of the program's output; undecodable bytes are replaced
+        """
+        self.chunk_size = chunk_size
+        self.chunks: Queue = Queue()
+        self.decoders: Dict[str, codecs.IncrementalDecoder] = {}
+        self.partial_lines: Dict[str, str] = {}
+        self.open_streams = set()
+        self.threads: List[Thread] = []
+        for stream_name, stream in (("stdout", proc.stdout), ("stderr", proc.stderr)):
+            if stream is None:
+                continue
+            self.decoders[stream_name] = codecs.getincrementaldecoder(encoding)(errors="replace")
+            self.partial_lines[stream_name] = ""
+            self.open_streams.add(stream_name)
+            thread = Thread(target=self._read_stream, args=(stream_name, stream.fileno()), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _read_stream(self, stream_name: str, fd: int):
+        try:
+            while True:
+                chunk = os.read(fd, self.chunk_size)
+                if not chunk:
+                    break
+                self.chunks.put((stream_name, chunk))
+        except OSError:  # The pipe was closed from under the thread
+            pass
+        self.chunks.put((stream_name, None))
+
+    @property
+    def at_eof(self) -> bool:
+        """
+        Whether every pipe has been read to its end and all of its lines have been returned
+        """
+        return len(self.open_streams) == 0 and self.chunks.empty()
+
+    def read_lines(self, timeout: Optional[float] = None) -> Dict[str, List[str]]:
+        """
+        Waits for output to arrive and then returns all of the complete lines that have arrived so far
+        :param timeout: the maximum number of seconds to wait for output. If None, waits until output arrives.
+        :return: a dict of the stream names ("stdout" and "stderr") to the lines (without their line endings) read from
+        them. Empty if no output arrived within the timeout. A partial line at the end of a pipe is returned once the
+        pipe has been read to its end.
+        """
+        received: List[Tuple[str, Optional[bytes]]] = []
+        try:
+            received.append(self.chunks.get(timeout=timeout))
+            while True:
+                received.append(self.chunks.get_nowait())
+        except Empty:
+            pass
+
+        texts: Dict[str, List[str]] = {}
+        for stream_name, chunk in received:
+            if chunk is None:
+                self.open_streams.discard(stream_name)
+                texts.setdefault(stream_name, []).append(self.decoders[stream_name].decode(b"", final=True))
+            else:
+                texts.setdefault(stream_name, []).append(self.decoders[stream_name].decode(chunk))
+
+        lines: Dict[str, List[str]] = {}
+        for stream_name, text_parts in texts.items():
+            stream_lines = (self.partial_lines[stream_name] + "".join(text_parts)).splitlines(keepends=True)
+            if stream_name in self.open_streams and len(stream_lines) > 0 and \
+                    not stream_lines[-1].endswith(("\n", "\r")):
+                self.partial_lines[stream_name] = stream_lines.pop()
+            else:
+                self.partial_lines[stream_name] = ""
+            if len(stream_lines) > 0:
+                lines[stream_name] = [line.rstrip("\r\n") for line in stream_lines]
+        return lines
@@ -0,0 +1,81 @@
+from src.xASL_utils_ImportManifest import ImportManifest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import json
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the batched handling of the JSON sidecars produced by an import. The sidecars are located
+# through the import manifest (see xASL_utils_ImportManifest) rather than by searching the whole analysis directory,
+# and are rewritten in a single parallel batch.
+# Current Main Classes/Functions:
+#       - get_imported_sidecars ; the JSON sidecars of a given BIDS suffix produced by the imports into a directory
+#       - pair_asl_m0_sidecars ; groups each M0 sidecar with the ASL sidecar of the same acquisition
+#       - rewrite_json_sidecars ; applies an update to many JSON sidecars in parallel
+########################################################################################################################
+
+
+def get_imported_sidecars(analysis_dir: Union[str, Path], suffix: str) -> List[Path]:
+    """
+    Retrieves the JSON sidecars with the given suffix that were successfully produced by imports into the analysis
+    directory. Falls back to searching the analysis directory if the import manifest is absent (i.e. for datasets
+    imported before the manifest was introduced) or none of its outputs exist (i.e. the study directory was moved).
+    :param analysis_dir: the analysis directory
+    :param suffix: the ending of the sidecar filenames (i.e. "_asl.json" or "_m0scan.json")
+    :return: the sorted filepaths of the sidecars that currently exist
+    """
+    analysis_dir = Path(analysis_dir)
+    outputs = [Path(output) for record in ImportManifest(analysis_dir).records.values()
+               if record["status"] == "success" for output in record["outputs"]]
+    if not any(output.exists() for output in outputs):
+        return sorted(analysis_dir.rglob(f"*{suffix}"))
+    return sorted({output for output in outputs if output.name.endswith(suffix) and output.exists()})
+
+
+def pair_asl_m0_sidecars(m0_sidecars: List[Path]) -> Dict[Path, Path]:
+    """
+    Groups each M0 sidecar with the ASL sidecar of the same subject, session and run
+    :param m0_sidecars: the M0 sidecars
+    :return: a dict of each M0 sidecar to its ASL sidecar; M0 sidecars without an ASL sidecar and NIFTI are left out
+    """
+    pairs = {}
+    for m0_sidecar in m0_sidecars:
+        asl_sidecar = m0_sidecar.with_name(m0_sidecar.name.replace("_m0scan.json", "_asl.json"))
+        if asl_sidecar.exists() and asl_sidecar.with_suffix(".nii").exists():
+            pairs[m0_sidecar] = asl_sidecar
+    return pairs
+
+
+def rewrite_json_sidecars(sidecars: List[Path], update: Callable[[Path, dict], bool],
+                          n_threads: int = None) -> Tuple[List[Path], List[Path]]:
+    """
+    Loads, updates and rewrites many JSON sidecars in parallel. Rewriting sidecars is mostly spent waiting on the
+    filesystem, hence threads rather than processes.
+    :param sidecars: the sidecars to rewrite
+    :param update: a function receiving the filepath and the loaded contents of a sidecar, which it modifies in place.
+    Returns False if the sidecar could not be updated as intended; the (partially) updated contents are still written.
+    :param n_threads: the number of threads to use. Defaults to that of ThreadPoolExecutor.
+    :return: the sidecars that could not be updated as intended, and separately, the sidecars that could not be read
+    or written
+    """
+    def rewrite(sidecar: Path) -> Optional[bool]:
+        try:
+            with open(sidecar) as sidecar_reader:
+                sidecar_data: dict = json.load(sidecar_reader)
+            success = update(sidecar, sidecar_data)
+            with open(sidecar, 'w') as sidecar_writer:
+                json.dump(sidecar_data, sidecar_writer, indent=3)
+        except (OSError, json.JSONDecodeError) as sidecar_err:
+            print(f"The JSON sidecar {sidecar} could not be rewritten: {sidecar_err}")
+            return None
+        return success
+
+    if len(sidecars) == 0:
+        return [], []
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        successes = list(executor.map(rewrite, sidecars))
+    update_failures = [sidecar for sidecar, success in zip(sidecars, successes) if success is False]
+    io_failures = [sidecar for sidecar, success in zip(sidecars, successes) if success is None]
+    return update_failures, io_failures
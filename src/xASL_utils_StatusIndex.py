@@ -0,0 +1,216 @@
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+import json
+import os
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the index of the STATUS files that ExploreASL has created within the lock dir of a study. The
+# index is built by a single scan of the lock tree and is afterwards kept up to date by whoever learns of STATUS
+# files being created or removed (i.e. the watchers of a run and the re-run setup), such that questions about which
+# STATUS files exist do not require the lock tree to be searched again.
+# The index may be persisted to the analysis directory alongside the modification time of every directory within the
+# lock tree. When a persisted index is loaded, only the directories whose modification times have since changed are
+# listed again.
+# Current Main Classes/Functions:
+#       - StatusIndex ; the index of the STATUS files of a single study
+#       - get_status_index ; the shared index of a study, created (and scanned) the first time it is requested
+########################################################################################################################
+
+STATUS_INDEX_FILENAME = "Status_Index.json"
+
+# Resolved analysis directory -> the shared index of that study
+_status_indices: Dict[Path, "StatusIndex"] = {}
+_status_indices_lock = Lock()
+
+
+class StatusIndex:
+    """
+    Index of the directories and STATUS files within the lock dir of a study. Paths are stored relative to the lock
+    dir, such that the index is unaffected by how the analysis directory was written out.
+    """
+
+    def __init__(self, analysis_dir: Union[str, Path]):
+        """
+        :param analysis_dir: the analysis directory of the study; its lock dir is not scanned until refresh is called
+        """
+        self.analysis_dir = Path(analysis_dir).resolve()
+        self.lock_dir = self.analysis_dir / "lock"
+        self.index_path = self.analysis_dir / STATUS_INDEX_FILENAME
+        # Relative directory (a tuple of its parts) -> its modification time, its subdirectories, its STATUS files
+        self.dirs: Dict[Tuple[str, ...], Dict[str, Union[int, Set[str]]]] = {}
+        self.lock = Lock()
+
+    def _relative_parts(self, path: Union[str, Path]) -> Optional[Tuple[str, ...]]:
+        path = Path(path)
+        try:
+            return path.relative_to(self.lock_dir).parts
+        except ValueError:
+            pass
+        # The path may have been written out differently (i.e. through a symlink or without being resolved)
+        try:
+            return path.resolve().relative_to(self.lock_dir).parts
+        except (ValueError, OSError):
+            return None
+
+    def _scan_dir(self, rel_dir: Tuple[str, ...]) -> List[Tuple[str, ...]]:
+        # Lists a single directory of the lock tree; returns its subdirectories that are not yet known to the index
+        directory = self.lock_dir.joinpath(*rel_dir)
+        subdirs, status_files = set(), set()
+        try:
+            mtime = directory.stat().st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            subdirs.add(entry.name)
+                        elif entry.name.endswith(".status"):
+                            status_files.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            self._forget_dir(rel_dir)
+            return []
+        previous = self.dirs.get(rel_dir)
+        for removed_subdir in (previous["subdirs"] - subdirs) if previous is not None else ():
+            self._forget_dir(rel_dir + (removed_subdir,))
+        self.dirs[rel_dir] = {"mtime_ns": mtime, "subdirs": subdirs, "status": status_files}
+        return [rel_dir + (subdir,) for subdir in subdirs if rel_dir + (subdir,) not in self.dirs]
+
+    def _forget_dir(self, rel_dir: Tuple[str, ...]):
+        self.dirs = {known: entry for known, entry in self.dirs.items() if known[:len(rel_dir)] != rel_dir}
+
+    def refresh(self):
+        """
+        Brings the index up to date with the lock tree. Directories already in the index are only listed again if
+        their modification time has changed; directories new to the index are always listed.
+        """
+        with self.lock:
+            to_scan: List[Tuple[str, ...]] = []
+            for rel_dir, entry in list(self.dirs.items()):
+                if rel_dir not in self.dirs:  # Forgotten along with a removed parent directory
+                    continue
+                try:
+                    is_stale = self.lock_dir.joinpath(*rel_dir).stat().st_mtime_ns != entry["mtime_ns"]
+                except OSError:
+                    is_stale = True
+                if is_stale:
+                    to_scan.append(rel_dir)
+            if () not in self.dirs:
+                to_scan.append(())
+            while len(to_scan) > 0:
+                to_scan.extend(self._scan_dir(to_scan.pop()))
+
+    def add(self, status_path: Union[str, Path]):
+        """
+        Records that a STATUS file was created
+        """
+        rel_parts = self._relative_parts(status_path)
+        if rel_parts is None or len(rel_parts) == 0:
+            return
+        with self.lock:
+            # Parent directories created since the last refresh are recorded without a modification time, such that
+            # the next refresh lists them
+            for depth in range(len(rel_parts)):
+                rel_dir = rel_parts[:depth]
+                entry = self.dirs.setdefault(rel_dir, {"mtime_ns": -1, "subdirs": set(), "status": set()})
+                if depth < len(rel_parts) - 1:
+                    entry["subdirs"].add(rel_parts[depth])
+            self.dirs[rel_parts[:-1]]["status"].add(rel_parts[-1])
+
+    def discard(self, status_path: Union[str, Path]):
+        """
+        Records that a STATUS file was removed
+        """
+        rel_parts = self._relative_parts(status_path)
+        if rel_parts is None or len(rel_parts) == 0:
+            return
+        with self.lock:
+            entry = self.dirs.get(rel_parts[:-1])
+            if entry is not None:
+                entry["status"].discard(rel_parts[-1])
+
+    def __contains__(self, status_path: Union[str, Path]) -> bool:
+        rel_parts = self._relative_parts(status_path)
+        if rel_parts is None or len(rel_parts) == 0:
+            return False
+        with self.lock:
+            entry = self.dirs.get(rel_parts[:-1])
+            return entry is not None and rel_parts[-1] in entry["status"]
+
+    def get_missing(self, expected_status_files: Iterable[Union[str, Path]]) -> List[Path]:
+        """
+        :param expected_status_files: the STATUS files that should exist
+        :return: those among them that are not in the index, in the same order
+        """
+        return [Path(status_file) for status_file in expected_status_files if status_file not in self]
+
+    def get_tree(self) -> dict:
+        """
+        :return: the lock tree as nested dicts, whose keys are the names of directories (with a dict value) and
+        STATUS files (with a None value), sorted by name
+        """
+        def build(rel_dir: Tuple[str, ...]) -> dict:
+            entry = self.dirs.get(rel_dir, {"subdirs": set(), "status": set()})
+            names = {name: None for name in entry["status"]}
+            names.update({name: build(rel_dir + (name,)) for name in entry["subdirs"]})
+            return {name: names[name] for name in sorted(names)}
+
+        with self.lock:
+            return build(())
+
+    def load(self) -> bool:
+        """
+        Loads the persisted index, if any; it should be refreshed afterwards to account for changes since it was saved
+        :return: whether a persisted index was loaded
+        """
+        try:
+            with open(self.index_path) as index_reader:
+                persisted: dict = json.load(index_reader)
+            dirs = {tuple(entry["dir"]): {"mtime_ns": entry["mtime_ns"], "subdirs": set(entry["subdirs"]),
+                                          "status": set(entry["status"])}
+                    for entry in persisted["dirs"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self.lock:
+            self.dirs = dirs
+        return True
+
+    def save(self):
+        """
+        Persists the index to the analysis directory; written to a temporary file first so that it is never truncated
+        """
+        with self.lock:
+            persisted = {"dirs": [{"dir": list(rel_dir), "mtime_ns": entry["mtime_ns"],
+                                   "subdirs": sorted(entry["subdirs"]), "status": sorted(entry["status"])}
+                                  for rel_dir, entry in sorted(self.dirs.items())]}
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w") as index_writer:
+                json.dump(persisted, index_writer)
+            os.replace(tmp_path, self.index_path)
+        except OSError as index_err:
+            print(f"The STATUS file index of {self.analysis_dir} could not be saved: {index_err}")
+
+
+def get_status_index(analysis_dir: Union[str, Path], refresh: bool = False) -> StatusIndex:
+    """
+    Retrieves the index shared by everything concerning a study. The first time the index of a study is requested, it
+    is loaded from its persisted form (if present) and brought up to date with the lock tree.
+    :param analysis_dir: the analysis directory of the study
+    :param refresh: whether an index that already exists should be brought up to date with the lock tree as well
+    :return: the index of the study
+    """
+    analysis_dir = Path(analysis_dir).resolve()
+    with _status_indices_lock:
+        index = _status_indices.get(analysis_dir)
+        is_new = index is None
+        if is_new:
+            index = _status_indices[analysis_dir] = StatusIndex(analysis_dir)
+    if is_new:
+        index.load()
+    if is_new or refresh:
+        index.refresh()
+    return index
@@ -0,0 +1,108 @@
+from pathlib import Path
+from threading import Lock
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+import os
+import re
+
+
+########################################################################################################################
+# PREFACE
+# This module contains the resolution of the version of an ExploreASL installation, which is recorded by the name of
+# a VERSION_x.y.z file. An installation also holds SPM, CAT12 and the atlases (tens of thousands of files), so the
+# known locations of the VERSION file are checked before resorting to a recursive search, and the result is cached per
+# installation directory for as long as the modification time of that directory and the VERSION file found are
+# unchanged. Versions are returned as structured objects that compare component by component.
+# Current Main Classes/Functions:
+#       - ExploreASLVersion ; a major.minor.patch version that can be compared against other versions
+#       - get_exploreasl_version ; the (cached) version of an ExploreASL directory
+#       - is_version_before ; whether a version is earlier than a threshold, treating an unknown version as earliest
+########################################################################################################################
+
+_VERSION_FILE_REGEX = re.compile(r"^VERSION_(\d+)(?:\.(\d+))?(?:\.(\d+))?")
+
+# Resolved ExploreASL directory -> (its modification time, the VERSION file found, the version)
+_version_cache: Dict[Path, Tuple[int, Optional[Path], Optional["ExploreASLVersion"]]] = {}
+_version_cache_lock = Lock()
+
+
+class ExploreASLVersion(NamedTuple):
+    major: int
+    minor: int = 0
+    patch: int = 0
+
+    @classmethod
+    def from_filename(cls, filename: str) -> Optional["ExploreASLVersion"]:
+        """
+        :param filename: the name of a VERSION file (i.e. "VERSION_1.5.0")
+        :return: the version, or None if the name is not that of a VERSION file
+        """
+        match = _VERSION_FILE_REGEX.search(filename)
+        if match is None:
+            return None
+        return cls(*(int(component) for component in match.groups() if component is not None))
+
+    @classmethod
+    def from_legacy_int(cls, legacy_version: int) -> "ExploreASLVersion":
+        """
+        Converts the integer representation formerly used for version thresholds (i.e. 140 for 1.4.0)
+        """
+        return cls(*(int(digit) for digit in str(legacy_version).zfill(3)[:3]))
+
+    def __str__(self):
+        return f"{self.major}.{self.minor}.{self.patch}"
+
+
+def _find_version_file(easl_dir: Path) -> Optional[Path]:
+    # The VERSION file is at the top level of an uncompiled installation and one level down within a compiled one
+    for pattern in ("VERSION_*", "*/VERSION_*"):
+        for candidate in sorted(easl_dir.glob(pattern)):
+            if ExploreASLVersion.from_filename(candidate.name) is not None:
+                return candidate
+    # Fall back to searching the whole installation, without descending into its directories more than once
+    for root, dir_names, filenames in os.walk(easl_dir):
+        dir_names.sort()
+        for filename in sorted(filenames):
+            if ExploreASLVersion.from_filename(filename) is not None:
+                return Path(root) / filename
+    return None
+
+
+def get_exploreasl_version(easl_dir: Union[Path, str]) -> Optional[ExploreASLVersion]:
+    """
+    Determines the version of an ExploreASL installation from its VERSION file. Results are cached, such that repeated
+    calls for an unchanged installation cost two stat calls.
+    :param easl_dir: the ExploreASL directory (either the uncompiled source or the compiled program)
+    :return: the version, or None if the directory does not exist or its version cannot be ascertained
+    """
+    try:
+        easl_dir = Path(easl_dir).resolve()
+        dir_mtime = easl_dir.stat().st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+    with _version_cache_lock:
+        cached = _version_cache.get(easl_dir)
+    if cached is not None:
+        cached_mtime, cached_file, cached_version = cached
+        if cached_mtime == dir_mtime and (cached_file is None or cached_file.exists()):
+            return cached_version
+
+    version_file = _find_version_file(easl_dir)
+    version = None if version_file is None else ExploreASLVersion.from_filename(version_file.name)
+    with _version_cache_lock:
+        _version_cache[easl_dir] = (dir_mtime, version_file, version)
+    return version
+
+
+def is_version_before(version: Optional[ExploreASLVersion], threshold: ExploreASLVersion,
+                      inclusive: bool = False) -> bool:
+    """
+    :param version: the version to compare; None if it could not be ascertained
+    :param threshold: the version to compare against
+    :param inclusive: whether a version equal to the threshold also counts as before it
+    :return: whether the version is earlier than the threshold. A version that could not be ascertained is regarded
+    as the earliest possible version.
+    """
+    if version is None:
+        return True
+    return version <= threshold if inclusive else version < threshold